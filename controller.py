@@ -16,24 +16,31 @@ import tkinter as tk
 from tkinter import ttk
 from tkinter import messagebox
 from tkinter import filedialog
+from tkinter import simpledialog
 
 # Import system packages
 import os
 import sys
-
-# Import misc packages
-import webbrowser
-import markdown
+import queue
+import functools
+import threading
+import multiprocessing
+from datetime import datetime
 
 # Import custom modules
 from models import dbmodel
 from models import filtermodel
+from models import filterexpr
 from models import audio_dict
+from models import audiosearch
+from models import schema
 from views import treeview as tv
 from views import filterview as fv
 from views import browseview as bv
 from menus import mainmenu as menu_main
 from models.constants import FieldTypes as FT
+from models.constants import DB_FILETYPES
+from models.predicates import PredicateError
 
 
 #########
@@ -76,18 +83,19 @@ class App(tk.Tk):
         # Create filter model
         self.filtermodel = filtermodel.FilterList()
 
-        # Load in sample database at start
-        # If running from compiled, look in compiled temporary location
-        print('Looking for startup database in temporary location')
-        db_path = self.resource_path('sample_data.csv')
-        file_exists = os.access(db_path, os.F_OK)
-        if not file_exists:
-            print('Not found!')
-            print('Checking local script version location for database')
-            self.db = dbmodel.SubDB(".\\assets\\sample_data.csv")
-        else:
-            self.db = dbmodel.SubDB(db_path)
-            
+        # Start with an empty database: the sample database
+        # is loaded in the background once the window is up
+        self.db = dbmodel.SubDB()
+
+        # Background database loading
+        self._loader = None
+
+        # Cancel flag of the running match count preview
+        self._preview_cancel = None
+
+        # Subject shown in the Browse tab
+        self._selected_subject = None
+        
         # Load in dict fields for displaying records
         self.dbmodel = dbmodel.DataModel()
         fields = self.dbmodel.fields
@@ -126,6 +134,7 @@ class App(tk.Tk):
             # File menu
             '<<FileImportFullDB>>': lambda _: self._import_full(),
             '<<FileImportFilteredDB>>': lambda _: self._import_filtered(),
+            '<<FileImportDelta>>': lambda _: self._import_delta(),
             '<<FileExportDB>>': lambda _: self._export_db(),
             '<<FileImportList>>': lambda _: self._import_filter_list(),
             '<<FileExportList>>': lambda _: self._export_filter_list(),
@@ -133,12 +142,28 @@ class App(tk.Tk):
 
             # Tools menu
             '<<ToolsReset>>': lambda _: self._reset_filters(),
+            '<<ToolsUndoFilter>>': lambda _: self._undo_filter(),
+            '<<ToolsRedoFilter>>': lambda _: self._redo_filter(),
+            '<<ToolsRemoveFilter>>': lambda _: self._remove_filter(),
+            '<<ToolsCacheStats>>': lambda _: self._show_cache_stats(),
+            '<<ToolsClearCache>>': lambda _: self._clear_cache(),
+            '<<ToolsRefDate>>': lambda _: self._set_reference_date(),
 
             # Help menu
             '<<Help>>': lambda _: self._show_help(),
 
             # Filter view
             '<<Filter>>': lambda _: self._on_filter(),
+            '<<FilterTemplate>>': lambda _: self._filter_template(),
+            '<<FilterExpression>>': lambda _: self._filter_expression(),
+            '<<FilterPreview>>': lambda _: self._preview_counts(),
+            '<<CancelLoad>>': lambda _: self._cancel_load(),
+
+            # Browse view
+            '<<BrowseSimilar>>': lambda _: self._find_similar(),
+            '<<SimilarSelected>>': lambda _: self._show_similar_subject(),
+            '<<BrowseFind>>': lambda _: self._find_subject(),
+            '<<FoundSelected>>': lambda _: self._show_found_subject(),
         }
 
         # Bind callbacks to sequences
@@ -154,6 +179,19 @@ class App(tk.Tk):
         self.create_browse_frame(self.db, self.dbmodel)
         self.center_window()
 
+        # Load in sample database at start
+        # If running from compiled, look in compiled temporary location
+        print('Looking for startup database in temporary location')
+        db_path = self.resource_path('sample_data.csv')
+        file_exists = os.access(db_path, os.F_OK)
+        if not file_exists:
+            print('Not found!')
+            print('Checking local script version location for database')
+            db_path = ".\\assets\\sample_data.csv"
+        # Start loading once the window has been drawn
+        self.after_idle(self._load_in_background, self.db.read_db, 
+            db_path, self._sample_loaded)
+
 
     #####################
     # General Functions #
@@ -191,24 +229,46 @@ class App(tk.Tk):
             imported)
         """
         # Query user for database .csv file
-        filename = filedialog.askopenfilename()
+        filename = filedialog.askopenfilename(
+            filetypes=DB_FILETYPES)
 
         # Do nothing if cancelled
         if not filename:
             return
 
-        # If a valid filename is found, load it
-        self.db.load_db(filename)
+        scrub = self.filter_frame.scrub_var.get() == 1
+        if scrub and self.db.stream_scrub(filename):
+            # Stream large databases, removing junk records as 
+            # they are read
+            self._load_in_background(self.db.read_db, filename,
+                self._full_loaded, scrub_dict=self.db.scrub_dict)
+        else:
+            # If a valid filename is found, load it (the scrub is
+            # applied afterwards as filter steps that can be undone)
+            self._load_in_background(self.db.read_db, filename, 
+                functools.partial(self._full_loaded, scrub=scrub))
+
+
+    def _full_loaded(self, data, scrub=False):
+        """ Display FULL database once loaded in the background.
+            If scrub, junk records are removed with filter steps.
+        """
+        self.db.set_data(data)
+        if scrub:
+            self.db.scrub()
 
-        if self.filter_frame.scrub_var.get() == 1:
-            # Remove junk records
+        if self.db.scrub_counts:
+            # Show junk record removal
             self._initial_scrub()
         else:
             # Clear any previous output from textbox
             self.filter_frame.txt_output.delete('1.0', tk.END)
             # Show total record count
             self.filter_frame.txt_output.insert(tk.END,
-                f"Candidates before filtering: {str(self.db.data.shape[0])}\n\n")
+                f"Candidates before filtering: {str(self.db.count)}\n\n")
+
+        # Show memory used by database
+        self._show_memory()
 
         # Reload the treeview with imported database
         self.sub_tree._load_tree()
@@ -219,20 +279,101 @@ class App(tk.Tk):
             (i.e., an file exported from this app)
         """
         # Query user for database .csv file
-        filename = filedialog.askopenfilename()
+        filename = filedialog.askopenfilename(
+            filetypes=DB_FILETYPES)
         # Do nothing if cancelled
         if not filename:
             return
         # If a valid filename is found, load it
-        self.db.load_filtered_db(filename)
+        self._load_in_background(self.db.read_filtered_db, filename,
+            self._filtered_loaded)
+
+
+    def _filtered_loaded(self, data):
+        """ Display previously-imported database once loaded in 
+            the background
+        """
+        self.db.set_data(data)
+        # Show record count and memory used by database
+        self.filter_frame.txt_output.delete('1.0', tk.END)
+        self.filter_frame.txt_output.insert(tk.END,
+            f"Candidates before filtering: {str(self.db.count)}\n\n")
+        self._show_memory()
         # Reload the treeview with imported database
         self.sub_tree._load_tree()
 
 
+    def _import_delta(self):
+        """ Load a new FULL database export, re-processing only the
+            records that changed since the last import
+        """
+        # Query user for database .csv file
+        filename = filedialog.askopenfilename(
+            filetypes=DB_FILETYPES)
+        # Do nothing if cancelled
+        if not filename:
+            return
+
+        scrub = self.filter_frame.scrub_var.get() == 1
+        if scrub and self.db.stream_scrub(filename):
+            self._load_in_background(self.db.read_delta, filename,
+                self._delta_loaded, scrub_dict=self.db.scrub_dict)
+        else:
+            self._load_in_background(self.db.read_delta, filename,
+                functools.partial(self._delta_loaded, scrub=scrub))
+
+
+    def _delta_loaded(self, data, scrub=False):
+        """ Display updated database once loaded in the background.
+            If scrub, junk records are removed with filter steps.
+        """
+        self.db.set_data(data)
+        if scrub:
+            self.db.scrub()
+
+        if self.db.scrub_counts:
+            # Show junk record removal
+            self._initial_scrub()
+        else:
+            self.filter_frame.txt_output.delete('1.0', tk.END)
+            self.filter_frame.txt_output.insert(tk.END,
+                f"Candidates before filtering: {str(self.db.count)}\n\n")
+
+        # Show changes since last import
+        counts = self.db.delta_counts
+        self.filter_frame.txt_output.insert(tk.END,
+            f"Inserted: {counts['inserted']}, " +
+            f"Updated: {counts['updated']}, " +
+            f"Deleted: {counts['deleted']}\n\n")
+
+        self._show_memory()
+        # Reload the treeview with updated database
+        self.sub_tree._load_tree()
+
+
+    def _show_memory(self):
+        """ Display memory used by the database, and memory saved
+            by compact column types
+        """
+        used = self.db.engine.base.memory_usage(deep=True).sum() / 1e6
+        saved = self.db.memory_saved / 1e6
+        self.filter_frame.txt_output.insert(tk.END,
+            f"Database memory: {used:.1f} MB " +
+            f"(compact column types saved {saved:.1f} MB)\n\n")
+
+
     def _export_db(self):
         """ Write current database object to .csv file
         """
-        self.db.write()
+        # Personal and medical details are left out unless requested
+        include_private = messagebox.askyesno(
+            title="Export Private Fields",
+            message="Include " + ", ".join(schema.private_cols) +
+                " in the exported file?",
+            detail="Exported files are often shared. These fields are " +
+                "not needed to re-import the file.",
+            default=messagebox.NO)
+        self.db.write(include_private=include_private)
 
 
     def _import_filter_list(self):
@@ -241,13 +382,23 @@ class App(tk.Tk):
         """
         # Get updated filter values dict
         self.filter_dict = self.filtermodel.import_filter_dict()
-        self._filter(self.filter_dict)
+        if self.filter_dict is None:
+            # Cancelled
+            return
+        expression = self.filtermodel.expression
+        if self.filter_dict or not expression:
+            self._filter(self.filter_dict)
+        if expression:
+            self.filter_frame.expression_var.set(expression)
+            self._filter_expression()
 
 
     def _export_filter_list(self):
-        """ Write filterview combobox values to .csv file
+        """ Write filterview combobox values and filter expression
+            to .csv file
         """
-        self.filtermodel.export_filters(self.filter_frame.filter_dict)
+        self.filtermodel.export_filters(self.filter_frame.filter_values,
+            self.filter_frame.expression_var.get().strip())
 
 
     def _quit(self):
@@ -257,24 +408,113 @@ class App(tk.Tk):
 
 
     def _initial_scrub(self):
-        """ Perform perfunctory junk record removal
+        """ Report perfunctory junk record removal performed
+            while the database was streamed in
         """
         # Clear any previous output from textbox
         self.filter_frame.txt_output.delete('1.0', tk.END)
         # Provide feedback
         self.filter_frame.txt_output.insert(tk.END, 
                 f"Loaded database records\n" +
-                f"Remaining Candidates: {str(self.db.data.shape[0])}\n\n")
-        # Create dictionary of filtering values
-        scrub_dict = {
-            1: ("Status", "contains", ["-", "Active"]),
-            2: ("Good Candidate", "does not equal", "Poor"),
-            3: ("Employment Status", "does not equal", "Employee"),
-            4: ("Miles From Starkey", "<=", "60")
-        }
-        # Call filtering function
-        self._filter(scrub_dict)
-        # Update tree widget after filtering
+                f"Remaining Candidates: {str(self.db.scrub_counts[0])}\n\n")
+        # Show remaining records after each scrub step
+        for (colname, operator, value), count in zip(
+            self.db.scrub_dict.values(), self.db.scrub_counts[1:]):
+            self.filter_frame.txt_output.insert(tk.END, 
+                f"Filtering by: {colname} {operator} {value}...\n" +
+                f"Remaining Candidates: {str(count)}\n\n")
+
+
+    #############################
+    # Background Load Functions #
+    #############################
+    def _load_in_background(self, read_func, filename, on_done, 
+        **kwargs):
+        """ Call database read function on a worker thread. Progress
+            is passed back through a queue and shown in the Filter 
+            tab output. When finished, on_done is called with the 
+            new frame on the main thread.
+        """
+        if (self._loader is not None) and self._loader.is_alive():
+            messagebox.showwarning(title="Import In Progress",
+                message="A database is already being loaded!",
+                detail="Wait for it to finish, or cancel it first.")
+            return
+
+        load_queue = queue.Queue()
+        cancel = threading.Event()
+
+        def progress(stage, rows):
+            load_queue.put(('progress', stage, rows))
+
+        def worker():
+            try:
+                data = read_func(filename, progress=progress, 
+                    cancel=cancel, **kwargs)
+                load_queue.put(('done', data))
+            except dbmodel.LoadCancelled as e:
+                load_queue.put(('cancelled', e))
+            except Exception as e:
+                load_queue.put(('error', e))
+
+        self._cancel_event = cancel
+        self._loader = threading.Thread(target=worker, daemon=True)
+        self._loader.start()
+        self.filter_frame.set_loading(True)
+        self._poll_load(load_queue, os.path.basename(filename), on_done)
+
+
+    def _poll_load(self, load_queue, name, on_done):
+        """ Show load progress and finish the load when done
+        """
+        try:
+            while True:
+                msg = load_queue.get_nowait()
+                if msg[0] == 'progress':
+                    _, stage, rows = msg
+                    self.filter_frame.txt_output.delete('1.0', tk.END)
+                    self.filter_frame.txt_output.insert(tk.END,
+                        f"Loading {name}...\n{stage}" + 
+                        (f": {rows:,} rows" if rows is not None else "") +
+                        "\n")
+                    continue
+
+                # Load finished
+                self.filter_frame.set_loading(False)
+                if msg[0] == 'done':
+                    on_done(msg[1])
+                elif msg[0] == 'cancelled':
+                    print(msg[1])
+                    self.filter_frame.txt_output.delete('1.0', tk.END)
+                    self.filter_frame.txt_output.insert(tk.END,
+                        f"Loading {name} cancelled. The previously " +
+                        "loaded database has been kept.\n\n")
+                else:
+                    print(msg[1])
+                    self.filter_frame.txt_output.delete('1.0', tk.END)
+                    messagebox.showerror(title="Import Error",
+                        message="Cannot import this database file!",
+                        detail=f"{msg[1]}\n\nThe previously loaded " +
+                            "database has been kept.")
+                return
+        except queue.Empty:
+            pass
+        self.after(100, self._poll_load, load_queue, name, on_done)
+
+
+    def _cancel_load(self):
+        """ Ask background load to stop at the next chunk
+        """
+        if (self._loader is not None) and self._loader.is_alive():
+            self._cancel_event.set()
+            self.filter_frame.txt_output.insert(tk.END, "Cancelling...\n")
+
+
+    def _sample_loaded(self, data):
+        """ Display sample database once loaded in the background
+        """
+        self.db.set_data(data)
+        self.filter_frame.txt_output.delete('1.0', tk.END)
         self.sub_tree._load_tree()
 
 
@@ -282,7 +522,123 @@ class App(tk.Tk):
     # Tools Menu Functions #
     ########################
     def _reset_filters(self):
+        """ Clear the filter rows and expression, and remove their
+            filter steps
+        """
+        # Drop counts still being made for the old rows
+        if self._preview_cancel is not None:
+            self._preview_cancel.set()
         self.filter_frame._clear_filters()
+        self.db.clear_grid()
+        self._show_filter_steps()
+
+
+    def _undo_filter(self):
+        """ Undo the last change to the filter steps
+        """
+        if self.db.undo_filter():
+            self._show_filter_steps()
+
+
+    def _redo_filter(self):
+        """ Redo the last undone change to the filter steps
+        """
+        if self.db.redo_filter():
+            self._show_filter_steps()
+
+
+    def _remove_filter(self):
+        """ Query user for a filter step number and remove it,
+            keeping the other steps
+        """
+        steps = self.db.filter_steps()
+        if not steps:
+            messagebox.showwarning(title="No Filters Found",
+                message="No filters have been applied!")
+            return
+
+        listing = "\n".join(f"{ii}. {label}" 
+            for ii, (label, _) in enumerate(steps, start=1))
+        number = simpledialog.askinteger(title="Remove Filter",
+            prompt=f"Filter number to remove:\n\n{listing}\n",
+            minvalue=1, maxvalue=len(steps), parent=self)
+        # Do nothing if cancelled
+        if number is None:
+            return
+
+        self.db.remove_filter(number - 1)
+        self._show_filter_steps()
+
+
+    def _show_cache_stats(self):
+        """ Display filter result cache hits and misses
+        """
+        stats = self.db.filter_cache.stats()
+        messagebox.showinfo(title="Filter Cache Statistics",
+            message=f"Hits: {stats['hits']}\n" +
+                f"Misses: {stats['misses']}\n" +
+                f"Hit rate: {stats['hit_rate']:.0%}\n" +
+                f"Cached results: {stats['entries']}")
+
+
+    def _clear_cache(self):
+        """ Delete the on-disk copies of imported exports (which
+            hold subject records) after confirming with the user
+        """
+        if not messagebox.askyesno(title="Clear Database Cache",
+            message="Delete all cached database imports?",
+            detail="The next import reads the whole export again, " +
+                "and the next incremental import starts over."):
+            return
+        removed = self.db.cache.clear()
+        print(f"Removed {removed} cache files")
+        messagebox.showinfo(title="Clear Database Cache",
+            message=f"Removed {removed} cached files.")
+
+
+    def _show_filter_steps(self):
+        """ Display the active filter steps with the remaining
+            record count after each, and update the tree
+        """
+        self.filter_frame.txt_output.delete('1.0', tk.END)
+        self.filter_frame.txt_output.insert(tk.END,
+            f"Candidates before filtering: {self.db.engine.base.shape[0]}\n\n")
+        for ii, (label, count) in enumerate(self.db.filter_steps(), 
+            start=1):
+            self.filter_frame.txt_output.insert(tk.END, 
+                f"{ii}. Filtering by: {label}...\n" +
+                f"Remaining Candidates: {count}\n\n")
+        self.sub_tree._load_tree()
+
+
+    def _set_reference_date(self):
+        """ Query user for the date ages are calculated on, 
+            allowing previous recruiting runs to be reproduced
+        """
+        date_str = simpledialog.askstring(title="Age Reference Date",
+            prompt="Calculate ages as of (MM/DD/YYYY).\n" +
+                "Leave blank to use today's date.")
+        # Do nothing if cancelled
+        if date_str is None:
+            return
+
+        if not date_str.strip():
+            reference_date = None
+        else:
+            try:
+                reference_date = datetime.strptime(date_str.strip(), 
+                    '%m/%d/%Y')
+            except ValueError:
+                messagebox.showerror(title="Invalid Date",
+                    message=f"Cannot read date: {date_str}",
+                    detail="Please enter the date as MM/DD/YYYY.")
+                return
+
+        self.db.set_reference_date(reference_date)
+        # Active filter steps were re-evaluated with the new ages
+        self._show_filter_steps()
+        self.filter_frame.txt_output.insert(tk.END,
+            f"Ages calculated as of {date_str.strip() or 'today'}\n\n")
 
 
     #######################
@@ -291,6 +647,10 @@ class App(tk.Tk):
     def _show_help(self):
         """ Create html help file and display in default browser
         """
+        # Imported on first use to keep startup fast
+        import webbrowser
+        import markdown
+
         print('Looking for help file in compiled version temp location...')
         help_file = self.resource_path('README\\README.html')
         file_exists = os.access(help_file, os.F_OK)
@@ -329,13 +689,19 @@ class App(tk.Tk):
         """
         # Update local filter dict with values from filterview
         self.filter_dict = self.filter_frame.filter_dict
-        # Call filter func using updated filter dict
-        self._filter(self.filter_dict)
+        # Call filter func using updated filter dict: only rows
+        # that changed since the last run are re-evaluated
+        self._filter(self.filter_dict, refine=True)
 
 
-    def _filter(self, filter_val_dict):
+    def _filter(self, filter_val_dict, refine=False):
         """ Call filter method of dbmodel to subset database.
             Update tree widget after filtering. 
+
+            If refine, the filters are the rows of the filter grid
+            and replace the previous grid result (see 
+            SubDB.filter_rows); otherwise they are added as a new 
+            filter step (see SubDB.filter_all).
         """
         if not filter_val_dict:
             messagebox.showwarning(title="No Filters Found",
@@ -353,34 +719,121 @@ class App(tk.Tk):
         # Clear any previous output from textbox
         self.filter_frame.txt_output.delete('1.0', tk.END)
 
-        # Remind user what the previous record count was
-        self.filter_frame.txt_output.insert(tk.END,
-            f"Candidates before filtering: {str(self.db.data.shape[0])}\n\n")
-
         try:
-            for val in filter_val_dict:
-                self.db.filter(
-                    filter_val_dict[val][0],
-                    filter_val_dict[val][1],
-                    filter_val_dict[val][2]
-                )
+            predicates = [filter_val_dict[x] 
+                for x in sorted(filter_val_dict)]
+            if refine:
+                before, steps = self.db.filter_rows(predicates)
+            else:
+                # Filters are evaluated (and reported) in the 
+                # order chosen by the query planner
+                before = self.db.count
+                steps = self.db.filter_all(predicates)
+
+            # Remind user what the previous record count was
+            self.filter_frame.txt_output.insert(tk.END,
+                f"Candidates before filtering: {str(before)}\n\n")
+            for (colname, operator, value), count in steps:
                 self.filter_frame.txt_output.insert(tk.END, 
-                    f"Filtering by: {filter_val_dict[val][0]} " +
-                    f"{filter_val_dict[val][1]} {filter_val_dict[val][2]}...\n" +
-                    f"Remaining Candidates: {str(self.db.data.shape[0])}\n\n")
-        except TypeError as e:
+                    f"Filtering by: {colname} {operator} {value}...\n" +
+                    f"Remaining Candidates: {str(count)}\n\n")
+        except PredicateError as e:
+            # Raised before anything is filtered
             print(e)
             messagebox.showerror(title="Filtering Error",
-                message="Cannot compare different data types!",
-                detail="The search term data type does not match the " +
-                    "database data type. This can happen when importing " +
-                    "a filtered database, or faulty filtering code. " +
-                    "Aborting.")
+                message="A filter value does not match the column type!",
+                detail=str(e) + "\n\nNo filters were applied.")
+            return
 
         # Update tree widget after filtering
         self.sub_tree._load_tree()
 
 
+    def _preview_counts(self):
+        """ Count matches for the filter rows on a worker thread, 
+            cancelling any preview still running
+        """
+        if self._preview_cancel is not None:
+            self._preview_cancel.set()
+        cancel = threading.Event()
+        self._preview_cancel = cancel
+
+        predicates = list(self.filter_frame.preview_rows)
+        # Count within the other filter steps (e.g., the scrub)
+        within = self.db.engine.mask_without('grid')
+        preview_queue = queue.Queue()
+
+        def worker():
+            # Always answer, so the poll stops even if counting fails
+            try:
+                preview_queue.put(self.db.preview_counts(predicates, 
+                    within, cancel))
+            except Exception as e:
+                preview_queue.put(e)
+
+        threading.Thread(target=worker, daemon=True).start()
+        self.after(50, self._poll_preview, preview_queue, cancel)
+
+
+    def _poll_preview(self, preview_queue, cancel):
+        """ Show preview counts once the worker thread is done,
+            unless a newer preview replaced it
+        """
+        try:
+            counts = preview_queue.get_nowait()
+        except queue.Empty:
+            if not cancel.is_set():
+                self.after(50, self._poll_preview, preview_queue, cancel)
+            return
+        if cancel.is_set():
+            return
+        if isinstance(counts, Exception):
+            # Clear the counts rather than show stale ones
+            print(f"Could not count filter matches: {counts}")
+            self.filter_frame.show_counts([])
+        elif counts is not None:
+            self.filter_frame.show_counts(counts)
+
+
+    def _filter_template(self):
+        """ Filter by the audiogram template chosen in filterview
+        """
+        name = self.filter_frame.template_var.get()
+        before = self.db.count
+        self.db.ac_thresh_filt(audio_dict.templates[name],
+            ears=self.filter_frame.ears_var.get(),
+            missing=self.filter_frame.missing_var.get(), name=name)
+
+        self.filter_frame.txt_output.delete('1.0', tk.END)
+        self.filter_frame.txt_output.insert(tk.END,
+            f"Candidates before filtering: {before}\n\n" +
+            f"Filtering by: audiogram template {name} " +
+            f"({self.filter_frame.ears_var.get()} ears)...\n" +
+            f"Remaining Candidates: {self.db.count}\n\n")
+        self.sub_tree._load_tree()
+
+
+    def _filter_expression(self):
+        """ Filter by the boolean expression typed in filterview
+        """
+        text = self.filter_frame.expression_var.get()
+        try:
+            before, after = self.db.filter_expression(text)
+        except filterexpr.ExpressionError as e:
+            print(e)
+            messagebox.showerror(title="Invalid Expression",
+                message="The filter expression could not be read!",
+                detail=str(e))
+            return
+
+        self.filter_frame.txt_output.delete('1.0', tk.END)
+        self.filter_frame.txt_output.insert(tk.END,
+            f"Candidates before filtering: {before}\n\n" +
+            f"Filtering by: {text.strip()}...\n" +
+            f"Remaining Candidates: {after}\n\n")
+        self.sub_tree._load_tree()
+
+
     ##########################
     # Browse Frame Functions #
     ##########################
@@ -408,14 +861,21 @@ class App(tk.Tk):
             item = self.sub_tree.tree.item(selected_item)
             # Convert item to record number
             record = int(item['values'][0])
+            self._selected_subject = record
+
+            # Look up subject record once
+            rec = self.db.record(record)
 
             # Subject Data
-            self._vars['age'] = self.db.data[self.db.data['Subject Id'] == record]['Age'].values[0]
-            self._vars['miles_away'] = self.db.data[self.db.data['Subject Id'] == record]['Miles From Starkey'].values[0]
-            self._vars['smartphone_type'] = self.db.data[self.db.data['Subject Id'] == record]['Smartphone Type'].values[0]
-            self._vars['will_not_wear'] = self.db.data[self.db.data['Subject Id'] == record]['Will Not Wear'].values[0]
+            # Missing numbers are shown as '-' (no data)
+            missing = rec.isna()
+            for key, colname in [('age', 'Age'),
+                ('miles_away', 'Miles From Starkey')]:
+                self._vars[key] = '-' if missing[colname] else rec[colname]
+            self._vars['smartphone_type'] = rec['Smartphone Type']
+            self._vars['will_not_wear'] = rec['Will Not Wear']
             # Study dates and names parsing
-            latest_study = self.db.data[self.db.data['Subject Id'] == record]['Latest Study'].values[0]
+            latest_study = rec['Latest Study']
             study_dates = [z.split(')')[0] for z in latest_study.split('(') if ')' in z]
             try:
                 study_dates = study_dates[0]
@@ -425,25 +885,20 @@ class App(tk.Tk):
             self._vars['study_dates'] = study_dates
             self._vars['study_info'] = study_info
             # Hearing aid data
-            self._vars['r_style'] = self.db.data[self.db.data['Subject Id'] == record]['RightStyle'].values[0]
-            self._vars['l_style'] = self.db.data[self.db.data['Subject Id'] == record]['LeftStyle'].values[0]
-            self._vars['r_coupling'] = self.db.data[self.db.data['Subject Id'] == record]['Right Earmold Style'].values[0]
-            self._vars['l_coupling'] = self.db.data[self.db.data['Subject Id'] == record]['Left Earmold Style'].values[0]
-            self._vars['r_receiver'] = self.db.data[self.db.data['Subject Id'] == record]['Right Ric Cable Size'].values[0]
-            self._vars['l_receiver'] = self.db.data[self.db.data['Subject Id'] == record]['Left Ric Cable Size'].values[0]
-            try:
-                matrix, coupling, vent_size = self.db.coupling(record)
-                self._vars['r_rec_coupling'] = coupling['Right']
-                self._vars['l_rec_coupling'] = coupling['Left']
-                self._vars['r_rec_vent'] = vent_size['Right']
-                self._vars['l_rec_vent'] = vent_size['Left']
-                self._vars['l_matrix'] = matrix['Left']
-                self._vars['r_matrix'] = matrix['Right']
-            except TypeError:
-                messagebox.showerror(title="Error!",
-                    message="An error occurred calculating the coupling type!",
-                    detail="Cannot determine the recommendation threshold."
-                )
+            self._vars['r_style'] = rec['RightStyle']
+            self._vars['l_style'] = rec['LeftStyle']
+            self._vars['r_coupling'] = rec['Right Earmold Style']
+            self._vars['l_coupling'] = rec['Left Earmold Style']
+            self._vars['r_receiver'] = rec['Right Ric Cable Size']
+            self._vars['l_receiver'] = rec['Left Ric Cable Size']
+            # ProFit recommendations are calculated for all records
+            # at load time (missing: no recommendation threshold)
+            for side, key in [('Right', 'r'), ('Left', 'l')]:
+                for field, var in [('Coupling', 'rec_coupling'),
+                    ('Vent', 'rec_vent'), ('Matrix', 'matrix')]:
+                    value = rec[f'{side} Pro Fit {field}']
+                    self._vars[f'{key}_{var}'] = value \
+                        if isinstance(value, str) else '-'
 
             # Send db data to View labels to display
             self.browse_frame.load(self._vars)
@@ -452,6 +907,77 @@ class App(tk.Tk):
             self._show_audio(record)
             
 
+    def _find_similar(self):
+        """ List the subjects with audiograms most similar to the 
+            typed audiogram, or to the selected subject
+        """
+        text = self.browse_frame.audiogram_var.get().strip()
+        try:
+            k = self.browse_frame.k_var.get()
+            if text:
+                results = self.db.similar_subjects(
+                    thresholds=audiosearch.parse_audiogram(text), k=k,
+                    filtered=self.browse_frame.similar_filtered_var.get())
+            elif self._selected_subject is not None:
+                results = self.db.similar_subjects(self._selected_subject,
+                    k=k, 
+                    filtered=self.browse_frame.similar_filtered_var.get())
+            else:
+                messagebox.showwarning(title="No Audiogram",
+                    message="Please select a subject or type an audiogram!")
+                return
+        except (ValueError, tk.TclError) as e:
+            print(e)
+            messagebox.showerror(title="Similarity Search Error",
+                message="Cannot search for similar audiograms!",
+                detail=str(e))
+            return
+
+        self.browse_frame.show_similar(results)
+        print(f"Found {results.shape[0]} similar audiograms")
+
+
+    def _show_similar_subject(self):
+        """ Select the chosen similar subject in the subject tree
+        """
+        sub_id = self.browse_frame.selected_similar()
+        if sub_id is None:
+            return
+        if not self.sub_tree.select(sub_id):
+            messagebox.showinfo(title="Subject Not Listed",
+                message=f"Subject {sub_id} is not in the filtered records!",
+                detail="Reset the filters to browse this subject.")
+
+
+    def _find_subject(self):
+        """ List the subjects whose name or address best match
+            the typed text
+        """
+        text = self.browse_frame.find_var.get()
+        try:
+            results = self.db.find_subjects(text, 
+                filtered=self.browse_frame.find_filtered_var.get())
+        except ValueError as e:
+            messagebox.showwarning(title="Nothing to Find",
+                message=str(e))
+            return
+
+        self.browse_frame.show_found(results)
+        print(f"Found {results.shape[0]} matching subjects")
+
+
+    def _show_found_subject(self):
+        """ Select the chosen search match in the subject tree
+        """
+        sub_id = self.browse_frame.selected_found()
+        if sub_id is None:
+            return
+        if not self.sub_tree.select(sub_id):
+            messagebox.showinfo(title="Subject Not Listed",
+                message=f"Subject {sub_id} is not in the filtered records!",
+                detail="Reset the filters to browse this subject.")
+
+
     def _show_audio(self, record):
         """ Retrieve figure axis handle and plot audio 
         """
@@ -460,5 +986,7 @@ class App(tk.Tk):
 
 
 if __name__ == '__main__':
+    # Required for parallel database parsing in the compiled app
+    multiprocessing.freeze_support()
     app = App()
     app.mainloop()
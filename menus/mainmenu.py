@@ -32,6 +32,10 @@ class MainMenu(tk.Menu):
             label="Import Filtered DB...",
             command=self._event('<<FileImportFilteredDB>>')
         )
+        file_menu.add_command(
+            label="Import DB Update...",
+            command=self._event('<<FileImportDelta>>')
+        )
         file_menu.add_command(
             label="Export DB...",
             command=self._event('<<FileExportDB>>')
@@ -61,6 +65,32 @@ class MainMenu(tk.Menu):
             label='Reset Filters',
             command=self._event('<<ToolsReset>>')
         )
+        tools_menu.add_separator()
+        tools_menu.add_command(
+            label='Undo Filter',
+            command=self._event('<<ToolsUndoFilter>>')
+        )
+        tools_menu.add_command(
+            label='Redo Filter',
+            command=self._event('<<ToolsRedoFilter>>')
+        )
+        tools_menu.add_command(
+            label='Remove Filter...',
+            command=self._event('<<ToolsRemoveFilter>>')
+        )
+        tools_menu.add_command(
+            label='Filter Cache Statistics',
+            command=self._event('<<ToolsCacheStats>>')
+        )
+        tools_menu.add_command(
+            label='Clear Database Cache...',
+            command=self._event('<<ToolsClearCache>>')
+        )
+        tools_menu.add_separator()
+        tools_menu.add_command(
+            label='Age Reference Date...',
+            command=self._event('<<ToolsRefDate>>')
+        )
         # Add Tools menu to the menubar
         self.add_cascade(label="Tools", menu=tools_menu)
 
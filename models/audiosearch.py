@@ -0,0 +1,149 @@
+""" Audiogram similarity search
+
+    Finds the subjects whose audiograms are closest to a given
+    audiogram (e.g., to replace a subject who dropped out of a
+    study). Audiograms are the AC and BC threshold vectors of the
+    column registry. Distance is the root mean square threshold
+    difference (dB) over the frequencies measured in both
+    audiograms. For all subjects at once, the squared differences
+    and the number of shared frequencies come from a single matrix
+    product: sum(m * (x - q)**2) = sum(m * x**2) - 2 * sum(m * x * q)
+    + sum(m * q**2), where m marks measured thresholds. Subjects 
+    sharing too few measured frequencies with the query are not 
+    matched.
+
+    Author: Travis M. Moore
+"""
+
+###########
+# Imports #
+###########
+# Import data science packages
+import numpy as np
+
+# Import system packages
+import re
+
+# Import custom modules
+from models import schema
+
+
+#########
+# BEGIN #
+#########
+# Typed audiogram entries: [R|L][AC|BC]freq=threshold
+_entry = re.compile(r'^(R|L)?(AC|BC)?(\d+)\s*[=:]\s*(-?\d+(?:\.\d+)?)$',
+    re.IGNORECASE)
+
+
+def parse_audiogram(text):
+    """ Return dict of threshold column to value from text such
+        as "500=20 1000=30 R4000=60 LBC1000=25". Entries without
+        R/L apply to both ears; entries without AC/BC are AC.
+        Raises ValueError for entries that cannot be read.
+    """
+    thresholds = {}
+    for item in text.replace(',', ' ').split():
+        match = _entry.match(item)
+        if match is None:
+            raise ValueError(f"Cannot read audiogram entry {item!r} " +
+                "(expected e.g. 1000=40 or R1000=40)")
+        side, path, freq, value = match.groups()
+        sides = [side.upper()] if side else ['R', 'L']
+        path = path.upper() if path else 'AC'
+        for x in sides:
+            colname = ('Right' if x == 'R' else 'Left') + \
+                f"{path} {int(freq)}"
+            if colname not in schema.threshold_cols:
+                raise ValueError(f"No {path} threshold at {freq} Hz")
+            thresholds[colname] = float(value)
+    if not thresholds:
+        raise ValueError("No thresholds given")
+    return thresholds
+
+
+class AudiogramIndex:
+    """ Threshold vectors of all subjects for nearest neighbour
+        queries
+    """
+
+    # Threshold columns compared
+    columns = schema.threshold_cols
+
+    # Fraction of the query's measured frequencies a subject must
+    # also have measured to be matched
+    min_overlap = 0.5
+
+    def __init__(self, frame):
+        # (subjects, columns); missing thresholds are NaN
+        values = frame[self.columns].to_numpy(dtype='float32',
+            na_value=np.nan)
+        self.measured = ~np.isnan(values)
+        # Missing thresholds are zero, and masked by measured
+        self.values = np.where(self.measured, values, 0).astype('float32')
+        # Per-subject terms of the distance (see module docstring)
+        self._terms = np.hstack([self.values * self.values, self.values,
+            self.measured.astype('float32')])
+
+
+    def query(self, thresholds):
+        """ Return query vector (NaN if missing) from a dict of
+            threshold column to value
+        """
+        vector = np.full(len(self.columns), np.nan, dtype='float32')
+        for ii, colname in enumerate(self.columns):
+            value = thresholds.get(colname)
+            if value is not None:
+                vector[ii] = value
+        return vector
+
+
+    def row(self, position):
+        """ Return query vector for the subject at position
+        """
+        return np.where(self.measured[position], self.values[position],
+            np.nan).astype('float32')
+
+
+    def nearest(self, vector, k=10, within=None, exclude=None):
+        """ Return (positions, distances, shared) of the k subjects
+            closest to the query vector, closest first. Within is an
+            optional boolean mask of subjects to search; exclude is
+            an optional position to leave out (e.g., the query
+            subject). Shared is the number of frequencies compared.
+        """
+        query = ~np.isnan(vector)
+        wanted = int(query.sum())
+        if wanted == 0:
+            raise ValueError("Audiogram has no thresholds")
+        q = np.where(query, vector, 0).astype('float32')
+
+        # Weights of the terms giving (squared differences, shared)
+        n = len(self.columns)
+        weights = np.zeros((3 * n, 2), dtype='float32')
+        weights[:n, 0] = query
+        weights[n:2 * n, 0] = -2 * q
+        weights[2 * n:, 0] = q * q
+        weights[2 * n:, 1] = query
+        rows = np.arange(self.values.shape[0]) if within is None \
+            else np.flatnonzero(within)
+        terms = self._terms if within is None else self._terms[rows]
+        squares, shared = (terms @ weights).T
+
+        shared = np.rint(shared).astype(int)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            # Clip float rounding below zero for identical audiograms
+            distances = np.sqrt(np.maximum(squares, 0) / shared)
+        enough = shared >= max(1, np.ceil(self.min_overlap * wanted))
+        if exclude is not None:
+            enough &= rows != exclude
+        distances[~enough] = np.inf
+
+        # Partial sort: only the k best are ordered
+        k = min(k, int(enough.sum()))
+        if k == 0:
+            return (np.array([], dtype=int), np.array([], dtype='float32'),
+                np.array([], dtype=int))
+        best = np.argpartition(distances, k - 1)[:k]
+        best = best[np.argsort(distances[best], kind='stable')]
+        return rows[best], distances[best], shared[best]
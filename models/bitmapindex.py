@@ -0,0 +1,131 @@
+""" Bitmap indexes for categorical database columns
+
+    Stores one packed bitmap (one bit per row) for each distinct
+    value of a low-cardinality column. Equals, does not equal and
+    contains filters are answered with bitwise OR/AND/NOT on the
+    bitmaps instead of scanning the column, and the number of rows
+    with each value is known without a scan.
+
+    Author: Travis M. Moore
+"""
+
+###########
+# Imports #
+###########
+# Import data science packages
+import numpy as np
+import pandas as pd
+
+
+#########
+# BEGIN #
+#########
+# Number of set bits in each byte value
+_popcount = np.array([bin(x).count('1') for x in range(256)],
+    dtype=np.uint8)
+
+
+def popcount(bits):
+    """ Number of set bits in a packed bitmap
+    """
+    return int(_popcount[bits].sum(dtype=np.int64))
+
+
+class BitmapIndex:
+    """ Packed bitmap per value of a categorical column
+    """
+
+    # Operators answered from the bitmaps
+    operators = ('equals', 'does not equal', 'contains')
+
+    def __init__(self, col):
+        """ Col is a categorical Series
+        """
+        self.rows = col.shape[0]
+        self.categories = col.cat.categories
+        codes = col.cat.codes.to_numpy()
+
+        self.bitmaps = np.empty((len(self.categories),
+            -(-self.rows // 8)), dtype=np.uint8)
+        for code in range(len(self.categories)):
+            self.bitmaps[code] = np.packbits(codes == code)
+        # Rows with any value
+        self.present = np.packbits(codes >= 0)
+        # All rows (the padding bits of the last byte are clear)
+        self.all = np.packbits(np.ones(self.rows, dtype=bool))
+        self.counts = pd.Series(np.bincount(codes[codes >= 0],
+            minlength=len(self.categories)), index=self.categories)
+
+
+    def bitmap(self, value):
+        """ Packed bitmap of rows equal to value
+        """
+        try:
+            return self.bitmaps[self.categories.get_loc(value)]
+        except (KeyError, TypeError):
+            return np.zeros_like(self.present)
+
+
+    def bits(self, operator, value):
+        """ Packed bitmap of rows matching (operator, value), or
+            None if the operator is not supported
+        """
+        if operator == "equals":
+            return self.bitmap(value)
+        elif operator == "does not equal":
+            # Missing values do not equal any value
+            return ~self.bitmap(value) & self.all
+        elif operator == "contains":
+            if isinstance(value, str):
+                # Same as Series.isin
+                raise TypeError("only list-like objects are allowed " +
+                    "for 'contains'")
+            bits = np.zeros_like(self.present)
+            for x in set(value):
+                bits |= self.bitmap(x)
+            return bits
+        return None
+
+
+    def mask(self, operator, value):
+        """ Boolean array of rows matching (operator, value), or
+            None if the operator is not supported
+        """
+        bits = self.bits(operator, value)
+        if bits is None:
+            return None
+        return np.unpackbits(bits, count=self.rows).astype(bool)
+
+
+    def count(self, operator, value):
+        """ Number of rows matching (operator, value), or None if
+            the operator is not supported
+        """
+        bits = self.bits(operator, value)
+        if bits is None:
+            return None
+        return popcount(bits)
+
+
+    def value_counts(self, within=None):
+        """ Number of rows with each value. Within is an optional
+            boolean row mask (e.g., the current filtered view).
+        """
+        if within is None:
+            return self.counts.copy()
+        within = np.packbits(within)
+        return pd.Series([popcount(bits & within)
+            for bits in self.bitmaps], index=self.categories)
+
+
+def build_indexes(frame, columns, max_values=64):
+    """ Return dict of BitmapIndex for the categorical columns
+        of frame with at most max_values distinct values
+    """
+    indexes = {}
+    for name in columns:
+        col = frame[name]
+        if isinstance(col.dtype, pd.CategoricalDtype) and \
+            (len(col.cat.categories) <= max_values):
+            indexes[name] = BitmapIndex(col)
+    return indexes
@@ -12,3 +12,23 @@ class FieldTypes(Enum):
     decimal = auto()
     integer = auto()
     boolean = auto()
+
+
+# File dialog types for database exports. Compression is 
+# inferred from the extension when reading and writing.
+DB_FILETYPES = [
+    ('Database export', '*.csv *.csv.gz *.gz *.zip *.xz'),
+    ('CSV file', '*.csv'),
+    ('Compressed CSV', '*.csv.gz *.gz *.zip *.xz'),
+    ('All files', '*.*')
+]
+
+EXPORT_FILETYPES = [
+    ('CSV file', '*.csv'),
+    ('Gzip compressed CSV', '*.csv.gz'),
+    ('Zip compressed CSV', '*.zip'),
+    ('XZ compressed CSV', '*.csv.xz')
+]
+
+# Extensions pandas reads and writes as compressed streams
+COMPRESSED_EXTENSIONS = ('.gz', '.zip', '.xz')
@@ -0,0 +1,256 @@
+""" On-disk cache for processed database exports
+
+    Stores the projected/renamed/sorted 'General Search' frame in a
+    columnar NumPy .npz store, keyed by a hash of the source file
+    contents and the version of the load logic. Reopening the same
+    export loads the cached columns instead of re-parsing the .csv.
+
+    Author: Travis M. Moore
+"""
+
+###########
+# Imports #
+###########
+# Import data science packages
+import numpy as np
+import pandas as pd
+
+# Import system packages
+import os
+import json
+import hashlib
+
+
+#########
+# BEGIN #
+#########
+def _pack_strings(strings):
+    """ Return (UTF-8 bytes, character offsets) of a list of 
+        strings joined end to end
+    """
+    lengths = np.array([len(x) for x in strings], dtype=np.int64)
+    offsets = np.concatenate([[0], np.cumsum(lengths)])
+    data = np.frombuffer(''.join(strings).encode('utf-8'), 
+        dtype=np.uint8)
+    return data, offsets
+
+
+def _unpack_strings(data, offsets):
+    """ Return list of strings from _pack_strings output
+    """
+    text = data.tobytes().decode('utf-8')
+    return [text[start:stop] for start, stop 
+        in zip(offsets[:-1].tolist(), offsets[1:].tolist())]
+
+
+class DBCache:
+    """ Columnar cache of processed database frames
+    """
+
+    # Number of cached exports to keep on disk
+    max_entries = 5
+
+    # Bytes read per hashing block
+    block_size = 1024 * 1024
+
+    # Bump whenever the on-disk layout changes
+    store_format = 2
+
+    def __init__(self, version, cache_dir=None):
+        """ Version is a string describing the load logic
+            (e.g., projection and rename maps). Changing it
+            invalidates all existing cache entries.
+        """
+        self.version = f"{self.store_format}:{version}"
+        if cache_dir is None:
+            cache_dir = os.path.join(os.path.expanduser('~'),
+                '.subject_browser', 'cache')
+        self.cache_dir = cache_dir
+
+
+    #####################
+    # General Functions #
+    #####################
+    def key(self, db_path, salt=''):
+        """ Hash the source file contents and the load logic
+            version into a cache key. Salt distinguishes different
+            processed versions of the same export.
+        """
+        hasher = hashlib.blake2b(digest_size=20)
+        hasher.update(self.version.encode('utf-8'))
+        hasher.update(salt.encode('utf-8'))
+        with open(db_path, 'rb') as f:
+            for block in iter(lambda: f.read(self.block_size), b''):
+                hasher.update(block)
+        return hasher.hexdigest()
+
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key + '.npz')
+
+
+    def _snapshot_key(self):
+        """ Key of the snapshot used for incremental imports. 
+            Depends only on the load logic version.
+        """
+        return 'snapshot_' + hashlib.blake2b(self.version.encode('utf-8'),
+            digest_size=20).hexdigest()
+
+
+    def load_snapshot(self):
+        """ Return the last full database snapshot, or None
+        """
+        return self.load(self._snapshot_key())
+
+
+    def save_snapshot(self, frame):
+        """ Replace the full database snapshot (never pruned).
+            Snapshots of other load logic versions are removed.
+        """
+        key = self._snapshot_key()
+        self.save(key, frame)
+        for name in os.listdir(self.cache_dir):
+            if name.startswith('snapshot_') and (name != key + '.npz'):
+                try:
+                    os.remove(os.path.join(self.cache_dir, name))
+                except OSError:
+                    pass
+
+
+    def load(self, key):
+        """ Return cached frame for key, or None on a miss.
+            Frame attrs saved with the entry are restored.
+        """
+        path = self._path(key)
+        if not os.access(path, os.F_OK):
+            return None
+
+        try:
+            with np.load(path, allow_pickle=False) as store:
+                meta = json.loads(str(store['meta']))
+                attrs = json.loads(str(store['attrs']))
+                columns = {}
+                for ii, (name, kind, dtype) in enumerate(meta):
+                    values = store[f'c{ii}']
+                    if kind == 'O':
+                        # Strings: codes into the distinct values
+                        uniques = _unpack_strings(store[f'k{ii}'],
+                            store[f'o{ii}'])
+                        values = np.array(uniques + [np.nan], 
+                            dtype=object)[values]
+                        # Keep the saved type, also for columns with
+                        # no strings to infer it from
+                        values = pd.Series(values, dtype=dtype)
+                    elif kind == 'I':
+                        # Nullable integers and decimals
+                        array = pd.arrays.FloatingArray \
+                            if values.dtype.kind == 'f' \
+                            else pd.arrays.IntegerArray
+                        values = array(values,
+                            store[f'm{ii}']).astype(dtype)
+                    elif kind == 'C':
+                        # Categories stored as codes
+                        values = pd.Categorical.from_codes(values,
+                            categories=store[f'k{ii}'].astype(object))
+                    elif kind == 'M':
+                        values = values.view(dtype)
+                    columns[name] = values
+        except (OSError, KeyError, ValueError) as e:
+            # Treat unreadable entries as a miss
+            print(f"Cache entry unreadable, ignoring: {e}")
+            return None
+
+        # Mark entry as recently used
+        os.utime(path)
+        print("Loaded database from cache")
+        frame = pd.DataFrame(columns)
+        frame.attrs.update(attrs)
+        return frame
+
+
+    def save(self, key, frame):
+        """ Write frame to the cache as one array per column
+        """
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+        arrays = {}
+        meta = []
+        for ii, name in enumerate(frame.columns):
+            col = frame[name]
+            dtype = str(col.dtype)
+            if isinstance(col.dtype, pd.CategoricalDtype):
+                arrays[f'c{ii}'] = col.cat.codes.to_numpy()
+                arrays[f'k{ii}'] = col.cat.categories.to_numpy(
+                    dtype=str)
+                meta.append((name, 'C', dtype))
+            elif isinstance(col.dtype, pd.api.extensions.ExtensionDtype) \
+                and (col.dtype.kind in 'iuf'):
+                # Nullable integers and decimals: values and missing 
+                # value mask
+                arrays[f'c{ii}'] = col.to_numpy(
+                    dtype=col.dtype.numpy_dtype, na_value=0)
+                arrays[f'm{ii}'] = col.isna().to_numpy()
+                meta.append((name, 'I', dtype))
+            elif col.dtype.kind == 'M':
+                arrays[f'c{ii}'] = col.to_numpy().view('int64')
+                meta.append((name, 'M', dtype))
+            elif col.dtype.kind in 'biuf':
+                arrays[f'c{ii}'] = col.to_numpy()
+                meta.append((name, col.dtype.kind, dtype))
+            else:
+                # Store strings as codes into the distinct values
+                # (-1: missing), packed as UTF-8 (no pickling). A
+                # fixed width array would pad every cell to the
+                # longest one in the column.
+                codes, uniques = pd.factorize(col)
+                arrays[f'c{ii}'] = codes.astype(np.int32)
+                arrays[f'k{ii}'], arrays[f'o{ii}'] = _pack_strings(
+                    [str(x) for x in uniques])
+                meta.append((name, 'O', dtype))
+        arrays['meta'] = np.array(json.dumps(meta))
+        arrays['attrs'] = np.array(json.dumps(frame.attrs))
+
+        # Write to temporary file first so a failed write
+        # never leaves a partial entry behind
+        path = self._path(key)
+        tmp_path = path + '.tmp'
+        try:
+            with open(tmp_path, 'wb') as f:
+                np.savez(f, **arrays)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print(f"Could not write database cache: {e}")
+            return
+
+        self._prune()
+
+
+    def clear(self):
+        """ Remove all cache entries, including the snapshot. 
+            Returns the number of files removed.
+        """
+        if not os.path.isdir(self.cache_dir):
+            return 0
+        removed = 0
+        for name in os.listdir(self.cache_dir):
+            if name.endswith(('.npz', '.tmp')):
+                try:
+                    os.remove(os.path.join(self.cache_dir, name))
+                    removed += 1
+                except OSError:
+                    pass
+        return removed
+
+
+    def _prune(self):
+        """ Remove least recently used entries beyond max_entries
+        """
+        entries = [os.path.join(self.cache_dir, x)
+            for x in os.listdir(self.cache_dir) 
+            if x.endswith('.npz') and not x.startswith('snapshot_')]
+        entries.sort(key=os.path.getmtime, reverse=True)
+        for path in entries[self.max_entries:]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
@@ -1,7 +1,8 @@
 """ Database model for the Subject Browser 
 
     Expects a .csv file of the entire 'General Search' tab 
-    from the online subject database. 
+    from the online subject database (optionally compressed as
+    .gz, .zip or .xz).
 
     Author: Travis M. Moore
  """
@@ -16,146 +17,607 @@ from tkinter import filedialog
 import numpy as np
 import pandas as pd
 
-
-
-import matplotlib.pyplot as plt
-
-import matplotlib
-matplotlib.use('TkAgg')
-from matplotlib.figure import Figure
-from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg, NavigationToolbar2Tk
-
 # Import system packages
+import os
+import functools
 from datetime import datetime
 
 # Import custom modules
+from models import audiosearch
+from models import bitmapindex
+from models import dbcache
+from models import features
+from models import filtercache
+from models import filterengine
+from models import filterexpr
+from models import namesearch
+from models import parallelcsv
+from models import queryplanner
+from models import rangeindex
+from models import schema
+from models import textindex
 from models.constants import FieldTypes as FT
+from models.constants import EXPORT_FILETYPES
+from models.predicates import PredicateError
+from models.predicates import compile_predicate, compile_predicates
 
 
 #########
 # BEGIN #
 #########
+class LoadCancelled(Exception):
+    """ Raised when a database load is cancelled by the user
+    """
+
+
 class SubDB:
     """ Class to hold database info and provide related 
         functions (e.g., get air conduction thresholds)
     """
 
-    def __init__(self, db_path):
-        """ Load database .csv file from path
+    # Perfunctory junk record removal: drop inactive, poor
+    # candidate, employee and far away records
+    scrub_dict = {
+        1: ("Status", "contains", ["-", "Active"]),
+        2: ("Good Candidate", "does not equal", "Poor"),
+        3: ("Employment Status", "does not equal", "Employee"),
+        4: ("Miles From Starkey", "<=", 60)
+    }
+
+    # Scrub steps on these columns keep records without data ('-'):
+    # an unknown distance does not make a subject far away
+    scrub_keep_missing = ['Miles From Starkey']
+
+    # Number of rows read at a time when streaming an export
+    chunksize = 50000
+
+    # Numeric columns with sorted indexes for range filters
+    range_index_cols = ['Age', 'Miles From Starkey', 
+        'Total Ytd Stipend'] + schema.threshold_cols + \
+        [x for x in schema.feature_cols if x in schema.decimal_cols]
+
+    # Free-text columns with word indexes for 'text contains'
+    text_index_cols = ['Medical Conditions Details', 'Latest Study',
+        'Will Not Wear']
+
+    # Exports at least this large are parsed on all cores
+    workers = os.cpu_count() or 1
+    parallel_min_bytes = 32 * 1024 * 1024
+
+    # Exports at least this large (and compressed exports) are 
+    # scrubbed while streaming (dropping rows); smaller ones are 
+    # scrubbed with filter steps that can be undone
+    scrub_stream_min_bytes = 32 * 1024 * 1024
+
+    # Bump whenever the load logic changes to invalidate 
+    # cached exports (registry changes are detected)
+    load_version = 5
+
+    def __init__(self, db_path=None, reference_date=None):
+        """ Load database .csv file from path. Ages are calculated
+            as of reference_date (default: today). Without a path, 
+            the database starts empty (e.g., while loading in the 
+            background).
         """
-        self.load_db(db_path)
+        self.reference_date = reference_date
+
+        # On-disk cache of processed exports
+        self.cache = dbcache.DBCache(version=repr((self.load_version,
+            schema.fields)))
+
+        # Filter steps over the loaded frame
+        self.engine = filterengine.FilterEngine(schema.empty_frame())
+
+        # Results of recent filter runs (kept across imports)
+        self.filter_cache = filtercache.FilterCache()
+
+        if db_path is None:
+            self.set_data(schema.empty_frame())
+        else:
+            self.load_db(db_path)
 
 
     #####################
     # General Functions #
     #####################
     def load_filtered_db(self, db_path):
-        # Import .csv file of database records
-        self.data = pd.read_csv(db_path)
+        """ Read previously exported database .csv file
+        """
+        self.set_data(self.read_filtered_db(db_path))
+
+
+    def load_db(self, db_path, use_cache=True, scrub_dict=None):
+        """ Read database .csv provided from filedialog browser.
+            See read_db.
+        """
+        self.set_data(self.read_db(db_path, use_cache, scrub_dict))
 
-        # Convert age back to string after importing 
-        # a previously-exported database .csv file
-        self.data['Age'] = self.data['Age'].astype('str')
 
-        # Convert all values back to strings
-        #self.data = self.data.astype(str)
-        # Pretty sure everything is loaded in as an object data type?
+    def set_data(self, data):
+        """ Swap in a newly read database frame. Load statistics 
+            travel with the frame in data.attrs. The frame is 
+            replaced in a single assignment, so the views never 
+            see a partially loaded database.
+        """
+        self.scrub_counts = data.attrs.pop('scrub_counts', [])
+        self.memory_saved = data.attrs.pop('memory_saved', 0)
+        self.delta_counts = data.attrs.pop('delta_counts', {})
+        self.engine.set_base(data)
+        self.chain = filterengine.FilterChain(data.shape[0])
+        self._ac_matrix = None
+        self._audiogram_index = None
+        self._name_index = None
+        self._fingerprint = None
+        # Bitmap indexes for equality filters on categorical 
+        # columns, and sorted indexes for range filters on numbers
+        self.indexes = bitmapindex.build_indexes(data, 
+            schema.category_cols)
+        self.indexes.update(rangeindex.build_indexes(data, 
+            self.range_index_cols))
+        # Word indexes for full-text queries
+        self.text_indexes = textindex.build_indexes(data,
+            self.text_index_cols)
+        self.planner = queryplanner.QueryPlanner(data, self.indexes,
+            self.text_indexes)
 
         # Provide feedback
         print("Loaded database records")
-        print(f"Remaining candidates: {self.data.shape[0]}\n")
+        print(f"Remaining candidates: {self.count}\n")
+
+
+    @property
+    def data(self):
+        """ Filtered view of the loaded database. Rows are only
+            copied when the view is first used after filtering;
+            prefer column() and record() for lookups.
+        """
+        return self.engine.view()
 
 
-    def load_db(self, db_path):
-        """ Read database .csv provided from filedialog browser
+    @property
+    def count(self):
+        """ Number of records in the filtered view
         """
+        return self.engine.count
+
+
+    @property
+    def fingerprint(self):
+        """ Hash of the loaded database contents (computed on 
+            first use after each load)
+        """
+        if self._fingerprint is None:
+            self._fingerprint = filtercache.fingerprint(self.engine.base)
+        return self._fingerprint
+
+
+    def column(self, colname):
+        """ Values of colname for the records in the filtered view
+        """
+        return self.engine.column(colname)
+
+
+    def record(self, sub_id):
+        """ Return the record for sub_id as a Series
+        """
+        base = self.engine.base
+        return base[(base['Subject Id'] == sub_id).to_numpy()].iloc[0]
+
+
+    def stream_scrub(self, db_path):
+        """ Return True if db_path is large enough that the scrub
+            should drop rows while streaming, rather than being 
+            applied as filter steps after loading. Compressed 
+            exports are always streamed: the file size says little
+            about their size once decompressed.
+        """
+        if parallelcsv.is_compressed(db_path):
+            return True
+        return os.path.getsize(db_path) >= self.scrub_stream_min_bytes
+
+
+    def read_filtered_db(self, db_path, progress=None, cancel=None):
+        """ Read previously exported database .csv file and 
+            return the frame (self.data is not changed).
+            See read_db for progress and cancel.
+        """
+        self._report(progress, cancel, "Reading")
+
         # Import .csv file of database records
-        general_search = pd.read_csv(db_path)
-
-        # Define columns of interest
-        cols_general = [0, 1, 3, 4, 5, 6, 7, 8, 9, 10, 11, 12, 13, 14, 15, 
-                        16, 17, 18, 19, 20, 21, 22, 23, 24, 25, 26, 27, 28, 
-                        29, 30, 31, 32, 33, 34, 35, 36, 38, 40, 42, 49, 51, 
-                        52, 74, 85, 86, 88, 90, 101,102,103,104, 109, 112, 
-                        113, 116, 121, 123, 124, 131, 132, 133, 134, 151, 
-                        154, 155, 158, 163, 164, 165, 166, 170, 172, 173, 
-                        176, 177, 178, 179, 180, 185, 187, 189, 192, 196, 
-                        202, 204]
-
-        # New dataframe with columns of interest only
-        short_gen = general_search[general_search.columns[cols_general]].copy()
-
-        # Correct column names
-        short_gen.rename(columns = {
-            'L Pt Bc 1000':'LeftBC 1000',
-            'L Pt Bc 2000':'LeftBC 2000',
-            'L Pt Bc 4000':'LeftBC 4000',
-            'L Pt Bc 500':'LeftBC 500',
-            'RightBC  1000':'RightBC 1000',
-            'RightBC  2000':'RightBC 2000',
-            'RightBC  4000':'RightBC 4000',
-            'Hearing AidUse':'Hearing Aid Use'
-            }, inplace = True
-        )
+        # (previously exported, so includes calculated fields)
+        options, rename = self._read_options(db_path, 
+            include_derived=True)
+        data = pd.read_csv(db_path, **options)
+        data = data[list(rename)].rename(columns=rename)
+
+        # Convert remaining columns (e.g., dates)
+        self._report(progress, cancel, "Converting", data.shape[0])
+        schema.apply_schema(data)
+        features.add_features(data)
+        data.attrs['memory_saved'] = schema.memory_saved(data)
+        return data
+
+
+    def read_db(self, db_path, use_cache=True, scrub_dict=None, 
+        progress=None, cancel=None):
+        """ Read database .csv and return the processed frame 
+            (self.data is not changed).
+
+            If a scrub_dict of (column, operator, value) tuples is
+            provided, the export is streamed in chunks and rejected
+            rows are dropped as each chunk is read. The remaining
+            candidate count after each scrub step is stored in 
+            data.attrs['scrub_counts'].
+
+            Progress is an optional callable taking a stage name 
+            and number of rows parsed so far. Cancel is an optional
+            threading.Event; when set, LoadCancelled is raised at 
+            the next chunk or stage.
+        """
+        short_gen = None
+        if use_cache:
+            # Look for a previously processed copy of this export
+            self._report(progress, cancel, "Checking cache")
+            key = self.cache.key(db_path,
+                salt=repr(scrub_dict) if scrub_dict else '')
+            short_gen = self.cache.load(key)
+            if short_gen is not None:
+                # Private fields are not cached: read them again
+                self._report(progress, cancel, "Reading private fields",
+                    short_gen.shape[0])
+                self._add_private(short_gen, self._read_private(db_path))
+
+        if short_gen is None:
+            self._report(progress, cancel, "Parsing", 0)
+            # Compressed exports are streamed serially: byte ranges
+            # of a compressed file are not row-aligned
+            if (self.workers > 1) and \
+                not parallelcsv.is_compressed(db_path) and \
+                (os.path.getsize(db_path) >= self.parallel_min_bytes):
+                short_gen = self._parallel_general_search(db_path,
+                    scrub_dict, progress, cancel)
+            elif scrub_dict or progress:
+                # Stream in chunks (also allows progress reporting)
+                short_gen = self._stream_general_search(db_path, 
+                    scrub_dict, progress, cancel)
+            else:
+                short_gen = self._read_general_search(db_path)
+            # Audiometric features are cached with the records
+            self._report(progress, cancel, "Calculating features", 
+                short_gen.shape[0])
+            features.add_features(short_gen)
+            if use_cache:
+                self._report(progress, cancel, "Writing cache", 
+                    short_gen.shape[0])
+                self.cache.save(key, self._public(short_gen))
 
         # Calculate age and store in new dataframe column
-        short_gen['Age'] = short_gen['Date Of Birth'].apply(
-            lambda x: self.calc_age(x))
+        # (not cached: depends on reference date)
+        self._report(progress, cancel, "Calculating ages", 
+            short_gen.shape[0])
+        schema.insert_field(short_gen, 'Age', schema.calc_age(
+            short_gen['Date Of Birth'], self.reference_date))
+
+        short_gen.attrs['memory_saved'] = schema.memory_saved(short_gen)
+        return short_gen
+
+
+    def read_delta(self, db_path, scrub_dict=None, progress=None, 
+        cancel=None):
+        """ Read a new full database export incrementally against 
+            the snapshot saved by the previous incremental import.
+            Rows are hashed and matched by Subject Id; only inserted
+            and changed rows are converted to their storage types. 
+            Unchanged rows are reused from the snapshot.
+
+            The number of inserted, updated, deleted and unchanged
+            records is stored in data.attrs['delta_counts']. If a 
+            scrub_dict is provided, it is applied after merging.
+            See read_db for progress and cancel.
+        """
+        # Read new export as strings (conversion happens later, 
+        # for changed rows only)
+        options, rename = self._read_options(db_path)
+        options['dtype'] = str
+        reader = pd.read_csv(db_path, chunksize=self.chunksize, 
+            **options)
+        chunks = []
+        rows = 0
+        for chunk in reader:
+            chunks.append(chunk[list(rename)].rename(columns=rename))
+            rows += chunk.shape[0]
+            self._report(progress, cancel, "Parsing", rows)
+        raw = pd.concat(chunks, ignore_index=True)
+
+        # Hash each new row and match it to the previous snapshot
+        self._report(progress, cancel, "Comparing", rows)
+        new_hash = pd.util.hash_pandas_object(raw, index=False).to_numpy()
+        new_ids = pd.to_numeric(raw['Subject Id']).to_numpy()
+
+        snapshot = self.cache.load_snapshot()
+        if snapshot is None:
+            # First incremental import: everything is new
+            snapshot = self._public(schema.empty_frame().drop(
+                columns='Age'))
+            snapshot['_row_hash'] = pd.Series(dtype='uint64')
+        old_hash = snapshot.pop('_row_hash').to_numpy()
+
+        pos = pd.Index(snapshot['Subject Id']).get_indexer(new_ids)
+        inserted = pos == -1
+        same = np.zeros(pos.shape[0], dtype=bool)
+        same[~inserted] = old_hash[pos[~inserted]] == new_hash[~inserted]
+        changed = ~same
+
+        # Convert inserted/changed rows only
+        self._report(progress, cancel, "Converting changed records", 
+            int(changed.sum()))
+        converted = raw[changed].reset_index(drop=True)
+        schema.apply_schema(converted)
+        # Private fields are not kept in the snapshot (added below)
+        converted = self._public(converted)
+        features.add_features(converted)
+        kept = snapshot.iloc[pos[same]].reset_index(drop=True)
+        if not set(schema.feature_cols).issubset(kept.columns):
+            # Snapshot saved before the features existed
+            features.add_features(kept)
+        schema.union_categories([kept, converted])
+
+        short_gen = pd.concat([kept, converted], ignore_index=True)
+        short_gen['_row_hash'] = np.concatenate([new_hash[same], 
+            new_hash[changed]])
+        short_gen = short_gen.sort_values(by='Subject Id').reset_index(
+            drop=True)
 
-        # Convert Age column back to string
-        short_gen['Age'] = short_gen['Age'].astype("str")
+        # Save merged database as the next snapshot
+        self._report(progress, cancel, "Writing snapshot", rows)
+        self.cache.save_snapshot(short_gen)
+        short_gen = short_gen.drop(columns='_row_hash')
+        self._add_private(short_gen, raw)
+
+        delta_counts = {
+            'inserted': int(inserted.sum()),
+            'updated': int((changed & ~inserted).sum()),
+            'deleted': int(snapshot.shape[0] - (~inserted).sum()),
+            'unchanged': int(same.sum())
+        }
+        print(f"Incremental import: {delta_counts}")
 
-        # Sort dataframe by subject ID
-        self.data = short_gen.sort_values(by='Subject Id').reset_index(
-            drop=True)
+        if scrub_dict:
+            self._report(progress, cancel, "Scrubbing", rows)
+            columns = {x: x for x in short_gen.columns}
+            short_gen = self._scrub_chunk(short_gen, columns, 
+                scrub_dict).reset_index(drop=True)
 
-        # Provide feedback
-        print("Loaded database records")
-        print(f"Remaining candidates: {self.data.shape[0]}\n")
+        # Calculate age (all rows: depends on reference date)
+        self._report(progress, cancel, "Calculating ages", 
+            short_gen.shape[0])
+        schema.insert_field(short_gen, 'Age', schema.calc_age(
+            short_gen['Date Of Birth'], self.reference_date))
+
+        short_gen.attrs['delta_counts'] = delta_counts
+        short_gen.attrs['memory_saved'] = schema.memory_saved(short_gen)
+        return short_gen
+
+
+    @staticmethod
+    def _public(frame):
+        """ Return frame without its private fields (see 
+            schema.private_cols), e.g., before it is cached
+        """
+        return frame.drop(columns=[x for x in schema.private_cols
+            if x in frame.columns])
+
+
+    def _read_private(self, db_path):
+        """ Return the Subject Id and private fields of db_path
+        """
+        options, rename = self._read_options(db_path)
+        keep = [x for x in rename 
+            if rename[x] in ['Subject Id'] + schema.private_cols]
+        options['usecols'] = keep
+        options['dtype'] = {x: options['dtype'][x] for x in keep}
+        options['na_values'] = {x: options['na_values'][x] 
+            for x in keep if x in options['na_values']}
+        return pd.read_csv(db_path, **options)[keep].rename(
+            columns=rename)
+
+
+    @staticmethod
+    def _add_private(frame, source):
+        """ Insert the private fields of source (a frame with a 
+            Subject Id column) into frame, in place, matching 
+            records by Subject Id. Private fields absent from 
+            source are added as missing.
+        """
+        ids = pd.Series(pd.to_numeric(source['Subject Id']))
+        first = ~ids.duplicated().to_numpy()
+        positions = pd.Index(ids[first]).get_indexer(frame['Subject Id'])
+        for name in schema.private_cols:
+            if name not in source.columns:
+                continue
+            values = source[name][first].reset_index(drop=True)
+            schema.insert_field(frame, name, pd.Series(
+                values.reindex(positions).to_numpy(), index=frame.index,
+                dtype=schema.storage_dtype(name)))
+        schema.apply_schema(frame)
+
+
+    @staticmethod
+    def _report(progress, cancel, stage, rows=None):
+        """ Send load progress and check for cancellation
+        """
+        if (cancel is not None) and cancel.is_set():
+            raise LoadCancelled(f"Cancelled while {stage.lower()}")
+        if progress is not None:
+            progress(stage, rows)
 
-        # Get rid of junk records
-        #self._initial_scrub()
+
+    @staticmethod
+    def _read_options(db_path, include_derived=False):
+        """ Match header row of db_path to the column registry.
+            Raises ValueError if expected columns are missing.
+        """
+        header = pd.read_csv(db_path, nrows=0).columns
+        return schema.read_options(header, include_derived)
 
 
-    def calc_age(self, birthdate):
-        """ Convert birthdate to ages
+    def _read_general_search(self, db_path):
+        """ Parse 'General Search' .csv and return columns of 
+            interest with canonical names, sorted by subject ID
         """
-        today = datetime.now()
-        x = str(birthdate).split('/')
-        try:
-            birth = datetime(int(x[2]), int(x[0]), int(x[1]))
-            age = int((today - birth).days / 365.2425)
-        except TypeError:
-            age = '-'
-        except IndexError:
-            age = '-'
-        except ValueError:
-            age = '-'
-        return age
+        # Import registry columns of database records
+        options, rename = self._read_options(db_path)
+        general_search = pd.read_csv(db_path, **options)
 
+        # Restore registry column order and correct column names
+        short_gen = general_search[list(rename)].rename(columns=rename)
+        schema.apply_schema(short_gen)
 
-    def _initial_scrub(self):
-        """ Perform perfunctory filtering 
+        # Sort dataframe by subject ID
+        return short_gen.sort_values(by='Subject Id').reset_index(
+            drop=True)
+
+
+    def _stream_general_search(self, db_path, scrub_dict, progress=None,
+        cancel=None):
+        """ Read 'General Search' .csv in chunks of self.chunksize
+            rows, dropping records rejected by the scrub_dict 
+            predicates before the next chunk is read. Returns the
+            surviving records, processed as in _read_general_search.
+        """
+        options, rename = self._read_options(db_path)
+        reader = pd.read_csv(db_path, chunksize=self.chunksize, 
+            **options)
+        kept = []
+        rows = 0
+        for chunk in reader:
+            kept.append(self._scrub_chunk(chunk, rename, scrub_dict))
+            rows += chunk.shape[0]
+            self._report(progress, cancel, "Parsing", rows)
+        return self._join_chunks(kept, scrub_dict)
+
+
+    def _parallel_general_search(self, db_path, scrub_dict=None, 
+        progress=None, cancel=None):
+        """ Parse 'General Search' .csv on self.workers processes. 
+            Any scrub_dict predicates are applied by the workers.
+            Returns the same frame as the serial readers.
         """
-        # Remove internal employees
-        self.data = self.data[self.data["Employment Status"] != "Employee"]
-        print(f"Automatically removed internal Starkey employees")
-        print(f"Remaining candidates: {self.data.shape[0]}\n")
+        options, rename = self._read_options(db_path)
+
+        # Report rows read so far as each range comes back
+        rows = [0]
+        def _on_range(chunk):
+            rows[0] += chunk.attrs['scrub_counts'][0]
+            self._report(progress, cancel, "Parsing", rows[0])
+
+        # Rename and scrub each range in the workers
+        transform = functools.partial(self._scrub_chunk, rename=rename,
+            scrub_dict=scrub_dict)
+        kept = parallelcsv.read_csv_parallel(db_path, transform=transform,
+            workers=self.workers, callback=_on_range, **options)
+        return self._join_chunks(kept, scrub_dict)
+
+
+    @staticmethod
+    def _scrub_chunk(chunk, rename, scrub_dict):
+        """ Restore registry column order, correct column names and 
+            drop rows rejected by the scrub_dict predicates. The 
+            number of rows read and remaining after each step is 
+            stored in chunk.attrs['scrub_counts'].
+        """
+        chunk = chunk[list(rename)].rename(columns=rename)
+        # Decimals are read as text; convert them so the scrub
+        # compares numbers
+        for name in [x for x in schema.decimal_cols if x in chunk]:
+            chunk[name] = schema.to_numbers(chunk[name], 
+                schema.storage_dtype(name))
+        counts = [chunk.shape[0]]
+        if scrub_dict:
+            keep = np.ones(chunk.shape[0], dtype=bool)
+            for colname, operator, value in compile_predicates(
+                scrub_dict.values()):
+                keep &= SubDB._scrub_mask(chunk, colname, operator, 
+                    value)
+                counts.append(int(keep.sum()))
+            chunk = chunk[keep]
+        chunk.attrs['scrub_counts'] = counts
+        return chunk
+
+
+    def _join_chunks(self, chunks, scrub_dict):
+        """ Concatenate chunks, finish column types (e.g., merge 
+            categories) and sort by subject ID. Sums per-chunk 
+            scrub counts.
+        """
+        counts = [sum(x) for x in zip(
+            *[chunk.attrs['scrub_counts'] for chunk in chunks])]
 
-        # Remove inactive records
-        self.data = self.data[self.data["Status"] == "Active"]
-        print(f"Automatically removed inactive participants")
-        print(f"Remaining candidates: {self.data.shape[0]}\n")
+        short_gen = pd.concat(chunks, ignore_index=True)
+        schema.apply_schema(short_gen)
+        short_gen.attrs = {}
+        if scrub_dict:
+            short_gen.attrs['scrub_counts'] = counts
 
-        # Remove poor candidates
-        self.data = self.data[self.data["Good Candidate"].isin(["-", 
-            "Excellent", "Good", "Fair"])]
-        print(f"Automatically removed poor candidates")
-        print(f"Remaining candidates: {self.data.shape[0]}\n")
+        # Sort dataframe by subject ID
+        return short_gen.sort_values(by='Subject Id').reset_index(
+            drop=True)
 
 
-    def write(self):
-        """ Save database to .csv"""
+    def set_reference_date(self, reference_date=None):
+        """ Recalculate ages as of reference_date (default: today)
+            so a recruiting run can be reproduced later
+        """
+        self.reference_date = reference_date
+        base = self.engine.base
+        base['Age'] = schema.calc_age(base['Date Of Birth'],
+            self.reference_date)
+        self._fingerprint = None
+        self.filter_cache.clear()
+        self.chain = filterengine.FilterChain(base.shape[0])
+        self.indexes.update(rangeindex.build_indexes(base, ['Age']))
+        self.planner = queryplanner.QueryPlanner(base, self.indexes,
+            self.text_indexes)
+        # Masks of the active steps may depend on the old ages
+        self.engine.reevaluate()
+        print(f"Calculated ages as of {reference_date or 'today'}")
+
+
+    def scrub(self, scrub_dict=None):
+        """ Remove junk records with one filter step per entry of 
+            scrub_dict (default: self.scrub_dict). The steps can be 
+            undone like any other filter. The remaining candidate 
+            count after each step is stored in self.scrub_counts.
+        """
+        if scrub_dict is None:
+            scrub_dict = self.scrub_dict
+        self.scrub_counts = [self.count]
+        for colname, operator, value in compile_predicates(
+            scrub_dict.values()):
+            rule = functools.partial(self._scrub_mask, self.engine.base,
+                colname, operator, value)
+            self.engine.add(f"{colname} {operator} {value}", rule(), rule)
+            print(f"Filtered column '{colname}' for '{value}'")
+            print(f"Remaining candidates: {self.count}\n")
+            self.scrub_counts.append(self.count)
+
+
+    @staticmethod
+    def _scrub_mask(frame, colname, operator, value):
+        """ Return boolean array of frame rows kept by one scrub
+            step (see scrub_keep_missing)
+        """
+        mask = SubDB._mask(frame, colname, operator, value)
+        if colname in SubDB.scrub_keep_missing:
+            mask = mask | frame[colname].isna().to_numpy()
+        return mask
+
+
+    def write(self, include_private=False):
+        """ Save database to .csv. Private fields (see 
+            schema.private_cols) are left out unless 
+            include_private.
+        """
         # Generate date stamp
         now = datetime.now()
         date_stamp = now.strftime("%Y_%b_%d_%H%M")
@@ -164,20 +626,23 @@ class SubDB:
         filename = 'filtered_db_' + str(date_stamp)
 
         # Query user for save path
-        try:
-            save_path = filedialog.asksaveasfile(
-                initialfile= filename,
-                defaultextension='.csv').name
-        except AttributeError:
-            # Do nothing if cancelled
-            return
+        save_path = filedialog.asksaveasfilename(
+            initialfile= filename,
+            defaultextension='.csv',
+            filetypes=EXPORT_FILETYPES)
 
         # Do nothing if cancelled
         if not save_path:
             return
 
         # Write data to .csv file if a valid save path is given
-        self.data.to_csv(save_path, mode='w', index=False)
+        # Write dates in the same format as the CAR database.
+        # A .gz/.zip/.xz extension writes a compressed stream.
+        data = self.data
+        columns = [x for x in data.columns 
+            if include_private or (x not in schema.private_cols)]
+        data.to_csv(save_path, mode='w', index=False, columns=columns,
+            date_format=schema.date_format, compression='infer')
         print("Database successfully written to file!")
 
 
@@ -185,6 +650,14 @@ class SubDB:
     # Filtering Functions #
     #######################
     def filter(self, colname, operator, value):
+        """ Add a filter step for one (colname, operator, value)
+            predicate. The value is converted to the column type 
+            first (raises predicates.PredicateError if it cannot 
+            be).
+        """
+        colname, operator, value = compile_predicate(colname, operator,
+            value)
+
         # Remove rows containing "-" (i.e., no data)
         #self.data = self.data[self.data[colname] != "-"]
         # Check data type of value
@@ -193,83 +666,382 @@ class SubDB:
         #elif isinstance(value, float):
         #    self.data[colname] = self.data[colname].astype("float")
 
-        # Perform filtering
-        # NOTE: Add OR condition to include '-' values for every operator!
-        if operator == "equals":
-            self.data = self.data[self.data[colname] == value]
-        if operator == "does not equal":
-            self.data = self.data[self.data[colname] != value]
-        if operator == ">":
-            self.data = self.data[self.data[colname] > value]
-        if operator == ">=":
-            self.data = self.data[self.data[colname] >= value]
-        if operator == "<":
-            self.data = self.data[self.data[colname] < value]
-        if operator == "<=":
-            self.data = self.data[self.data[colname] <= value]
-        if operator == "contains":
-            self.data = self.data[self.data[colname].isin(value)]
+        # Add filter step (the loaded frame is not changed)
+        rule = lambda: self.planner.mask((colname, operator, value))
+        self.engine.add(f"{colname} {operator} {value}", rule(), rule)
         print(f"Filtered column '{colname}' for '{value}'")
-        print(f"Remaining candidates: {self.data.shape[0]}\n")
+        print(f"Remaining candidates: {self.count}\n")
+
+
+    def filter_all(self, predicates):
+        """ Apply a list of (colname, operator, value) predicates as
+            one filter step. The query planner evaluates the most 
+            selective predicates first, each on the surviving rows 
+            only. Returns a list of (predicate, remaining count) in 
+            the order the predicates were evaluated.
+
+            Results are cached by filter set, database and current
+            view, so repeating a query does not re-evaluate it.
+            Values are converted to the column types first; raises
+            predicates.PredicateError (before filtering anything)
+            if one cannot be.
+        """
+        predicates = compile_predicates(predicates)
+        key = self.filter_cache.key(self.fingerprint, predicates,
+            self.engine.mask)
+        cached = self.filter_cache.get(key, self.engine.base.shape[0])
+        if cached is None:
+            mask, steps = self.planner.execute(predicates, 
+                within=self.engine.mask)
+            self.filter_cache.put(key, mask, steps)
+        else:
+            mask, steps = cached
+            print("Filter results loaded from cache")
+        self.engine.add(" AND ".join(f"{c} {o} {v}" 
+            for c, o, v in predicates), mask, 
+            lambda: self.planner.execute(predicates)[0])
+        for (colname, operator, value), count in steps:
+            print(f"Filtered column '{colname}' for '{value}'")
+            print(f"Remaining candidates: {count}\n")
+        return steps
+
+
+    def filter_rows(self, predicates):
+        """ Apply the rows of the filter grid: a list of (colname, 
+            operator, value) predicates. The grid is a single 
+            filter step that is replaced each time, so rows are 
+            never applied on top of an earlier result.
+
+            The mask after each row is kept. Rows up to the first
+            changed row are reused; each later row is evaluated 
+            only on the rows that passed the rows before it.
+
+            Returns the number of records before the grid, and a 
+            list of (predicate, remaining count) in grid order.
+            Raises predicates.PredicateError (before filtering 
+            anything) if a value does not fit its column type.
+        """
+        predicates = compile_predicates(predicates)
+        start = self.chain.update(predicates, self._extend)
+        print(f"Re-evaluated filter rows {start + 1} to " +
+            f"{len(predicates)}")
+        self.engine.set_step('grid', " AND ".join(f"{c} {o} {v}" 
+            for c, o, v in predicates), self.chain.mask, 
+            lambda: self._grid_mask(predicates))
+
+        within = self.engine.mask_without('grid')
+        steps = list(zip(predicates, self.chain.counts(within)))
+        for (colname, operator, value), count in steps:
+            print(f"Filtered column '{colname}' for '{value}'")
+            print(f"Remaining candidates: {count}\n")
+        return int(within.sum()), steps
+
+
+    def filter_expression(self, text):
+        """ Apply a boolean filter expression (see filterexpr), 
+            e.g., "(RightStyle is RIC OR LeftStyle is RIC) AND 
+            NOT Employment Status = Employee". The expression is a
+            single filter step that is replaced each time it is 
+            applied. Raises filterexpr.ExpressionError if the 
+            expression cannot be parsed.
+
+            Returns the number of records before and after the 
+            expression.
+        """
+        node = filterexpr.parse(text)
+        # Cached by the parsed form, so spacing and keyword case
+        # do not matter
+        key = self.filter_cache.key(self.fingerprint, 
+            [('(expression)', 'matches', str(node))])
+        cached = self.filter_cache.get(key, self.engine.base.shape[0])
+        if cached is None:
+            mask = filterexpr.evaluate(node, self.planner)
+            self.filter_cache.put(key, mask)
+        else:
+            mask = cached[0]
+            print("Filter results loaded from cache")
+        self.engine.set_step('expression', str(node), mask,
+            lambda: filterexpr.evaluate(node, self.planner))
+
+        within = self.engine.mask_without('expression')
+        print(f"Filtered by expression: {node}")
+        print(f"Remaining candidates: {self.count}\n")
+        return int(within.sum()), self.count
+
+
+    def preview_counts(self, predicates, within, cancel=None):
+        """ Return the number of records left after each of a list
+            of (colname, operator, value) predicates, starting from
+            the within mask. Safe to call from a worker thread: 
+            nothing is cached or changed. Stops at the first 
+            predicate whose value does not fit its column type 
+            (returns the counts so far), and returns None if cancel
+            (a threading.Event) is set.
+        """
+        planner = self.planner
+        positions = np.flatnonzero(within)
+        counts = []
+        for predicate in predicates:
+            if (cancel is not None) and cancel.is_set():
+                return None
+            try:
+                predicate = compile_predicate(*predicate)
+            except PredicateError:
+                break
+            keep = planner.evaluate(predicate, positions)
+            positions = positions[keep]
+            counts.append(positions.shape[0])
+        return counts
+
+
+    def _grid_mask(self, predicates):
+        """ Return the mask after all filter grid rows, evaluating
+            the rows the chain does not hold
+        """
+        self.chain.update(predicates, self._extend)
+        return self.chain.mask
+
+
+    def _extend(self, predicates, previous):
+        """ Return the mask of rows passing all predicates, given
+            the mask of rows passing all but the last. Masks of 
+            each predicate set are cached.
+        """
+        rows = self.engine.base.shape[0]
+        key = self.filter_cache.key(self.fingerprint, predicates)
+        cached = self.filter_cache.get(key, rows)
+        if cached is not None:
+            return cached[0]
+
+        positions = np.flatnonzero(previous)
+        keep = self.planner.evaluate(predicates[-1], positions)
+        mask = np.zeros(rows, dtype=bool)
+        mask[positions[keep]] = True
+        self.filter_cache.put(key, mask)
+        return mask
+
+
+    @staticmethod
+    def _mask(frame, colname, operator, value):
+        """ Return boolean array of frame rows matching 
+            (colname, operator, value)
+        """
+        return queryplanner.predicate_mask(frame[colname], operator,
+            value)
 
 
-    def ac_thresh_filt(self, thresh_dict):
+    @property
+    def ac_matrix(self):
+        """ AC thresholds of the loaded database as a (subjects, 
+            ears, frequencies) array (see schema.ac_matrix)
+        """
+        if self._ac_matrix is None:
+            self._ac_matrix = schema.ac_matrix(self.engine.base)
+        return self._ac_matrix
+
+
+    @property
+    def audiogram_index(self):
+        """ Threshold vectors of the loaded database for similarity
+            search (built on first use after each load)
+        """
+        if self._audiogram_index is None:
+            self._audiogram_index = audiosearch.AudiogramIndex(
+                self.engine.base)
+        return self._audiogram_index
+
+
+    def similar_subjects(self, sub_id=None, thresholds=None, k=10,
+        filtered=True):
+        """ Return the k subjects with audiograms most similar to 
+            subject sub_id, or to a dict of threshold column to 
+            value (see audiosearch.parse_audiogram). If filtered, 
+            only records in the filtered view are searched.
+
+            Returns a DataFrame of Subject Id, Distance (RMS 
+            threshold difference in dB) and Frequencies (number 
+            of thresholds compared), closest first.
+        """
+        index = self.audiogram_index
+        base = self.engine.base
+        exclude = None
+        if sub_id is not None:
+            positions = np.flatnonzero((base['Subject Id'] == 
+                sub_id).to_numpy())
+            if positions.shape[0] == 0:
+                raise ValueError(f"No subject with ID {sub_id}")
+            exclude = positions[0]
+            vector = index.row(exclude)
+        else:
+            vector = index.query(thresholds)
+
+        within = self.engine.mask if filtered else None
+        positions, distances, shared = index.nearest(vector, k, 
+            within=within, exclude=exclude)
+        return pd.DataFrame({
+            'Subject Id': base['Subject Id'].to_numpy()[positions],
+            'Distance': np.round(distances, 1),
+            'Frequencies': shared,
+        })
+
+
+    @property
+    def name_index(self):
+        """ Trigram index of names and addresses for subject 
+            lookup (built on first use after each load)
+        """
+        if self._name_index is None:
+            self._name_index = namesearch.NameIndex(self.engine.base)
+        return self._name_index
+
+
+    def find_subjects(self, text, k=10, filtered=False):
+        """ Return the k subjects whose name or address best 
+            matches text, allowing for misspellings (see 
+            namesearch). If filtered, only records in the filtered
+            view are searched.
+
+            Returns a DataFrame of Subject Id, Name, Address and 
+            Score (0 to 1; 1 is an exact match), best first.
+        """
+        within = self.engine.mask if filtered else None
+        positions, scores = self.name_index.search(text, k, 
+            within=within)
+        base = self.engine.base
+        return pd.DataFrame({
+            'Subject Id': base['Subject Id'].to_numpy()[positions],
+            'Name': base['Name'].to_numpy()[positions],
+            'Address': base['Address'].to_numpy()[positions],
+            'Score': np.round(scores, 2),
+        })
+
+
+    def template_mask(self, thresh_dict, ears='both', missing='exclude'):
+        """ Return boolean array of subjects whose AC thresholds 
+            fall within an audiogram template: a dict of frequencies
+            with tuple of lower and upper threshold limits (see 
+            audio_dict). The whole template is evaluated as one 
+            broadcast comparison.
+
+            Ears is 'both', 'either', 'right' or 'left'. Missing is
+            'exclude' (a missing threshold at a template frequency
+            fails the ear) or 'ignore' (missing thresholds are 
+            skipped, but the ear needs at least one measured 
+            template frequency).
+        """
+        freqs = [schema.ac_freqs.index(int(x)) for x in thresh_dict]
+        bounds = np.array(list(thresh_dict.values()), dtype='float32')
+        # (subjects, ears, template frequencies)
+        thresholds = self.ac_matrix[:, :, freqs]
+        in_range = (thresholds >= bounds[:, 0]) & \
+            (thresholds <= bounds[:, 1])
+
+        if missing == 'exclude':
+            ear_ok = in_range.all(axis=2)
+        elif missing == 'ignore':
+            measured = ~np.isnan(thresholds)
+            ear_ok = (in_range | ~measured).all(axis=2) & \
+                measured.any(axis=2)
+        else:
+            raise ValueError(f"Unknown missing value option: {missing}")
+
+        if ears == 'both':
+            return ear_ok.all(axis=1)
+        elif ears == 'either':
+            return ear_ok.any(axis=1)
+        elif ears == 'right':
+            return ear_ok[:, 0]
+        elif ears == 'left':
+            return ear_ok[:, 1]
+        raise ValueError(f"Unknown ears option: {ears}")
+
+
+    def ac_thresh_filt(self, thresh_dict, ears='both', missing='exclude',
+        name=None):
         """ Filter by right/left air conduction thresholds. 
             Expects dict of frequencies with tuple of lower
-            and upper threshold limits.
+            and upper threshold limits. See template_mask for
+            ears and missing.
         """
-        sides = ["RightAC", "LeftAC"]
-        for side in sides:
-            for key in thresh_dict:
-                # Construct column name
-                colname = side + " " + key
-                # Remove rows containing "-" (i.e., no data)
-                self.data = self.data[self.data[colname] != "-"]
-                # Convert column to int
-                self.data[colname] = self.data[colname].astype("int")
-                # Exclude thresholds above dict value 1
-                self.data = self.data[self.data[colname] <= thresh_dict[key][1]]
-                # Exclude thresholds below dict value 0
-                self.data = self.data[self.data[colname] >= thresh_dict[key][0]]
+        mask = self.template_mask(thresh_dict, ears, missing)
+        label = f"AC template {name}" if name \
+            else "AC thresholds within limits"
+        self.engine.add(f"{label} ({ears} ears, missing: {missing})", 
+            mask)
 
         print("Filtered by provided air conduction threshold limits")
-        print(f"Remaining candidates: {self.data.shape[0]}\n")
+        print(f"Remaining candidates: {self.count}\n")
+
+
+    def undo_filter(self):
+        """ Undo the last change to the filter steps. Returns 
+            False if there is nothing to undo.
+        """
+        return self.engine.undo()
+
+
+    def redo_filter(self):
+        """ Redo the last undone change to the filter steps. 
+            Returns False if there is nothing to redo.
+        """
+        return self.engine.redo()
+
+
+    def remove_filter(self, index):
+        """ Remove active filter step number index (0-based)
+        """
+        self.engine.remove(index)
+
+
+    def clear_grid(self):
+        """ Remove the filter grid and expression steps (e.g., after
+            the filter rows were cleared), keeping the other steps
+        """
+        self.engine.remove_tagged('grid', 'expression')
+        self.chain = filterengine.FilterChain(self.engine.base.shape[0])
+
+
+    def value_counts(self, colname):
+        """ Number of records in the filtered view with each value 
+            of an indexed categorical column
+        """
+        return self.indexes[colname].value_counts(
+            within=self.engine.mask)
+
+
+    def filter_steps(self):
+        """ Return a list of (label, remaining count) for the 
+            active filter steps
+        """
+        return list(zip([step.label for step in self.engine.steps],
+            self.engine.counts()[1:]))
 
 
     def get_thresholds(self, sub_id):
         """ Make a dictionary of subject thresholds """
-        # Get AC thresholds
-        sides = ["RightAC", "LeftAC"]
-        freqs = [250, 500, 750, 1000, 1500, 2000, 3000, 4000, 6000, 8000]
-        ac = {}
-        for side in sides:
-            for freq in freqs:
-                colname = side + " " + str(freq)
-                #ac.append(self.data[self.data['Subject Id'] == sub_id][colname].astype(int))
-                try:
-                    ac[side + ' ' + str(freq)] = int(
-                        self.data[self.data['Subject Id'] == sub_id][colname].values[0])
-                except:
-                    ac[side + ' ' + str(freq)] = None
-
-        # Get BC thresholds
-        sides = ["RightBC", "LeftBC"]
-        freqs = [500, 1000, 2000, 4000]
-        bc = {}
-        for side in sides:
-            for freq in freqs:
-                colname = side + " " + str(freq)
+        # Get subject record
+        base = self.engine.base
+        record = base[(base['Subject Id'] == sub_id).to_numpy()]
+
+        # Get AC and BC thresholds (missing values are None)
+        thresholds = ({}, {})
+        for cols, values in zip([schema.ac_cols, schema.bc_cols], 
+            thresholds):
+            for colname in cols:
                 try:
-                    bc[side + ' ' + str(freq)] = int(
-                        self.data[self.data['Subject Id'] == sub_id][colname].values[0])
-                except:
-                    bc[side + ' ' + str(freq)] = None
+                    value = record[colname].values[0]
+                except IndexError:
+                    value = pd.NA
+                values[colname] = None if pd.isna(value) else int(value)
+        ac, bc = thresholds
 
         return ac, bc
 
 
     def audio_ac(self, sub_id, ax=None):
         if ax is None:
+            # Imported on first use to keep startup fast
+            import matplotlib.pyplot as plt
             ax = plt.gca()
 
         # Get AC and BC thresholds
@@ -372,7 +1144,11 @@ class SubDB:
     # Acoustic Coupling Functions #
     ###############################
     def coupling(self, sub_id):
-        """ Return ProFit recommended coupling and vent size"""
+        """ Return ProFit recommended coupling and vent size.
+            The same rules are applied to all records at load time
+            (the Pro Fit feature columns, see features.py); this
+            is the single-subject reference.
+        """
 
         # Get subject thresholds
         ac, bc = self.get_thresholds(sub_id)
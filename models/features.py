@@ -0,0 +1,173 @@
+""" Derived audiometric features
+
+    Computes per-subject summary measures from the air conduction
+    thresholds, for all subjects at once:
+      - Pure tone average (PTA) and high-frequency PTA of each ear
+      - Degree of hearing loss of each ear (from the PTA)
+      - Interaural asymmetry (PTA difference) and better ear
+      - ProFit RIC matrix, acoustic coupling and vent size of each
+        ear (same rules as SubDB.coupling)
+
+    The features are registry fields (see schema.feature_cols), so
+    they can be filtered like any other column. They are computed
+    when records are read and cached with them, so they are only
+    recalculated for records whose thresholds were (re)read.
+
+    Author: Travis M. Moore
+"""
+
+###########
+# Imports #
+###########
+# Import data science packages
+import numpy as np
+import pandas as pd
+
+# Import custom modules
+from models import schema
+
+
+#########
+# BEGIN #
+#########
+# Frequencies averaged for the PTA and high-frequency PTA. A PTA is
+# missing if any of its thresholds is missing.
+pta_freqs = [500, 1000, 2000]
+hf_pta_freqs = [2000, 4000, 8000]
+
+# Degree of hearing loss by PTA: upper limit (dB HL) of each band
+degrees = {
+    'normal': 25,
+    'mild': 40,
+    'moderate': 55,
+    'moderately-severe': 70,
+    'severe': 90,
+    'profound': np.inf,
+}
+
+
+def _average(ac, freqs):
+    """ Mean threshold over freqs for each subject and ear
+    """
+    cols = [schema.ac_freqs.index(x) for x in freqs]
+    # NaN if any threshold is missing
+    return ac[:, :, cols].mean(axis=2)
+
+
+def _degree(pta):
+    """ Categorical degree of hearing loss for an array of PTAs
+    """
+    names = list(degrees)
+    codes = np.searchsorted(np.array(list(degrees.values())), pta,
+        side='left')
+    codes = np.where(np.isnan(pta), -1, codes)
+    return pd.Categorical.from_codes(codes, categories=names)
+
+
+# ProFit recommendation values, in category order
+profit_matrices = ['M', 'P', 'UP']
+profit_couplings = ['Open Dome', 'Occluded Dome', 'Earmold', '-', 'Error!']
+profit_vents = ['Large', 'Medium', 'Small', 'NA']
+
+
+def _profit(ac):
+    """ Return (matrix, coupling, vent) categoricals for one ear 
+        from its (subjects, frequencies) AC thresholds, applying 
+        the rules of SubDB.coupling to all subjects at once.
+
+        The conditions mirror the scalar code exactly, including
+        how Python evaluates it: 'a250 and a500 < 30' is true when
+        250 Hz is measured and non-zero and 500 Hz is below 30, and
+        a missing threshold that the scalar code compares gives 
+        '-'. Where the scalar code raises TypeError (no threshold 
+        at 500 or 2000 Hz; earmold without a 1000 Hz threshold for
+        the vent), the values are missing.
+    """
+    a250, a500, a1k, a2k = (ac[:, schema.ac_freqs.index(x)] 
+        for x in (250, 500, 1000, 2000))
+    has_1k = ~np.isnan(a1k)
+    # Truth value of the 250 Hz threshold (None and 0 are false)
+    t250 = ~np.isnan(a250) & (a250 != 0)
+
+    with np.errstate(invalid='ignore'):
+        # Step 1: recommendation threshold
+        threshold = np.where(a2k >= a500, a2k, a500 + 10)
+        valid = ~np.isnan(a500) & ~np.isnan(a2k)
+        # Step 2: matrix (M up to 65, P up to 80, UP above)
+        matrix = np.searchsorted([65, 80], threshold, side='left')
+        stock = matrix <= 1
+
+        # Coupling: first matching rule wins
+        open_dome = t250 & (a500 < 30)
+        occluded = t250 & (a500 <= 50)
+        coupling = np.select([
+            open_dome & ~has_1k,
+            open_dome & (a1k <= 60) & stock,
+            occluded & ~has_1k,
+            occluded & (a1k <= 60) & stock,
+            t250 | (a500 > 50),
+            ~has_1k,
+            a1k > 60,
+        ], [3, 0, 3, 1, 2, 3, 2], default=4)
+
+        # Vent size for earmolds, from the 500/1000 Hz average
+        average = (a500 + a1k) / 2
+        vent = np.select([coupling != 2, average <= 40, average < 55],
+            [3, 0, 1], default=2)
+
+    vent = np.where(valid & ((coupling != 2) | has_1k), vent, -1)
+    return (
+        pd.Categorical.from_codes(np.where(valid, matrix, -1), 
+            categories=profit_matrices),
+        pd.Categorical.from_codes(np.where(valid, coupling, -1),
+            categories=profit_couplings),
+        pd.Categorical.from_codes(vent, categories=profit_vents),
+    )
+
+
+def compute(frame):
+    """ Return DataFrame of the feature columns for frame, which
+        needs the AC threshold columns
+    """
+    ac = schema.ac_matrix(frame).astype('float64')
+    pta = _average(ac, pta_freqs)
+    hf_pta = _average(ac, hf_pta_freqs)
+    right, left = pta[:, 0], pta[:, 1]
+
+    better = np.select([right < left, left < right], ['Right', 'Left'],
+        default='Equal').astype(object)
+    better[np.isnan(right) | np.isnan(left)] = None
+
+    features = pd.DataFrame({
+        'Right PTA': right,
+        'Left PTA': left,
+        'Right HF PTA': hf_pta[:, 0],
+        'Left HF PTA': hf_pta[:, 1],
+        'Right Degree': _degree(right),
+        'Left Degree': _degree(left),
+        'PTA Asymmetry': np.abs(right - left),
+        'Better Ear': pd.Categorical(better,
+            categories=['Equal', 'Left', 'Right']),
+        # NaN if either ear is missing (np.minimum propagates NaN)
+        'Better Ear PTA': np.minimum(right, left),
+    }, index=frame.index)
+    for ii, side in enumerate(['Right', 'Left']):
+        matrix, coupling, vent = _profit(ac[:, ii, :])
+        features[f'{side} Pro Fit Matrix'] = matrix
+        features[f'{side} Pro Fit Coupling'] = coupling
+        features[f'{side} Pro Fit Vent'] = vent
+
+    for name in schema.feature_cols:
+        if features[name].dtype.kind == 'f':
+            # Rounded to 0.1 dB
+            features[name] = features[name].round(1).astype(
+                schema.storage_dtype(name))
+    return features[schema.feature_cols]
+
+
+def add_features(frame):
+    """ Add (or replace) the feature columns of frame, in place
+    """
+    features = compute(frame)
+    for name in schema.feature_cols:
+        frame[name] = features[name]
@@ -0,0 +1,115 @@
+""" In-memory LRU cache of filter results
+
+    Keyed by an order-independent form of the filter predicates,
+    a fingerprint of the loaded database and the view the filters
+    were applied to. Stores the matching row set and the per-step
+    remaining counts, so repeating a query skips evaluation.
+
+    Author: Travis M. Moore
+"""
+
+###########
+# Imports #
+###########
+# Import data science packages
+import numpy as np
+import pandas as pd
+
+# Import system packages
+import hashlib
+from collections import OrderedDict
+
+
+#########
+# BEGIN #
+#########
+def fingerprint(frame):
+    """ Return a hash of the contents of frame
+    """
+    hashes = pd.util.hash_pandas_object(frame, index=False).to_numpy()
+    hasher = hashlib.blake2b(digest_size=16)
+    hasher.update(repr(list(frame.columns)).encode('utf-8'))
+    hasher.update(hashes.tobytes())
+    return hasher.hexdigest()
+
+
+class FilterCache:
+    """ Bounded least recently used cache of filter results
+    """
+
+    # Number of filter results to keep
+    max_entries = 64
+
+    def __init__(self, max_entries=None):
+        if max_entries is not None:
+            self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+
+    @staticmethod
+    def normalize(predicates):
+        """ Return an order-independent, hashable form of a list
+            of (colname, operator, value) predicates
+        """
+        normal = []
+        for colname, operator, value in predicates:
+            if isinstance(value, (list, tuple, set)):
+                # 'contains' values: order and repeats do not matter
+                value = tuple(sorted(set(value), key=repr))
+            normal.append((colname, operator, value))
+        return frozenset(normal)
+
+
+    def key(self, db_fingerprint, predicates, within=None):
+        """ Cache key for predicates applied to the database with
+            db_fingerprint. Within is an optional mask of the rows
+            the per-step counts were taken from.
+        """
+        view = None
+        if within is not None:
+            view = hashlib.blake2b(np.packbits(within).tobytes(),
+                digest_size=16).hexdigest()
+        return (db_fingerprint, view, self.normalize(predicates))
+
+
+    def get(self, key, rows):
+        """ Return (mask, steps) for key, or None on a miss. Rows
+            is the number of rows in the database.
+        """
+        if key not in self._entries:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._entries.move_to_end(key)
+        positions, steps = self._entries[key]
+        mask = np.zeros(rows, dtype=bool)
+        mask[positions] = True
+        return mask, list(steps)
+
+
+    def put(self, key, mask, steps=()):
+        """ Store the row set of mask and the per-step counts
+        """
+        self._entries[key] = (np.flatnonzero(mask).astype(np.int32),
+            tuple(steps))
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+
+    def clear(self):
+        self._entries.clear()
+
+
+    def stats(self):
+        """ Return dict of hits, misses, hit rate and entries
+        """
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+            'entries': len(self._entries),
+        }
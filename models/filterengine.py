@@ -0,0 +1,307 @@
+""" Non-destructive filtering of the subject database
+
+    Keeps the loaded database frame unchanged and represents each
+    filter step as a boolean row mask. The current view is the AND
+    of the active masks. Every change to the list of active steps
+    (adding, replacing, removing or clearing) is recorded, so 
+    filters can be undone and redone without re-reading the 
+    database.
+
+    The rows of the filter grid are kept as a chain of prefix 
+    masks, so editing row k only re-evaluates rows k and later.
+
+    Author: Travis M. Moore
+"""
+
+###########
+# Imports #
+###########
+# Import data science packages
+import numpy as np
+
+
+#########
+# BEGIN #
+#########
+class FilterStep:
+    """ One filter step: a description and a boolean mask over
+        the rows of the base frame. Tag optionally identifies a
+        step that is replaced rather than added to. Rule is an 
+        optional function that returns the mask again (see 
+        FilterEngine.reevaluate).
+    """
+    def __init__(self, label, mask, tag=None, rule=None):
+        self.label = label
+        self.mask = mask
+        self.tag = tag
+        self.rule = rule
+
+
+    def __repr__(self):
+        return f"FilterStep({self.label!r}, {int(self.mask.sum())} rows)"
+
+
+class FilterEngine:
+    """ Filter steps over an immutable base frame
+    """
+
+    def __init__(self, base):
+        self.set_base(base)
+
+
+    #####################
+    # General Functions #
+    #####################
+    def set_base(self, base):
+        """ Replace the base frame and discard all filter steps
+        """
+        self.base = base
+        # History of active step lists; position is the current one
+        self._history = [()]
+        self._position = 0
+        self._cache = {}
+
+
+    @property
+    def steps(self):
+        """ Active filter steps, in the order they were added
+        """
+        return list(self._history[self._position])
+
+
+    def _push(self, steps):
+        """ Make steps the active list, dropping any redo history
+        """
+        del self._history[self._position + 1:]
+        self._history.append(tuple(steps))
+        self._position += 1
+        self._cache = {}
+
+
+    def _check(self, mask):
+        mask = np.asarray(mask, dtype=bool)
+        if mask.shape != (self.base.shape[0],):
+            raise ValueError(f"Mask has {mask.shape[0]} rows; " +
+                f"database has {self.base.shape[0]}")
+        return mask
+
+
+    def add(self, label, mask, rule=None):
+        """ Add a filter step. Mask is a boolean array (or Series)
+            with one value per row of the base frame.
+        """
+        self._push(self.steps + [FilterStep(label, self._check(mask),
+            rule=rule)])
+
+
+    def set_step(self, tag, label, mask, rule=None):
+        """ Replace the active step with tag (in place), or add it
+            if there is none
+        """
+        step = FilterStep(label, self._check(mask), tag, rule)
+        steps = self.steps
+        for ii, x in enumerate(steps):
+            if x.tag == tag:
+                steps[ii] = step
+                break
+        else:
+            steps.append(step)
+        self._push(steps)
+
+
+    def mask_without(self, tag):
+        """ AND of the active step masks, except the step with tag
+        """
+        mask = np.ones(self.base.shape[0], dtype=bool)
+        for step in self.steps:
+            if step.tag != tag:
+                mask &= step.mask
+        return mask
+
+
+    def remove(self, index):
+        """ Remove the active step at index (0-based)
+        """
+        steps = self.steps
+        del steps[index]
+        self._push(steps)
+
+
+    def remove_tagged(self, *tags):
+        """ Remove the active steps with any of tags (one change 
+            to undo), if there are any
+        """
+        steps = [x for x in self.steps if x.tag not in tags]
+        if len(steps) < len(self.steps):
+            self._push(steps)
+
+
+    def clear(self):
+        """ Remove all active steps (can be undone)
+        """
+        if self.steps:
+            self._push([])
+
+
+    def can_undo(self):
+        return self._position > 0
+
+
+    def can_redo(self):
+        return self._position < len(self._history) - 1
+
+
+    def undo(self):
+        """ Return to the previous list of steps. Returns False
+            if there is nothing to undo.
+        """
+        if not self.can_undo():
+            return False
+        self._position -= 1
+        self._cache = {}
+        return True
+
+
+    def redo(self):
+        """ Reapply the most recently undone change. Returns False
+            if there is nothing to redo.
+        """
+        if not self.can_redo():
+            return False
+        self._position += 1
+        self._cache = {}
+        return True
+
+
+    def refresh(self):
+        """ Drop cached views (e.g., after a derived column of the
+            base frame was recalculated)
+        """
+        self._cache = {}
+
+
+    def reevaluate(self):
+        """ Recalculate the masks of the active steps that have a
+            rule (e.g., after a derived column of the base frame
+            was recalculated). Steps without a rule keep their 
+            mask. The undo history is discarded: its masks were 
+            calculated from the old values.
+        """
+        steps = [FilterStep(x.label, self._check(x.rule()), x.tag, 
+            x.rule) if x.rule else x for x in self.steps]
+        self._history = [tuple(steps)]
+        self._position = 0
+        self._cache = {}
+
+
+    ##################
+    # View Functions #
+    ##################
+    @property
+    def mask(self):
+        """ AND of the active step masks
+        """
+        if 'mask' not in self._cache:
+            mask = np.ones(self.base.shape[0], dtype=bool)
+            for step in self.steps:
+                mask &= step.mask
+            self._cache['mask'] = mask
+        return self._cache['mask']
+
+
+    @property
+    def count(self):
+        """ Number of rows in the current view
+        """
+        if 'count' not in self._cache:
+            self._cache['count'] = int(self.mask.sum())
+        return self._cache['count']
+
+
+    def counts(self):
+        """ Rows remaining after each active step, starting with
+            the number of rows in the base frame
+        """
+        mask = np.ones(self.base.shape[0], dtype=bool)
+        counts = [int(mask.sum())]
+        for step in self.steps:
+            mask &= step.mask
+            counts.append(int(mask.sum()))
+        return counts
+
+
+    def column(self, name):
+        """ Values of one column for the rows in the current view
+        """
+        return self.base[name][self.mask]
+
+
+    def view(self):
+        """ Current view as a frame. The rows are only copied on
+            first access after the active steps change.
+        """
+        if 'view' not in self._cache:
+            if self.count == self.base.shape[0]:
+                self._cache['view'] = self.base
+            else:
+                self._cache['view'] = self.base[self.mask]
+        return self._cache['view']
+
+
+class FilterChain:
+    """ Prefix masks for an ordered list of filter rows: mask j
+        is the AND of rows 0..j over all rows of the base frame
+    """
+
+    def __init__(self, rows):
+        self.rows = rows
+        self.predicates = []
+        self.prefixes = []
+
+
+    @staticmethod
+    def _normal(predicate):
+        colname, operator, value = predicate
+        if isinstance(value, (list, tuple)):
+            value = tuple(value)
+        return (colname, operator, value)
+
+
+    def update(self, predicates, extend):
+        """ Make predicates the filter rows. Rows before the first
+            changed row keep their prefix masks; later rows are 
+            re-evaluated with extend(predicates[:j+1], previous 
+            prefix mask), which returns the prefix mask for row j.
+            Returns the index of the first re-evaluated row.
+        """
+        start = 0
+        for old, new in zip(self.predicates, predicates):
+            if self._normal(old) != self._normal(new):
+                break
+            start += 1
+        del self.prefixes[start:]
+
+        for jj in range(start, len(predicates)):
+            previous = self.prefixes[jj - 1] if jj else \
+                np.ones(self.rows, dtype=bool)
+            self.prefixes.append(extend(predicates[:jj + 1], previous))
+        self.predicates = list(predicates)
+        return start
+
+
+    @property
+    def mask(self):
+        """ Mask after all rows
+        """
+        if not self.prefixes:
+            return np.ones(self.rows, dtype=bool)
+        return self.prefixes[-1]
+
+
+    def counts(self, within=None):
+        """ Rows remaining after each filter row, counting only
+            rows also in the within mask
+        """
+        if within is None:
+            return [int(x.sum()) for x in self.prefixes]
+        return [int((x & within).sum()) for x in self.prefixes]
@@ -0,0 +1,381 @@
+""" Boolean filter expressions for the subject database
+
+    Parses expressions such as:
+        (RightStyle is RIC OR LeftStyle is RIC)
+            AND NOT Employment Status = Employee
+        Miles From Starkey <= 60 OR Miles From Starkey is missing
+        Status in (Active, -) AND RightAC 1000 >= 40
+
+    into a tree of And/Or/Not/Compare/Missing nodes, and evaluates
+    the tree as boolean masks over the database rows. Each
+    comparison is evaluated in one vectorized step (using an index
+    when there is one), and only on the rows still undecided by the
+    branches before it.
+
+    Grammar (keywords are not case sensitive):
+        expression := term ('OR' term)*
+        term       := factor ('AND' factor)*
+        factor     := 'NOT' factor | '(' expression ')' | comparison
+        comparison := field operator value | field 'is missing'
+        operator   := = | == | != | <> | < | <= | > | >= | is |
+                      is not | equals | does not equal | in | contains
+        value      := word(s) | "quoted text" | ( value, value, ... )
+
+    Field names may contain spaces; they are matched to the column
+    registry (including header aliases), ignoring case.
+
+    Author: Travis M. Moore
+"""
+
+###########
+# Imports #
+###########
+# Import data science packages
+import numpy as np
+
+# Import system packages
+import re
+
+# Import custom modules
+from models import schema
+from models.predicates import PredicateError, compile_predicate
+
+
+#########
+# BEGIN #
+#########
+class ExpressionError(ValueError):
+    """ Raised for expressions that cannot be parsed
+    """
+    pass
+
+
+# Operator spellings, longest first, mapped to filter operators
+operators = [
+    (('does', 'not', 'equal'), 'does not equal'),
+    (('is', 'not'), 'does not equal'),
+    (('equals',), 'equals'),
+    (('is',), 'equals'),
+    (('text', 'contains'), 'text contains'),
+    (('matches',), 'text contains'),
+    (('contains',), 'contains'),
+    (('in',), 'contains'),
+    (('==',), 'equals'),
+    (('=',), 'equals'),
+    (('!=',), 'does not equal'),
+    (('<>',), 'does not equal'),
+    (('<=',), '<='),
+    (('>=',), '>='),
+    (('<',), '<'),
+    (('>',), '>'),
+]
+
+# Tokens: quoted text, comparison symbols, parentheses and commas,
+# and words (anything else without spaces)
+_token = re.compile(r'\s*(?:"([^"]*)"|(==|!=|<>|<=|>=|=|<|>)|([(),\[\]])'
+    r'|([^\s(),\[\]"=<>!]+))')
+
+
+def tokenize(text):
+    """ Return list of (kind, text) tokens, where kind is 'text'
+        (quoted), 'symbol', 'paren' or 'word'
+    """
+    tokens = []
+    pos = 0
+    text = text.strip()
+    while pos < len(text):
+        match = _token.match(text, pos)
+        if (match is None) or (match.end() == pos):
+            raise ExpressionError(f"Unexpected character at " +
+                f"position {pos + 1}: {text[pos]!r}")
+        quoted, symbol, paren, word = match.groups()
+        if quoted is not None:
+            tokens.append(('text', quoted))
+        elif symbol is not None:
+            tokens.append(('symbol', symbol))
+        elif paren is not None:
+            tokens.append(('paren', {'[': '(', ']': ')'}.get(paren,
+                paren)))
+        else:
+            tokens.append(('word', word))
+        pos = match.end()
+    return tokens
+
+
+def _field_names():
+    """ Map of lower case field names and aliases to canonical names
+    """
+    names = {}
+    for name, spec in schema.fields.items():
+        for x in [name] + spec.get('aliases', []):
+            names[' '.join(x.split()).lower()] = name
+    return names
+
+
+#########
+# Nodes #
+#########
+class Compare:
+    """ Leaf: (field, operator, value) predicate
+    """
+    def __init__(self, field, operator, value):
+        self.field = field
+        self.operator = operator
+        self.value = value
+
+    def predicates(self):
+        return [(self.field, self.operator, self.value)]
+
+    def evaluate(self, planner, rows):
+        return planner.evaluate((self.field, self.operator, self.value),
+            rows)
+
+    def __str__(self):
+        return f"{self.field} {self.operator} {self.value}"
+
+
+class Missing:
+    """ Leaf: field has no data (missing, or the '-' placeholder)
+    """
+    def __init__(self, field):
+        self.field = field
+
+    def predicates(self):
+        return []
+
+    def evaluate(self, planner, rows):
+        col = planner.frame[self.field].iloc[rows]
+        missing = col.isna().to_numpy()
+        if col.dtype.kind not in 'biufM':
+            missing = missing | (col == '-').fillna(False).to_numpy(
+                dtype=bool)
+        return missing
+
+    def __str__(self):
+        return f"{self.field} is missing"
+
+
+class Not:
+    def __init__(self, operand):
+        self.operand = operand
+
+    def predicates(self):
+        return self.operand.predicates()
+
+    def evaluate(self, planner, rows):
+        return ~self.operand.evaluate(planner, rows)
+
+    def __str__(self):
+        return f"NOT {self.operand}"
+
+
+class And:
+    def __init__(self, operands):
+        self.operands = operands
+
+    def predicates(self):
+        return [x for op in self.operands for x in op.predicates()]
+
+    def evaluate(self, planner, rows):
+        """ Each operand only sees rows that passed the ones before
+        """
+        result = np.ones(rows.shape[0], dtype=bool)
+        todo = np.arange(rows.shape[0])
+        for operand in self.operands:
+            keep = operand.evaluate(planner, rows[todo])
+            result[todo[~keep]] = False
+            todo = todo[keep]
+        return result
+
+    def __str__(self):
+        return "(" + " AND ".join(str(x) for x in self.operands) + ")"
+
+
+class Or:
+    def __init__(self, operands):
+        self.operands = operands
+
+    def predicates(self):
+        return [x for op in self.operands for x in op.predicates()]
+
+    def evaluate(self, planner, rows):
+        """ Each operand only sees rows not matched by the ones
+            before
+        """
+        result = np.zeros(rows.shape[0], dtype=bool)
+        todo = np.arange(rows.shape[0])
+        for operand in self.operands:
+            match = operand.evaluate(planner, rows[todo])
+            result[todo[match]] = True
+            todo = todo[~match]
+        return result
+
+    def __str__(self):
+        return "(" + " OR ".join(str(x) for x in self.operands) + ")"
+
+
+##########
+# Parser #
+##########
+class Parser:
+    """ Recursive descent parser for filter expressions
+    """
+
+    # Words that end a multi-word value
+    _stop = ('and', 'or')
+
+    def __init__(self, text):
+        self.tokens = tokenize(text)
+        self.pos = 0
+        self.names = _field_names()
+
+
+    def parse(self):
+        if not self.tokens:
+            raise ExpressionError("Expression is empty")
+        node = self._expression()
+        if self.pos < len(self.tokens):
+            raise ExpressionError(f"Unexpected " +
+                f"'{self.tokens[self.pos][1]}' after complete expression")
+        return node
+
+
+    def _peek(self, offset=0):
+        pos = self.pos + offset
+        return self.tokens[pos] if pos < len(self.tokens) else (None, None)
+
+
+    def _keyword(self, word):
+        kind, text = self._peek()
+        if (kind == 'word') and (text.lower() == word):
+            self.pos += 1
+            return True
+        return False
+
+
+    def _expression(self):
+        operands = [self._term()]
+        while self._keyword('or'):
+            operands.append(self._term())
+        return operands[0] if len(operands) == 1 else Or(operands)
+
+
+    def _term(self):
+        operands = [self._factor()]
+        while self._keyword('and'):
+            operands.append(self._factor())
+        return operands[0] if len(operands) == 1 else And(operands)
+
+
+    def _factor(self):
+        if self._keyword('not'):
+            return Not(self._factor())
+        if self._peek() == ('paren', '('):
+            self.pos += 1
+            node = self._expression()
+            if self._peek() != ('paren', ')'):
+                raise ExpressionError("Missing closing parenthesis")
+            self.pos += 1
+            return node
+        return self._comparison()
+
+
+    def _operator(self):
+        """ Match an operator at the current position and return
+            it, or None
+        """
+        for spelling, operator in operators:
+            words = [self._peek(ii) for ii in range(len(spelling))]
+            if all((text is not None) and (kind in ('word', 'symbol'))
+                and (text.lower() == x)
+                for (kind, text), x in zip(words, spelling)):
+                self.pos += len(spelling)
+                return operator
+        return None
+
+
+    def _comparison(self):
+        # Field: words up to the operator
+        start = self.pos
+        words = []
+        operator = None
+        while self.pos < len(self.tokens):
+            operator = self._operator()
+            if operator is not None:
+                break
+            kind, text = self._peek()
+            if kind not in ('word', 'text'):
+                break
+            words.append(text)
+            self.pos += 1
+        if not words:
+            raise ExpressionError(f"Expected a field name at token " +
+                f"{start + 1}")
+        field = self.names.get(' '.join(words).lower())
+        if field is None:
+            raise ExpressionError(f"Unknown field: '{' '.join(words)}'")
+        if operator is None:
+            raise ExpressionError(f"Expected an operator after '{field}'")
+
+        # 'is missing' and 'is not missing'
+        if (operator in ('equals', 'does not equal')) and \
+            self._keyword('missing'):
+            node = Missing(field)
+            return node if operator == 'equals' else Not(node)
+
+        value = self._value()
+        if (operator == 'contains') and not isinstance(value, list):
+            value = [value]
+        # Values are converted to the column type here, so a bad
+        # value is reported before any data is filtered
+        try:
+            return Compare(*compile_predicate(field, operator, value))
+        except PredicateError as e:
+            raise ExpressionError(str(e))
+
+
+    def _value(self):
+        """ Quoted text, a list in parentheses, or words up to the
+            next AND/OR/parenthesis
+        """
+        kind, text = self._peek()
+        if kind == 'text':
+            self.pos += 1
+            return text
+        if (kind, text) == ('paren', '('):
+            self.pos += 1
+            values = []
+            while True:
+                values.append(self._value())
+                kind, text = self._peek()
+                self.pos += 1
+                if (kind, text) == ('paren', ')'):
+                    return values
+                if (kind, text) != ('paren', ','):
+                    raise ExpressionError("Expected ',' or ')' in list " +
+                        "of values")
+
+        words = []
+        while True:
+            kind, text = self._peek()
+            if (kind not in ('word', 'symbol')) or \
+                (text.lower() in self._stop):
+                break
+            words.append(text)
+            self.pos += 1
+        if not words:
+            raise ExpressionError("Expected a value")
+        return ' '.join(words)
+
+
+def parse(text):
+    """ Parse an expression string into a tree of nodes
+    """
+    return Parser(text).parse()
+
+
+def evaluate(node, planner):
+    """ Return boolean mask of the planner's frame rows matching
+        the expression tree
+    """
+    return node.evaluate(planner, np.arange(planner.frame.shape[0]))
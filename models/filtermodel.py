@@ -23,34 +23,57 @@ import ast
 #########
 class FilterList:
     """ Class to handle importing/exporting the 
-        filter combobox values
+        filter combobox values and filter expression
     """
 
+    def __init__(self):
+        # Filter expression from the last imported list
+        self.expression = ''
+
+
     def import_filter_dict(self):
         # Query user for filter .csv file
         filename = filedialog.askopenfilename()
         # Do nothing if cancelled
         if not filename:
             return
-        # If a valid filename is found, load it
-        filter_df = pd.read_csv(filename)
+        # If a valid filename is found, load it (values as typed)
+        filter_df = pd.read_csv(filename, dtype=str)
+
+        # Filter expression is stored in the first row of its own
+        # column (lists saved before expressions have none)
+        self.expression = ''
+        if 'expression' in filter_df.columns:
+            expression = filter_df.pop('expression').iloc[0]
+            if not pd.isna(expression):
+                self.expression = str(expression)
 
         # Create filter dict
         keys = list(filter_df.columns)
         filter_dict = {}
-        for key in keys:
-            # Check for lists
-            if filter_df.loc[1,key] == 'contains':
-                #filter_list = ast.literal_eval(filter_df.loc[2,key])
-                #value = ' '.join(filter_list)
-                value = ast.literal_eval(filter_df.loc[2,key])
-            else:
-                value = filter_df.loc[2,key]
-            # Assign values to dict
-            filter_dict[key] = (filter_df.loc[0,key],
-                        filter_df.loc[1,key],
-                        value
-            )
+        try:
+            for key in keys:
+                # Check for lists
+                if filter_df.loc[1,key] == 'contains':
+                    #filter_list = ast.literal_eval(filter_df.loc[2,key])
+                    #value = ' '.join(filter_list)
+                    value = ast.literal_eval(filter_df.loc[2,key])
+                else:
+                    value = filter_df.loc[2,key]
+                # Assign values to dict
+                filter_dict[key] = (filter_df.loc[0,key],
+                            filter_df.loc[1,key],
+                            value
+                )
+        except (KeyError, ValueError, SyntaxError) as e:
+            # Missing rows, or a list that is not plain values
+            # (e.g., exported from converted filter values)
+            print(e)
+            messagebox.showerror(title="Invalid Filter List",
+                message="Cannot read the filter list!",
+                detail=f"{filename}\n\nPlease export the filter " +
+                    "list again, or check its values.")
+            return
 
         return filter_dict
 
@@ -81,10 +104,11 @@ class FilterList:
     #     return filter_dict
 
 
-    def export_filters(self, filter_dict):
-        """ Save filters to .csv
+    def export_filters(self, filter_dict, expression=''):
+        """ Save filters (and an optional filter expression) 
+            to .csv
         """
-        if not filter_dict:
+        if not (filter_dict or expression):
             messagebox.showerror(title="Empty List",
                 message="No filter values to save!",
                 detail="Cannot export an empty filter list. If you have " +
@@ -95,6 +119,9 @@ class FilterList:
 
         # Convert dict to dataframe for writing to .csv
         filter_df = pd.DataFrame.from_dict(filter_dict)
+        if expression:
+            filter_df = filter_df.reindex(range(3))
+            filter_df['expression'] = [expression, None, None]
 
         # Generate date stamp
         now = datetime.now()
@@ -0,0 +1,143 @@
+""" Fuzzy subject lookup by name and address
+
+    Finds subjects from a misspelled name or address (e.g., taken
+    down during a phone call). Each distinct name and address is
+    split into lower case words, and each word into trigrams (three
+    letter pieces, padded so word starts and ends count):
+        'jon'  ->  '  j', ' jo', 'jon', 'on '
+    The index keeps, for every trigram, the distinct values that
+    contain it. A query is scored against all values at once by
+    counting shared trigrams from those lists (Dice similarity:
+    2 * shared / (query trigrams + value trigrams)), so typos,
+    missing letters and swapped words still match. A subject's
+    score is the best score of its name and address.
+
+    Author: Travis M. Moore
+"""
+
+###########
+# Imports #
+###########
+# Import data science packages
+import numpy as np
+import pandas as pd
+
+# Import system packages
+import re
+
+
+#########
+# BEGIN #
+#########
+# Words: letters and digits (case is ignored)
+_word = re.compile(r"[a-z0-9]+")
+
+
+def _word_trigrams(word):
+    """ Return the trigrams of one word
+    """
+    padded = '  ' + word + ' '
+    return [padded[ii:ii + 3] for ii in range(len(padded) - 2)]
+
+
+def trigrams(text):
+    """ Return the set of trigrams of the words of text
+    """
+    grams = set()
+    for word in _word.findall(str(text).lower()):
+        grams.update(_word_trigrams(word))
+    return grams
+
+
+class _FieldIndex:
+    """ Trigram posting lists of the distinct values of one column
+    """
+
+    def __init__(self, col):
+        # Each distinct value is split into trigrams once
+        codes, uniques = pd.factorize(col)
+        # Code -1 (missing) looks up the extra last score (0)
+        self.codes = np.where(codes >= 0, codes, len(uniques))
+
+        # Vocabulary: trigram to number. Words repeat across values
+        # (first names, street names), so each is split once.
+        self.grams = {}
+        word_grams = {}
+        entry_grams, entry_values = [], []
+        self.sizes = np.zeros(len(uniques), dtype=np.int32)
+        for code, value in enumerate(uniques):
+            grams = set()
+            for word in _word.findall(str(value).lower()):
+                if word not in word_grams:
+                    word_grams[word] = [self.grams.setdefault(x, 
+                        len(self.grams)) for x in _word_trigrams(word)]
+                grams.update(word_grams[word])
+            self.sizes[code] = len(grams)
+            entry_grams.extend(grams)
+            entry_values.extend([code] * len(grams))
+        gram_ids = np.array(entry_grams, dtype=np.int32)
+
+        # Posting lists: values of each trigram, grouped by trigram
+        order = np.argsort(gram_ids, kind='stable')
+        self.postings = np.array(entry_values, dtype=np.int32)[order]
+        self.offsets = np.searchsorted(gram_ids[order],
+            np.arange(len(self.grams) + 1))
+
+
+    def scores(self, grams):
+        """ Return Dice similarity of each row's value to the query
+            trigrams (0 for missing values)
+        """
+        # Shared trigrams of each distinct value
+        ids = [self.grams[x] for x in grams if x in self.grams]
+        shared = np.bincount(np.concatenate(
+            [self.postings[self.offsets[x]:self.offsets[x + 1]]
+            for x in ids] + [np.zeros(0, dtype=np.int32)]),
+            minlength=len(self.sizes))
+        table = np.zeros(len(self.sizes) + 1, dtype='float32')
+        table[:-1] = 2 * shared / np.maximum(len(grams) + self.sizes, 1)
+        return table[self.codes]
+
+
+class NameIndex:
+    """ Trigram indexes of the name and address of all subjects
+    """
+
+    # Columns searched
+    columns = ['Name', 'Address']
+
+    # Lowest score (0 to 1) listed as a match
+    min_score = 0.3
+
+    def __init__(self, frame):
+        self.fields = {name: _FieldIndex(frame[name])
+            for name in self.columns if name in frame.columns}
+
+
+    def search(self, text, k=10, within=None):
+        """ Return (positions, scores) of the k subjects best
+            matching text, best first. Within is an optional
+            boolean mask of subjects to search. Raises ValueError
+            if text has no letters or digits.
+        """
+        grams = trigrams(text)
+        if not grams:
+            raise ValueError("Please type part of a name or address")
+        scores = None
+        for field in self.fields.values():
+            field_scores = field.scores(grams)
+            scores = field_scores if scores is None \
+                else np.maximum(scores, field_scores)
+        if scores is None:
+            return np.array([], dtype=int), np.array([], dtype='float32')
+        if within is not None:
+            scores = np.where(within, scores, 0)
+
+        # Partial sort: only the k best are ordered
+        matched = np.flatnonzero(scores >= self.min_score)
+        k = min(k, matched.shape[0])
+        if k == 0:
+            return np.array([], dtype=int), np.array([], dtype='float32')
+        best = matched[np.argpartition(-scores[matched], k - 1)[:k]]
+        best = best[np.argsort(-scores[best], kind='stable')]
+        return best, scores[best]
@@ -0,0 +1,184 @@
+""" Multi-core .csv parsing for large database exports
+
+    Splits a .csv file into newline-aligned byte ranges (respecting
+    quoted fields, which may contain newlines), parses each range in
+    a separate process and returns the parsed ranges in file order.
+
+    Compressed files cannot be split into byte ranges; use
+    is_compressed() to fall back to a serial read.
+
+    Run as a script to benchmark parsing speed against core count:
+        python -m models.parallelcsv path/to/export.csv
+
+    Author: Travis M. Moore
+"""
+
+###########
+# Imports #
+###########
+# Import data science packages
+import pandas as pd
+
+# Import system packages
+import io
+import os
+import sys
+import mmap
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+# Import custom modules
+from models.constants import COMPRESSED_EXTENSIONS
+
+
+#########
+# BEGIN #
+#########
+def _row_start(mm, pos, quotes):
+    """ Return the offset of the first row starting at or after
+        pos, and the number of quote characters before it. Quotes
+        is the number of quote characters before pos; a newline
+        only ends a row when the quote count is even.
+    """
+    while True:
+        newline = mm.find(b'\n', pos)
+        if newline == -1:
+            return len(mm), quotes
+        quotes += mm[pos:newline].count(b'"')
+        pos = newline + 1
+        if quotes % 2 == 0:
+            return pos, quotes
+
+
+def is_compressed(path):
+    """ Return True if path is a compressed stream (by extension)
+    """
+    return str(path).lower().endswith(COMPRESSED_EXTENSIONS)
+
+
+def split_ranges(path, parts):
+    """ Split the rows of a .csv file (excluding the header row)
+        into at most parts (start, end) byte ranges
+    """
+    if os.path.getsize(path) == 0:
+        return []
+
+    with open(path, 'rb') as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            # First row starts after header
+            start, quotes = _row_start(mm, 0, 0)
+            step = max((len(mm) - start) // parts, 1)
+
+            bounds = [start]
+            pos = start
+            while True:
+                target = bounds[-1] + step
+                if target >= len(mm):
+                    break
+                # Count quotes up to target, then move to next row
+                quotes += mm[pos:target].count(b'"')
+                pos, quotes = _row_start(mm, target, quotes)
+                if pos >= len(mm):
+                    break
+                bounds.append(pos)
+            bounds.append(len(mm))
+
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+def _parse_range(path, start, end, names, transform, options):
+    """ Parse one byte range of path
+    """
+    with open(path, 'rb') as f:
+        f.seek(start)
+        data = f.read(end - start)
+
+    frame = pd.read_csv(io.BytesIO(data), header=None, names=names,
+        **options)
+    if transform is not None:
+        frame = transform(frame)
+    return frame
+
+
+def read_csv_parallel(path, transform=None, workers=None, callback=None,
+    range_bytes=64*1024*1024, **options):
+    """ Parse path in a process pool and return a list of frames,
+        one per byte range, in file order. Options are passed to
+        pd.read_csv (e.g., usecols, dtype). Without a dtype, all 
+        columns are parsed as strings so every range has the same 
+        column types.
+
+        Transform is an optional picklable callable applied to each
+        parsed range inside the worker process (e.g., to drop rows
+        before they are sent back). Ranges are at most range_bytes
+        long to bound the memory used by each worker.
+
+        Callback is an optional callable that receives each parsed
+        range, in file order, as it becomes available. Any exception
+        raised by callback cancels the ranges not yet started.
+
+        Raises ValueError for compressed files, which have no 
+        row-aligned byte offsets.
+    """
+    if is_compressed(path):
+        raise ValueError(f"Cannot split compressed file: {path}")
+    if workers is None:
+        workers = os.cpu_count() or 1
+    options.setdefault('dtype', str)
+
+    # Get column names from header row
+    names = list(pd.read_csv(path, nrows=0).columns)
+
+    size = os.path.getsize(path)
+    parts = max(workers, -(-size // range_bytes))
+    ranges = split_ranges(path, parts)
+
+    pool = ProcessPoolExecutor(max_workers=workers)
+    futures = [pool.submit(_parse_range, path, start, end, names,
+        transform, options) for start, end in ranges]
+    frames = []
+    try:
+        for future in futures:
+            frames.append(future.result())
+            if callback is not None:
+                callback(frames[-1])
+    except BaseException:
+        # Do not wait for ranges that have not started
+        for future in futures:
+            future.cancel()
+        pool.shutdown(wait=False)
+        raise
+    pool.shutdown()
+    return frames
+
+
+def benchmark(path, max_workers=None):
+    """ Print parse time of path for serial read_csv and for
+        increasing numbers of worker processes
+    """
+    if max_workers is None:
+        max_workers = os.cpu_count() or 1
+
+    start = time.perf_counter()
+    serial = pd.read_csv(path, dtype=str)
+    baseline = time.perf_counter() - start
+    print(f"File: {path} ({os.path.getsize(path) / 1e6:.1f} MB, " +
+        f"{serial.shape[0]} rows)")
+    print(f"{'Workers':>8} {'Seconds':>9} {'Speedup':>8}")
+    print(f"{'serial':>8} {baseline:>9.2f} {1:>8.2f}")
+
+    workers = 1
+    while workers <= max_workers:
+        start = time.perf_counter()
+        frames = read_csv_parallel(path, workers=workers)
+        parallel = pd.concat(frames, ignore_index=True)
+        elapsed = time.perf_counter() - start
+        if not parallel.equals(serial):
+            print("WARNING: parallel result differs from serial result!")
+        print(f"{workers:>8} {elapsed:>9.2f} {baseline / elapsed:>8.2f}")
+        workers *= 2
+
+
+if __name__ == '__main__':
+    benchmark(sys.argv[1],
+        int(sys.argv[2]) if len(sys.argv) > 2 else None)
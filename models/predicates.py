@@ -0,0 +1,231 @@
+""" Typed filter predicates for the subject database
+
+    Compiles (column, operator, value) predicates against the
+    column registry: the value typed in the filter view (always
+    text) is converted once to the column's declared type, and
+    unsupported operators or values that cannot be converted are
+    rejected before any data is touched. Compiled predicates are
+    evaluated by one vectorized kernel per column type: numeric
+    comparison, categorical code lookup or string match. 'text 
+    contains' matches words and phrases in text (see textindex).
+
+    Author: Travis M. Moore
+"""
+
+###########
+# Imports #
+###########
+# Import data science packages
+import numpy as np
+import pandas as pd
+
+# Import custom modules
+from models import schema
+from models import textindex
+
+
+#########
+# BEGIN #
+#########
+class PredicateError(ValueError):
+    """ Raised for predicates that do not fit the column type
+    """
+    pass
+
+
+# Operators supported by each kind of column
+operators = {
+    'number': ('equals', 'does not equal', 'contains',
+        '>', '>=', '<', '<='),
+    'date': ('equals', 'does not equal', 'contains',
+        '>', '>=', '<', '<='),
+    'category': ('equals', 'does not equal', 'contains', 
+        'text contains'),
+    'text': ('equals', 'does not equal', 'contains', 'text contains'),
+}
+
+
+def kind(colname):
+    """ Return 'number', 'date', 'category' or 'text' for a
+        registry column (unknown columns are text)
+    """
+    if colname in schema.integer_cols + schema.decimal_cols:
+        return 'number'
+    if colname in schema.date_cols:
+        return 'date'
+    if colname in schema.category_cols:
+        return 'category'
+    return 'text'
+
+
+def _literal(colname, value):
+    """ Convert one filter value to the type of colname
+    """
+    column_kind = kind(colname)
+    if column_kind == 'number':
+        try:
+            number = float(str(value).replace(',', '').lstrip('$'))
+        except ValueError:
+            raise PredicateError(f"'{colname}' is a number column; " +
+                f"{value!r} is not a number")
+        if np.isnan(number):
+            raise PredicateError(f"'{colname}' needs a number")
+        if (colname in schema.integer_cols) and number.is_integer():
+            return int(number)
+        return number
+    if column_kind == 'date':
+        try:
+            date = pd.Timestamp(value)
+        except (TypeError, ValueError):
+            raise PredicateError(f"'{colname}' is a date column; " +
+                f"{value!r} is not a date (use MM/DD/YYYY)")
+        if pd.isna(date):
+            raise PredicateError(f"'{colname}' needs a date")
+        return date
+    return str(value)
+
+
+def compile_predicate(colname, operator, value):
+    """ Return (colname, operator, value) with value converted to
+        the type of colname ('contains' values become a list).
+        Raises PredicateError for an operator the column does not
+        support, or a value that cannot be converted.
+    """
+    column_kind = kind(colname)
+    if operator not in operators[column_kind]:
+        raise PredicateError(f"'{operator}' cannot be used with " +
+            f"{column_kind} column '{colname}'")
+    if operator == "text contains":
+        # Text query: checked here, matched by the text index
+        if isinstance(value, (list, tuple, set)):
+            raise PredicateError(f"'text contains' needs one text " +
+                f"query ('{colname}')")
+        try:
+            textindex.parse(str(value))
+        except ValueError as e:
+            raise PredicateError(f"'{colname}': {e}")
+        return (colname, operator, str(value))
+    if operator == "contains":
+        if isinstance(value, str):
+            value = value.split()
+        if not value:
+            raise PredicateError(f"'contains' needs at least one " +
+                f"value for '{colname}'")
+        return (colname, operator, [_literal(colname, x) for x in value])
+    if isinstance(value, (list, tuple, set)):
+        raise PredicateError(f"A list of values needs 'contains' " +
+            f"('{colname}')")
+    return (colname, operator, _literal(colname, value))
+
+
+def compile_predicates(predicates):
+    """ Compile a list of predicates. Raises PredicateError before
+        any is evaluated if one of them is invalid.
+    """
+    return [compile_predicate(*predicate) for predicate in predicates]
+
+
+###########
+# Kernels #
+###########
+def _compare(values, operator, value):
+    """ Elementwise comparison of a numpy array with value
+    """
+    if operator == "equals":
+        return values == value
+    elif operator == "does not equal":
+        return values != value
+    elif operator == ">":
+        return values > value
+    elif operator == ">=":
+        return values >= value
+    elif operator == "<":
+        return values < value
+    elif operator == "<=":
+        return values <= value
+    elif operator == "contains":
+        return np.isin(values, value)
+    return None
+
+
+def _number_mask(col, operator, value):
+    """ Numeric columns: compare float values; missing values only
+        match 'does not equal'
+    """
+    values = col.to_numpy(dtype='float64', na_value=np.nan)
+    if operator == "contains":
+        value = np.asarray(value, dtype='float64')
+    with np.errstate(invalid='ignore'):
+        mask = _compare(values, operator, value)
+    if operator == "does not equal":
+        return mask | np.isnan(values)
+    return mask & ~np.isnan(values)
+
+
+def _date_mask(col, operator, value):
+    """ Date columns: compare datetime64 values; missing values only
+        match 'does not equal'
+    """
+    values = col.to_numpy()
+    if operator == "contains":
+        value = np.array([pd.Timestamp(x).to_datetime64() for x in value],
+            dtype=values.dtype)
+    else:
+        value = np.datetime64(pd.Timestamp(value).to_datetime64(),
+            np.datetime_data(values.dtype)[0])
+    mask = _compare(values, operator, value)
+    if operator == "does not equal":
+        return mask | np.isnat(values)
+    return mask & ~np.isnat(values)
+
+
+def _category_mask(col, operator, value):
+    """ Categorical columns: look up the category codes of the
+        values once, then map every row's code through a table 
+        of matching codes
+    """
+    codes = col.cat.codes.to_numpy()
+    values = value if operator == "contains" else [value]
+    lookup = col.cat.categories.get_indexer(pd.Index(values,
+        dtype=object))
+    lookup = lookup[lookup >= 0]
+    # One entry per category, plus a last one for missing (-1)
+    table = np.zeros(len(col.cat.categories) + 1, dtype=bool)
+    if operator == "does not equal":
+        # Missing values do not equal any value
+        table[:] = True
+        table[lookup] = False
+    else:
+        table[lookup] = True
+    return table[codes]
+
+
+def _text_mask(col, operator, value):
+    """ Text columns: exact string match; missing values only
+        match 'does not equal'
+    """
+    if operator == "contains":
+        mask = col.isin(value)
+    elif operator == "equals":
+        mask = col == value
+    else:
+        mask = (col != value) | col.isna()
+    return mask.fillna(False).to_numpy(dtype=bool)
+
+
+def mask(col, operator, value):
+    """ Return boolean array of col values matching a compiled
+        (operator, value), using the kernel for the column's
+        storage type
+    """
+    dtype = col.dtype
+    if operator == "text contains":
+        # Without a prebuilt index: index this column now
+        return textindex.TextIndex(col).mask(operator, value)
+    if isinstance(dtype, pd.CategoricalDtype):
+        return _category_mask(col, operator, value)
+    if dtype.kind == 'M':
+        return _date_mask(col, operator, value)
+    if dtype.kind in 'biuf':
+        return _number_mask(col, operator, value)
+    return _text_mask(col, operator, value)
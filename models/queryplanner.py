@@ -0,0 +1,222 @@
+""" Query planner for subject database filters
+
+    Estimates the selectivity of each (column, operator, value)
+    predicate from column statistics, evaluates the cheapest and
+    most selective predicates first, and fuses all predicates into
+    a single mask. Each predicate is only evaluated on the rows
+    that survived the predicates before it, unless an index 
+    (bitmap or sorted range) answers it for all rows at once.
+
+    Author: Travis M. Moore
+"""
+
+###########
+# Imports #
+###########
+# Import data science packages
+import numpy as np
+import pandas as pd
+
+# Import custom modules
+from models import predicates
+
+
+#########
+# BEGIN #
+#########
+def predicate_mask(col, operator, value):
+    """ Return boolean array of col values matching
+        (operator, value), where value has been converted to the
+        column type (see predicates.compile_predicate). Missing 
+        values only match 'does not equal'. Unknown operators 
+        match every row.
+    """
+    # NOTE: Add OR condition to include '-' values for every operator!
+    if operator not in ("equals", "does not equal", "contains",
+        ">", ">=", "<", "<=", "text contains"):
+        # Unknown operators leave the data untouched
+        return np.ones(col.shape[0], dtype=bool)
+    return predicates.mask(col, operator, value)
+
+
+class QueryPlanner:
+    """ Orders and evaluates filter predicates over a frame
+    """
+
+    # Rows sampled to estimate selectivity of text columns
+    sample_size = 2000
+
+    # Relative cost of evaluating a predicate per row
+    costs = {'index': 0.25, 'category': 1, 'number': 1, 'text': 4}
+
+    def __init__(self, frame, indexes=None, text_indexes=None):
+        """ Indexes is an optional dict of column name to index
+            (bitmapindex.BitmapIndex or rangeindex.RangeIndex);
+            text_indexes is an optional dict of column name to 
+            textindex.TextIndex
+        """
+        self.frame = frame
+        self.indexes = indexes or {}
+        self.text_indexes = text_indexes or {}
+        self._stats = {}
+        rng = np.random.default_rng(0)
+        self._sample = np.sort(rng.choice(frame.shape[0],
+            size=min(self.sample_size, frame.shape[0]), replace=False))
+
+
+    #####################
+    # Column Statistics #
+    #####################
+    def _indexed(self, colname, operator):
+        """ Return the index answering (colname, operator), or 
+            None
+        """
+        for indexes in (self.indexes, self.text_indexes):
+            index = indexes.get(colname)
+            if (index is not None) and (operator in index.operators):
+                return index
+        return None
+
+
+    def _kind(self, colname):
+        """ Return 'category', 'number' or 'text'
+        """
+        dtype = self.frame[colname].dtype
+        if isinstance(dtype, pd.CategoricalDtype):
+            return 'category'
+        if dtype.kind in 'biufM':
+            return 'number'
+        return 'text'
+
+
+    def stats(self, colname):
+        """ Return (kind, statistics) for colname, computed once:
+            value frequencies for categories, sorted values for
+            numbers, and a row sample for text
+        """
+        if colname not in self._stats:
+            col = self.frame[colname]
+            kind = self._kind(colname)
+            if kind == 'category':
+                # Exact frequencies from the category codes
+                codes = col.cat.codes.to_numpy()
+                counts = np.bincount(codes[codes >= 0],
+                    minlength=len(col.cat.categories))
+                stat = pd.Series(counts / max(col.shape[0], 1),
+                    index=col.cat.categories)
+            elif kind == 'number':
+                # Empirical distribution of the non-missing values
+                stat = np.sort(col.dropna().to_numpy(dtype='float64')
+                    if col.dtype.kind != 'M' else
+                    col.dropna().to_numpy().view('int64'))
+            else:
+                stat = col.iloc[self._sample]
+            self._stats[colname] = (kind, stat)
+        return self._stats[colname]
+
+
+    def selectivity(self, colname, operator, value):
+        """ Estimated fraction of rows matching the predicate
+        """
+        n = self.frame.shape[0]
+        if n == 0:
+            return 1.0
+        index = self._indexed(colname, operator)
+        if index is not None:
+            # Exact count from the index
+            return index.count(operator, value) / n
+
+        kind, stat = self.stats(colname)
+        if kind == 'category':
+            values = value if operator == 'contains' else [value]
+            matched = stat.reindex(pd.Index(values).unique(),
+                fill_value=0).sum()
+            if operator == 'equals' or operator == 'contains':
+                return float(matched)
+            if operator == 'does not equal':
+                # Missing values included
+                return float(1 - matched)
+        elif kind == 'number' and operator in ('>', '>=', '<', '<='):
+            try:
+                x = pd.Timestamp(value).value \
+                    if self.frame[colname].dtype.kind == 'M' \
+                    else float(value)
+            except (TypeError, ValueError):
+                return 1.0
+            side = 'left' if operator in ('>=', '<') else 'right'
+            below = np.searchsorted(stat, x, side=side)
+            matched = below if operator.startswith('<') \
+                else stat.shape[0] - below
+            return matched / n
+
+        # Otherwise evaluate the predicate on the row sample
+        sample = self.frame[colname].iloc[self._sample]
+        if sample.shape[0] == 0:
+            return 1.0
+        return float(predicate_mask(sample, operator, value).mean())
+
+
+    ############
+    # Planning #
+    ############
+    def plan(self, predicates):
+        """ Return predicates in evaluation order. Predicates that
+            remove the most rows per unit of cost come first.
+        """
+        def rank(predicate):
+            colname, operator, value = predicate
+            removed = 1.0 - self.selectivity(colname, operator, value)
+            kind = 'index' if self._indexed(colname, operator) \
+                else self._kind(colname)
+            return self.costs[kind] / max(removed, 1e-6)
+        return sorted(predicates, key=rank)
+
+
+    def mask(self, predicate):
+        """ Return boolean array: whether each frame row matches
+            predicate. Uses an index when one answers the predicate.
+        """
+        colname, operator, value = predicate
+        index = self._indexed(colname, operator)
+        if index is not None:
+            return index.mask(operator, value)
+        return predicate_mask(self.frame[colname], operator, value)
+
+
+    def evaluate(self, predicate, rows):
+        """ Return boolean array: whether each of the frame rows at
+            positions rows matches predicate. Uses an index when 
+            one answers the predicate.
+        """
+        colname, operator, value = predicate
+        index = self._indexed(colname, operator)
+        if index is not None:
+            return index.mask(operator, value)[rows]
+        col = self.frame[colname]
+        if rows.shape[0] < self.frame.shape[0]:
+            col = col.iloc[rows]
+        return predicate_mask(col, operator, value)
+
+
+    def execute(self, predicates, within=None):
+        """ Evaluate predicates in planned order as one fused mask.
+
+            Returns (mask, steps): mask has one value per frame row;
+            steps is a list of (predicate, remaining) in execution
+            order, where remaining counts the surviving rows that
+            are also in the within mask (default: all rows).
+        """
+        n = self.frame.shape[0]
+        if within is None:
+            within = np.ones(n, dtype=bool)
+        mask = np.ones(n, dtype=bool)
+        # Row positions that survived all predicates so far
+        rows = np.arange(n)
+
+        steps = []
+        for predicate in self.plan(predicates):
+            keep = self.evaluate(predicate, rows)
+            mask[rows[~keep]] = False
+            rows = rows[keep]
+            steps.append((predicate, int(within[rows].sum())))
+        return mask, steps
@@ -0,0 +1,134 @@
+""" Sorted range indexes for numeric database columns
+
+    Stores the non-missing values of a numeric column in sorted
+    order (argsort), with the row each value came from. Range
+    filters (>, >=, <, <=) and equality filters become a binary
+    search (searchsorted) that returns a contiguous run of rows,
+    instead of a comparison against every row.
+
+    Author: Travis M. Moore
+"""
+
+###########
+# Imports #
+###########
+# Import data science packages
+import numpy as np
+
+
+#########
+# BEGIN #
+#########
+class RangeIndex:
+    """ Sorted values of a numeric column with their row positions
+    """
+
+    # Operators answered from the sorted values
+    operators = ('equals', 'does not equal', '>', '>=', '<', '<=')
+
+    def __init__(self, col):
+        """ Col is a numeric Series (nullable types allowed)
+        """
+        self.rows = col.shape[0]
+        missing = col.isna().to_numpy()
+        if hasattr(col.dtype, 'numpy_dtype'):
+            # Nullable integer/float: fill missing values, which
+            # are dropped below
+            values = col.to_numpy(dtype=col.dtype.numpy_dtype,
+                na_value=0)
+        else:
+            values = col.to_numpy()
+
+        positions = np.flatnonzero(~missing).astype(np.int32)
+        # Rows with missing values (only match 'does not equal')
+        self.missing = np.flatnonzero(missing).astype(np.int32)
+        order = np.argsort(values[positions], kind='stable')
+        self.values = values[positions][order]
+        self.positions = positions[order]
+
+
+    @staticmethod
+    def _number(value):
+        """ Coerce a filter value (e.g., '60' from a combobox) to
+            a number. Raises TypeError if it is not numeric.
+        """
+        try:
+            return float(value)
+        except (TypeError, ValueError):
+            raise TypeError(f"Cannot compare number with {value!r}")
+
+
+    def _bounds(self, operator, value):
+        """ Return (start, stop) of the sorted values matching
+            (operator, value). Stop is None for ranges that run
+            to the largest value.
+        """
+        x = self._number(value)
+        if operator == "equals":
+            return (np.searchsorted(self.values, x, side='left'),
+                np.searchsorted(self.values, x, side='right'))
+        elif operator == ">":
+            return np.searchsorted(self.values, x, side='right'), None
+        elif operator == ">=":
+            return np.searchsorted(self.values, x, side='left'), None
+        elif operator == "<":
+            return 0, np.searchsorted(self.values, x, side='left')
+        elif operator == "<=":
+            return 0, np.searchsorted(self.values, x, side='right')
+        return None
+
+
+    def _rows(self, operator, value):
+        """ Row positions matching (operator, value), in value order
+        """
+        if operator == "does not equal":
+            start, stop = self._bounds("equals", value)
+            return np.concatenate([self.positions[:start],
+                self.positions[stop:], self.missing])
+        start, stop = self._bounds(operator, value)
+        return self.positions[start:stop]
+
+
+    def row_set(self, operator, value):
+        """ Sorted row positions matching (operator, value), or
+            None if the operator is not supported
+        """
+        if operator not in self.operators:
+            return None
+        return np.sort(self._rows(operator, value))
+
+
+    def count(self, operator, value):
+        """ Number of rows matching (operator, value), or None if
+            the operator is not supported
+        """
+        if operator not in self.operators:
+            return None
+        if operator == "does not equal":
+            start, stop = self._bounds("equals", value)
+            return self.rows - (stop - start)
+        start, stop = self._bounds(operator, value)
+        stop = self.values.shape[0] if stop is None else stop
+        return int(stop - start)
+
+
+    def mask(self, operator, value):
+        """ Boolean array of rows matching (operator, value), or
+            None if the operator is not supported. Missing values
+            only match 'does not equal'.
+        """
+        if operator not in self.operators:
+            return None
+        mask = np.zeros(self.rows, dtype=bool)
+        mask[self._rows(operator, value)] = True
+        return mask
+
+
+def build_indexes(frame, columns):
+    """ Return dict of RangeIndex for the numeric columns of frame
+    """
+    indexes = {}
+    for name in columns:
+        if (name in frame.columns) and (frame[name].dtype.kind in 'iuf'):
+            indexes[name] = RangeIndex(frame[name])
+    return indexes
@@ -0,0 +1,374 @@
+""" Column registry for the Subject Browser database
+
+    Declares every field the app reads from the CAR 'General Search'
+    export: its canonical name, the header spellings accepted for it
+    in the export, and its type. Parsers read only these columns, by
+    name, with their storage types set up front:
+      - Audiometric thresholds are nullable small integers,
+        with the '-' (no data) sentinel mapped to missing (NA).
+      - Distances and amounts are nullable decimals, so they
+        compare as numbers rather than as text.
+      - Low-cardinality fields are categoricals.
+      - Date fields are datetimes, and age is derived from
+        date of birth in bulk.
+      - Audiometric features (PTA, degree, etc.) are derived 
+        from the thresholds (see features.py).
+
+    Author: Travis M. Moore
+"""
+
+###########
+# Imports #
+###########
+# Import data science packages
+import numpy as np
+import pandas as pd
+
+# Import system packages
+from datetime import datetime
+
+# Import custom modules
+from models.constants import FieldTypes as FT
+
+
+#########
+# BEGIN #
+#########
+# Air conduction threshold columns
+ac_freqs = [250, 500, 750, 1000, 1500, 2000, 3000, 4000, 6000, 8000]
+ac_cols = [side + 'AC ' + str(freq)
+    for side in ['Right', 'Left'] for freq in ac_freqs]
+
+# Bone conduction threshold columns
+bc_freqs = [500, 1000, 2000, 4000]
+bc_cols = [side + 'BC ' + str(freq)
+    for side in ['Right', 'Left'] for freq in bc_freqs]
+
+threshold_cols = ac_cols + bc_cols
+
+# Threshold storage type (dB HL fits easily)
+threshold_dtype = 'Int16'
+
+# Date format used by CAR exports
+date_format = '%m/%d/%Y'
+
+# Values read as missing in numeric fields
+na_values = ['-']
+
+# Storage types by field type (unless a field gives its own)
+type_dtypes = {
+    FT.integer: 'Int64',
+    FT.decimal: 'Float64',
+    FT.short_string_list: 'category',
+}
+
+# Registry of database fields, in display order. 
+# Aliases are other header spellings used by the CAR export.
+# Derived fields are calculated by the app, and are only read
+# back from previously exported (filtered) databases.
+# Optional fields may be absent from an export (e.g., one written
+# by an older version of the app); they are then read as missing.
+# Private fields (personal and medical details) are used in the
+# app, but only written to exported files on request.
+fields = {
+    'Subject Id': {'type': FT.integer, 'dtype': 'int64'},
+    'Status': {'type': FT.short_string_list},
+    'Name': {'type': FT.string, 'optional': True, 'private': True},
+    'Availability': {'type': FT.short_string_list},
+    'Hearing Aid Use': {'type': FT.short_string_list, 'aliases': ['Hearing AidUse']},
+    'RightStyle': {'type': FT.short_string_list},
+    'Right Earmold Style': {'type': FT.short_string_list},
+    'LeftStyle': {'type': FT.short_string_list},
+    'Left Earmold Style': {'type': FT.short_string_list},
+    'RightAC 250': {'type': FT.integer, 'dtype': threshold_dtype},
+    'RightAC 500': {'type': FT.integer, 'dtype': threshold_dtype},
+    'RightAC 750': {'type': FT.integer, 'dtype': threshold_dtype},
+    'RightAC 1000': {'type': FT.integer, 'dtype': threshold_dtype},
+    'RightAC 1500': {'type': FT.integer, 'dtype': threshold_dtype},
+    'RightAC 2000': {'type': FT.integer, 'dtype': threshold_dtype},
+    'RightAC 3000': {'type': FT.integer, 'dtype': threshold_dtype},
+    'RightAC 4000': {'type': FT.integer, 'dtype': threshold_dtype},
+    'RightAC 6000': {'type': FT.integer, 'dtype': threshold_dtype},
+    'RightAC 8000': {'type': FT.integer, 'dtype': threshold_dtype},
+    'R Pt Type': {'type': FT.short_string_list},
+    'R Lf Degree': {'type': FT.short_string_list},
+    'R Hf Degree': {'type': FT.short_string_list},
+    'R Pt Configuration': {'type': FT.short_string_list},
+    'LeftAC 250': {'type': FT.integer, 'dtype': threshold_dtype},
+    'LeftAC 500': {'type': FT.integer, 'dtype': threshold_dtype},
+    'LeftAC 750': {'type': FT.integer, 'dtype': threshold_dtype},
+    'LeftAC 1000': {'type': FT.integer, 'dtype': threshold_dtype},
+    'LeftAC 1500': {'type': FT.integer, 'dtype': threshold_dtype},
+    'LeftAC 2000': {'type': FT.integer, 'dtype': threshold_dtype},
+    'LeftAC 3000': {'type': FT.integer, 'dtype': threshold_dtype},
+    'LeftAC 4000': {'type': FT.integer, 'dtype': threshold_dtype},
+    'LeftAC 6000': {'type': FT.integer, 'dtype': threshold_dtype},
+    'LeftAC 8000': {'type': FT.integer, 'dtype': threshold_dtype},
+    'L Pt Type': {'type': FT.short_string_list},
+    'L Lf Degree': {'type': FT.short_string_list},
+    'L Hf Degree': {'type': FT.short_string_list},
+    'L Pt Configuration': {'type': FT.short_string_list},
+    'Asymmetry': {'type': FT.string},
+    'Latest Study': {'type': FT.long_string},
+    'Address': {'type': FT.string, 'optional': True, 'private': True},
+    'Employment Status': {'type': FT.short_string_list},
+    'Medical Conditions Details': {'type': FT.long_string, 
+        'optional': True, 'private': True},
+    'Steadi Pass Fail': {'type': FT.short_string_list},
+    'Thi Score': {'type': FT.string},
+    'Thi Pass Fail': {'type': FT.short_string_list},
+    'Date Of Birth': {'type': FT.iso_date_string},
+    'Good Candidate': {'type': FT.short_string_list},
+    'Good Candidate Comment': {'type': FT.long_string},
+    'Ha Accessories Yn': {'type': FT.short_string_list},
+    'Hours Used Daily': {'type': FT.short_string_list},
+    'LeftBC 1000': {'type': FT.integer, 'dtype': threshold_dtype, 'aliases': ['L Pt Bc 1000']},
+    'LeftBC 2000': {'type': FT.integer, 'dtype': threshold_dtype, 'aliases': ['L Pt Bc 2000']},
+    'LeftBC 4000': {'type': FT.integer, 'dtype': threshold_dtype, 'aliases': ['L Pt Bc 4000']},
+    'LeftBC 500': {'type': FT.integer, 'dtype': threshold_dtype, 'aliases': ['L Pt Bc 500']},
+    'L Speech Quicksin Snr': {'type': FT.string},
+    'L Speech Wrs Pl': {'type': FT.string},
+    'L Speech Wrs Score': {'type': FT.string},
+    'L Tympanometry Type': {'type': FT.short_string_list},
+    'Left Make': {'type': FT.short_string_list},
+    'Left Ric Cable Size': {'type': FT.string},
+    'Left Thin Tube Size': {'type': FT.string},
+    'Medications': {'type': FT.long_string},
+    'Miles From Starkey': {'type': FT.decimal},
+    'MoCA Pass/Fail': {'type': FT.short_string_list},
+    'MoCA Total Score': {'type': FT.string},
+    'R Speech Quicksin Snr': {'type': FT.string},
+    'R Speech Wrs Pl': {'type': FT.string},
+    'R Speech Wrs Score': {'type': FT.string},
+    'R Tympanometry Type': {'type': FT.short_string_list},
+    'RightBC 1000': {'type': FT.integer, 'dtype': threshold_dtype, 'aliases': ['RightBC  1000']},
+    'RightBC 2000': {'type': FT.integer, 'dtype': threshold_dtype, 'aliases': ['RightBC  2000']},
+    'RightBC 4000': {'type': FT.integer, 'dtype': threshold_dtype, 'aliases': ['RightBC  4000']},
+    'RightBC 500': {'type': FT.integer, 'dtype': threshold_dtype},
+    'Right Make': {'type': FT.short_string_list},
+    'Right Ric Cable Size': {'type': FT.string},
+    'Right Thin Tube Size': {'type': FT.string},
+    'Sla Date': {'type': FT.iso_date_string},
+    'Smartphone Os': {'type': FT.short_string_list},
+    'Smartphone Type': {'type': FT.short_string_list},
+    'Smartphone Yn': {'type': FT.short_string_list},
+    'Social Gatherings': {'type': FT.short_string_list},
+    'Test Date': {'type': FT.iso_date_string},
+    'Use Cellphone': {'type': FT.short_string_list},
+    'Use Email': {'type': FT.short_string_list},
+    'Use Internet': {'type': FT.short_string_list},
+    'Use Starkey Ha Accessories Yn': {'type': FT.short_string_list},
+    'When Noticed Loss': {'type': FT.string},
+    'Will Not Wear': {'type': FT.short_string_list},
+    'Total Ytd Stipend': {'type': FT.decimal, 'optional': True},
+    'Age': {'type': FT.integer, 'dtype': 'Int16', 'derived': True},
+    # Audiometric features (see features.py): calculated from the
+    # AC thresholds whenever records are read, never read back
+    'Right PTA': {'type': FT.decimal, 'derived': True, 'feature': True},
+    'Left PTA': {'type': FT.decimal, 'derived': True, 'feature': True},
+    'Right HF PTA': {'type': FT.decimal, 'derived': True, 'feature': True},
+    'Left HF PTA': {'type': FT.decimal, 'derived': True, 'feature': True},
+    'Right Degree': {'type': FT.short_string_list, 'derived': True, 
+        'feature': True},
+    'Left Degree': {'type': FT.short_string_list, 'derived': True, 
+        'feature': True},
+    'PTA Asymmetry': {'type': FT.decimal, 'derived': True, 'feature': True},
+    'Better Ear': {'type': FT.short_string_list, 'derived': True, 
+        'feature': True},
+    'Better Ear PTA': {'type': FT.decimal, 'derived': True, 'feature': True},
+    'Right Pro Fit Matrix': {'type': FT.short_string_list, 
+        'derived': True, 'feature': True},
+    'Right Pro Fit Coupling': {'type': FT.short_string_list, 
+        'derived': True, 'feature': True},
+    'Right Pro Fit Vent': {'type': FT.short_string_list, 
+        'derived': True, 'feature': True},
+    'Left Pro Fit Matrix': {'type': FT.short_string_list, 
+        'derived': True, 'feature': True},
+    'Left Pro Fit Coupling': {'type': FT.short_string_list, 
+        'derived': True, 'feature': True},
+    'Left Pro Fit Vent': {'type': FT.short_string_list, 
+        'derived': True, 'feature': True},
+}
+
+# Field lists by type
+integer_cols = [x for x in fields if fields[x]['type'] == FT.integer]
+decimal_cols = [x for x in fields if fields[x]['type'] == FT.decimal]
+date_cols = [x for x in fields if fields[x]['type'] == FT.iso_date_string]
+category_cols = [x for x in fields 
+    if fields[x]['type'] == FT.short_string_list]
+feature_cols = [x for x in fields if fields[x].get('feature')]
+private_cols = [x for x in fields if fields[x].get('private')]
+
+
+def storage_dtype(name):
+    """ Return the storage type of a registry field
+    """
+    spec = fields[name]
+    return spec.get('dtype', type_dtypes.get(spec['type'], str))
+
+
+def read_options(header, include_derived=False):
+    """ Match the header row of an export to the registry.
+        
+        Returns keyword arguments for pd.read_csv that read only
+        registry fields with their storage types, and a dict to 
+        rename header spellings to canonical names. 
+        
+        Raises ValueError if a required field is missing from the
+        header, or if more than one spelling of a field is present.
+        Absent optional fields are left for apply_schema to add.
+    """
+    header = list(header)
+    usecols = []
+    dtype = {}
+    na = {}
+    rename = {}
+    missing = []
+    for name, spec in fields.items():
+        if spec.get('derived') and not include_derived:
+            continue
+        if spec.get('feature'):
+            # Recalculated from the thresholds instead
+            continue
+
+        matches = [x for x in [name] + spec.get('aliases', []) 
+            if x in header]
+        if not matches:
+            if not spec.get('optional'):
+                missing.append(name)
+            continue
+        if len(matches) > 1:
+            raise ValueError(f"Database has more than one column for " +
+                f"'{name}': {matches}")
+
+        actual = matches[0]
+        usecols.append(actual)
+        rename[actual] = name
+        if spec['type'] in (FT.iso_date_string, FT.decimal):
+            # Parsed in bulk after reading (decimals may include
+            # currency symbols and thousands separators)
+            dtype[actual] = str
+        else:
+            dtype[actual] = storage_dtype(name)
+        if spec['type'] in (FT.integer, FT.decimal):
+            na[actual] = na_values
+
+    if missing:
+        raise ValueError(f"Database is missing expected columns: " +
+            ", ".join(missing))
+
+    options = {'usecols': usecols, 'dtype': dtype, 'na_values': na}
+    return options, rename
+
+
+def empty_frame():
+    """ Return a database frame with no records
+    """
+    return pd.DataFrame({name: to_dates(pd.Series(dtype=str)) 
+        if name in date_cols else pd.Series(dtype=storage_dtype(name)) 
+        for name in fields})
+
+
+def union_categories(frames):
+    """ Give the categorical columns of frames the same categories, 
+        in place, so they concatenate without reverting to strings
+    """
+    for name in category_cols:
+        cats = frames[0][name].cat.categories
+        for frame in frames[1:]:
+            cats = cats.union(frame[name].cat.categories)
+        for frame in frames:
+            frame[name] = frame[name].cat.set_categories(cats)
+
+
+def to_numbers(col, dtype):
+    """ Convert a column to a nullable numeric type.
+        '$' and ',' are ignored; '-' and any other non-numeric 
+        values become NA.
+    """
+    if not pd.api.types.is_numeric_dtype(col):
+        col = col.astype(str).str.replace(r'[$,]', '', regex=True)
+    col = pd.to_numeric(col, errors='coerce')
+    if dtype.startswith('Int') or dtype.startswith('int'):
+        col = col.round()
+    return col.astype(dtype)
+
+
+def to_dates(col):
+    """ Parse a date column in bulk. '-' and any other 
+        unparseable values become NaT.
+    """
+    return pd.to_datetime(col, format=date_format, errors='coerce')
+
+
+def calc_age(birthdates, reference_date=None):
+    """ Return age in whole years on reference_date (default: now)
+        for a datetime column of birthdates. Missing birthdates 
+        give a missing (NA) age.
+    """
+    if reference_date is None:
+        reference_date = datetime.now()
+    days = (pd.Timestamp(reference_date) - birthdates).dt.days
+    return np.trunc(days / 365.2425).astype(storage_dtype('Age'))
+
+
+def insert_field(frame, name, values):
+    """ Set column name of frame to values, in place. A new column
+        is inserted at its registry position among the columns 
+        present, so frames read by any path keep the same order.
+    """
+    if name in frame.columns:
+        frame[name] = values
+        return
+    names = list(fields)
+    position = sum(x in frame.columns for x in names[:names.index(name)])
+    frame.insert(position, name, values)
+
+
+def apply_schema(frame):
+    """ Convert registry fields in frame to their storage types,
+        in place. Columns already stored correctly are left as is,
+        so this is cheap after a typed read. Optional fields absent
+        from frame are added as missing, in registry order.
+    """
+    for name in fields:
+        if (name not in frame.columns) and fields[name].get('optional'):
+            insert_field(frame, name, pd.Series(index=frame.index,
+                dtype=storage_dtype(name)))
+        if name not in frame.columns:
+            continue
+        col = frame[name]
+        dtype = storage_dtype(name)
+
+        if name in date_cols:
+            if not pd.api.types.is_datetime64_any_dtype(col):
+                frame[name] = to_dates(col)
+        elif dtype == 'category':
+            # Also merges categories of concatenated chunks
+            if not isinstance(col.dtype, pd.CategoricalDtype):
+                frame[name] = col.astype('category')
+        elif name in integer_cols + decimal_cols:
+            if str(col.dtype) != dtype:
+                frame[name] = to_numbers(col, dtype)
+
+
+def ac_matrix(frame):
+    """ Return AC thresholds as a float array of shape 
+        (subjects, ears, frequencies): ears are (Right, Left),
+        frequencies are ac_freqs, and missing thresholds are NaN
+    """
+    values = frame[ac_cols].to_numpy(dtype='float32', na_value=np.nan)
+    return values.reshape(frame.shape[0], 2, len(ac_freqs))
+
+
+def memory_saved(frame, sample_rows=1000):
+    """ Estimate bytes saved by storing frame with compact types
+        rather than as strings, from a sample of rows
+    """
+    if frame.shape[0] == 0:
+        return 0
+    sample = frame.head(sample_rows)
+    as_str = sample.astype(str)
+    saved = (as_str.memory_usage(deep=True).sum() 
+        - sample.memory_usage(deep=True).sum())
+    return int(saved * frame.shape[0] / sample.shape[0])
@@ -0,0 +1,295 @@
+""" Inverted full-text index for free-text database columns
+
+    Splits each cell into lower case words and keeps, for every
+    word, a posting list of (row, word position) pairs sorted by
+    row. Queries are answered from the posting lists with sorted
+    array intersections and unions instead of scanning the text:
+        knee                    rows with the word 'knee'
+        replac*                 words starting with 'replac'
+        "sleep apnea"           the words next to each other
+                                (or 'sleep apnea')
+        knee AND NOT (apnea OR diabet*)
+    Adjacent terms without an operator must all match (AND).
+
+    Author: Travis M. Moore
+"""
+
+###########
+# Imports #
+###########
+# Import data science packages
+import numpy as np
+import pandas as pd
+
+# Import system packages
+import re
+
+
+#########
+# BEGIN #
+#########
+# Words: letters and digits (case is ignored)
+_word = re.compile(r"[a-z0-9]+")
+
+# Query tokens: phrases, parentheses and terms (with optional *)
+_query_token = re.compile(
+    r'''\s*(?:"([^"]*)"|'([^']*)'|([()])|([^\s()"']+))''')
+
+
+def words(text):
+    """ Return the lower case words of text
+    """
+    return _word.findall(str(text).lower())
+
+
+#########
+# Query #
+#########
+def parse(query):
+    """ Parse a text query into a nested tuple:
+        ('word', w), ('prefix', p), ('phrase', [w, ...]),
+        ('and', [...]), ('or', [...]) or ('not', node).
+        Raises ValueError if the query cannot be read.
+    """
+    tokens = []
+    pos = 0
+    query = query.strip()
+    while pos < len(query):
+        match = _query_token.match(query, pos)
+        if (match is None) or (match.end() == pos):
+            raise ValueError(f"Cannot read text query at position " +
+                f"{pos + 1}")
+        double, single, paren, word = match.groups()
+        tokens.append((double if double is not None else single,
+            paren, word))
+        pos = match.end()
+    if not tokens:
+        raise ValueError("Text query is empty")
+
+    def keyword(ii, word):
+        return (ii < len(tokens)) and (tokens[ii][2] is not None) and \
+            (tokens[ii][2].upper() == word)
+
+    def expression(ii):
+        node, ii = term(ii)
+        operands = [node]
+        while keyword(ii, 'OR'):
+            node, ii = term(ii + 1)
+            operands.append(node)
+        return (operands[0] if len(operands) == 1
+            else ('or', operands)), ii
+
+    def term(ii):
+        node, ii = factor(ii)
+        operands = [node]
+        # Explicit AND, or terms next to each other
+        while (ii < len(tokens)) and (tokens[ii][1] != ')') and \
+            not keyword(ii, 'OR'):
+            if keyword(ii, 'AND'):
+                ii += 1
+            node, ii = factor(ii)
+            operands.append(node)
+        return (operands[0] if len(operands) == 1
+            else ('and', operands)), ii
+
+    def factor(ii):
+        if ii >= len(tokens):
+            raise ValueError("Text query ends unexpectedly")
+        phrase, paren, word = tokens[ii]
+        if keyword(ii, 'NOT'):
+            node, ii = factor(ii + 1)
+            return ('not', node), ii
+        if paren == '(':
+            node, ii = expression(ii + 1)
+            if (ii >= len(tokens)) or (tokens[ii][1] != ')'):
+                raise ValueError("Missing closing parenthesis in " +
+                    "text query")
+            return node, ii + 1
+        if paren == ')':
+            raise ValueError("Unexpected ')' in text query")
+        if phrase is not None:
+            parts = words(phrase)
+            if not parts:
+                raise ValueError("Empty phrase in text query")
+            return (('word', parts[0]) if len(parts) == 1
+                else ('phrase', parts)), ii + 1
+        if word.upper() in ('AND', 'OR'):
+            raise ValueError(f"Missing term before {word.upper()}")
+        if word.endswith('*'):
+            parts = words(word[:-1])
+            if len(parts) != 1:
+                raise ValueError(f"Cannot use {word!r} as a prefix")
+            return ('prefix', parts[0]), ii + 1
+        parts = words(word)
+        if not parts:
+            raise ValueError(f"No words in {word!r}")
+        return (('word', parts[0]) if len(parts) == 1
+            else ('phrase', parts)), ii + 1
+
+    node, ii = expression(0)
+    if ii < len(tokens):
+        raise ValueError("Unexpected ')' in text query")
+    return node
+
+
+#########
+# Index #
+#########
+class TextIndex:
+    """ Posting lists of the words in a text column
+    """
+
+    # Operators answered from the index
+    operators = ('text contains',)
+
+    def __init__(self, col):
+        """ Col is a text or categorical Series
+        """
+        self.rows = col.shape[0]
+        # Tokenize each distinct value once
+        codes, uniques = pd.factorize(col.astype(object)
+            if isinstance(col.dtype, pd.CategoricalDtype) else col)
+        self.present = np.flatnonzero(codes >= 0).astype(np.int32)
+
+        entry_terms, entry_codes, entry_positions = [], [], []
+        for code, value in enumerate(uniques):
+            tokens = words(value)
+            entry_terms.extend(tokens)
+            entry_codes.extend([code] * len(tokens))
+            entry_positions.extend(range(len(tokens)))
+        self.terms, term_ids = np.unique(np.array(entry_terms,
+            dtype=str), return_inverse=True)
+        entry_codes = np.array(entry_codes, dtype=np.int64)
+        entry_positions = np.array(entry_positions, dtype=np.int32)
+
+        # Rows of each distinct value, grouped by value
+        order = np.argsort(codes, kind='stable')
+        order = order[codes[order] >= 0]
+        counts = np.bincount(codes[codes >= 0], minlength=len(uniques))
+        starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+
+        # One (term, row, position) entry per word occurrence
+        repeats = counts[entry_codes]
+        entry = np.repeat(np.arange(entry_codes.shape[0]), repeats)
+        offset = np.arange(entry.shape[0]) - np.repeat(
+            np.cumsum(repeats) - repeats, repeats)
+        rows = order[starts[entry_codes[entry]] + offset]
+        terms = term_ids.reshape(-1)[entry]
+        positions = entry_positions[entry]
+
+        # Posting lists: sorted by term, then row, then position
+        sort = np.lexsort((positions, rows, terms))
+        self.posting_rows = rows[sort].astype(np.int32)
+        self.posting_positions = positions[sort]
+        self.offsets = np.searchsorted(terms[sort],
+            np.arange(len(self.terms) + 1))
+
+
+    ##########
+    # Lookup #
+    ##########
+    def _postings(self, start, stop):
+        """ (rows, positions) of terms start to stop (sorted
+            vocabulary positions)
+        """
+        lo, hi = self.offsets[start], self.offsets[stop]
+        return self.posting_rows[lo:hi], self.posting_positions[lo:hi]
+
+
+    def _term(self, word):
+        """ Vocabulary position of word, or None
+        """
+        ii = np.searchsorted(self.terms, word)
+        if (ii < len(self.terms)) and (self.terms[ii] == word):
+            return ii
+        return None
+
+
+    def word_rows(self, word):
+        """ Sorted rows containing word
+        """
+        ii = self._term(word)
+        if ii is None:
+            return np.array([], dtype=np.int32)
+        return np.unique(self._postings(ii, ii + 1)[0])
+
+
+    def prefix_rows(self, prefix):
+        """ Sorted rows containing a word starting with prefix
+        """
+        start = np.searchsorted(self.terms, prefix, side='left')
+        stop = np.searchsorted(self.terms, prefix + '\uffff',
+            side='left')
+        return np.unique(self._postings(start, stop)[0])
+
+
+    def phrase_rows(self, phrase):
+        """ Sorted rows containing the words of phrase in order
+        """
+        # Encode (row, position - offset in phrase) as one key
+        scale = np.int64(self.posting_positions.max(initial=0) +
+            len(phrase) + 1)
+        keys = None
+        for offset, word in enumerate(phrase):
+            ii = self._term(word)
+            if ii is None:
+                return np.array([], dtype=np.int32)
+            rows, positions = self._postings(ii, ii + 1)
+            word_keys = rows.astype(np.int64) * scale + \
+                (positions.astype(np.int64) - offset + len(phrase))
+            keys = word_keys if keys is None else \
+                np.intersect1d(keys, word_keys, assume_unique=True)
+        return np.unique(keys // scale).astype(np.int32)
+
+
+    def query_rows(self, query):
+        """ Sorted rows matching a text query (string or parsed)
+        """
+        node = parse(query) if isinstance(query, str) else query
+        kind, arg = node
+        if kind == 'word':
+            return self.word_rows(arg)
+        elif kind == 'prefix':
+            return self.prefix_rows(arg)
+        elif kind == 'phrase':
+            return self.phrase_rows(arg)
+        elif kind == 'not':
+            # Rows with text only: missing values never match
+            return np.setdiff1d(self.present, self.query_rows(arg),
+                assume_unique=True)
+        rows = [self.query_rows(x) for x in arg]
+        result = rows[0]
+        for x in rows[1:]:
+            result = np.intersect1d(result, x, assume_unique=True) \
+                if kind == 'and' else np.union1d(result, x)
+        return result
+
+
+    ####################
+    # Filter Interface #
+    ####################
+    def mask(self, operator, value):
+        """ Boolean array of rows matching (operator, value), or
+            None if the operator is not supported
+        """
+        if operator not in self.operators:
+            return None
+        mask = np.zeros(self.rows, dtype=bool)
+        mask[self.query_rows(value)] = True
+        return mask
+
+
+    def count(self, operator, value):
+        """ Number of rows matching (operator, value), or None if
+            the operator is not supported
+        """
+        if operator not in self.operators:
+            return None
+        return int(self.query_rows(value).shape[0])
+
+
+def build_indexes(frame, columns):
+    """ Return dict of TextIndex for the columns of frame
+    """
+    return {name: TextIndex(frame[name]) for name in columns
+        if name in frame.columns}
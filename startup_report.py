@@ -0,0 +1,110 @@
+""" Startup-time report for the Subject Browser
+
+    Measures the time taken to import the app (everything that
+    runs before the main window can be drawn) using the
+    interpreter's -X importtime option, lists the slowest imports,
+    and warns if the total exceeds the startup budget or if a
+    module that should only be imported on first use was loaded.
+
+    Run from the project folder:
+        python startup_report.py [budget_seconds]
+
+    Exits with status 1 if the budget is exceeded, so the report
+    can be used to catch startup regressions.
+
+    Author: Travis M. Moore
+"""
+
+###########
+# Imports #
+###########
+# Import system packages
+import sys
+import subprocess
+
+
+#########
+# BEGIN #
+#########
+# Seconds allowed for importing the app
+budget = 1.5
+
+# Modules that must only be imported on first use
+lazy_modules = ['matplotlib', 'markdown', 'webbrowser']
+
+# Number of slowest imports to list
+top_n = 15
+
+
+def measure(module='controller'):
+    """ Import module in a fresh interpreter and return a list
+        of (cumulative seconds, module name) for every import,
+        and the set of top-level packages that were loaded
+    """
+    code = (f"import sys, {module}; "
+        "print(','.join(sorted({m.split('.')[0] for m in sys.modules})))")
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c',
+        code], capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1])
+
+    # Lines look like:
+    # import time:  self [us] | cumulative | imported package
+    times = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        fields = line.split(':', 1)[1].split('|')
+        try:
+            cumulative = int(fields[1]) / 1e6
+        except ValueError:
+            # Header line
+            continue
+        # Nested imports are indented below their parent
+        times.append((cumulative, fields[2][1:].rstrip()))
+
+    loaded = set(result.stdout.strip().splitlines()[-1].split(','))
+    return times, loaded
+
+
+def report(budget=budget, module='controller'):
+    """ Print import-time report and return True if startup is
+        within budget and no lazy module was imported
+    """
+    times, loaded = measure(module)
+
+    # Imports are listed after their own imports, so the module's
+    # imports are the nested lines just before its own line
+    end = max(ii for ii, (t, name) in enumerate(times) if name == module)
+    start = end
+    while (start > 0) and times[start - 1][1].startswith(' '):
+        start -= 1
+    total = times[end][0]
+
+    print(f"Importing {module}: {total:.3f} s (budget {budget:.3f} s)\n")
+    print(f"{'Seconds':>8}  Module (slowest imports made by {module})")
+    # Direct imports are indented one level below the module
+    direct = [(t, name) for t, name in times[start:end]
+        if (len(name) - len(name.lstrip()) == 2)]
+    for t, name in sorted(direct, reverse=True)[:top_n]:
+        print(f"{t:>8.3f}  {name.strip()}")
+    print()
+
+    ok = True
+    if total > budget:
+        print(f"WARNING: startup import time exceeds budget by " +
+            f"{total - budget:.3f} s")
+        ok = False
+    for name in lazy_modules:
+        if name in loaded:
+            print(f"WARNING: '{name}' is imported at startup; it " +
+                "should only be imported on first use")
+            ok = False
+    if ok:
+        print("Startup within budget")
+    return ok
+
+
+if __name__ == '__main__':
+    if not report(float(sys.argv[1]) if len(sys.argv) > 1 else budget):
+        sys.exit(1)
@@ -0,0 +1,93 @@
+""" Equivalence of the batch ProFit columns with SubDB.coupling
+
+    Builds synthetic subjects covering the rule boundaries and
+    compares features._profit (via the Pro Fit feature columns)
+    with the single-subject SubDB.coupling, ear by ear.
+
+    Author: Travis M. Moore
+"""
+
+###########
+# Imports #
+###########
+# Import data science packages
+import numpy as np
+import pandas as pd
+import pytest
+
+# Import system packages
+import itertools
+
+# Import custom modules
+from models import dbmodel
+from models import features
+from models import schema
+
+
+#########
+# BEGIN #
+#########
+# Thresholds tried at each frequency the rules use (None: missing).
+# Includes the 30/50/60/65/80 dB boundaries, equal 500 and 2000 Hz
+# thresholds, and a zero 250 Hz threshold (false in the scalar code).
+cases = {
+    250: [None, 0, 20],
+    500: [None, 20, 29, 30, 31, 40, 49, 50, 51, 60, 65],
+    1000: [None, 40, 59, 60, 61],
+    2000: [None, 40, 64, 65, 66, 79, 80, 81],
+}
+
+# Thresholds of the other ear and of unused frequencies
+normal = 20
+
+
+@pytest.fixture(scope='module')
+def db():
+    """ Return SubDB with one subject per case and ear: the case
+        thresholds in one ear and normal hearing in the other
+    """
+    rows = []
+    for side in ['Right', 'Left']:
+        for values in itertools.product(*cases.values()):
+            row = {col: normal for col in schema.ac_cols}
+            for freq, value in zip(cases, values):
+                row[f'{side}AC {freq}'] = value
+            rows.append(row)
+
+    frame = schema.empty_frame().reindex(range(len(rows)))
+    frame['Subject Id'] = np.arange(1, len(rows) + 1)
+    for col in schema.ac_cols:
+        frame[col] = pd.array([row[col] for row in rows],
+            dtype=schema.threshold_dtype)
+    features.add_features(frame)
+
+    db = dbmodel.SubDB()
+    db.set_data(frame)
+    return db
+
+
+def test_profit_matches_coupling(db):
+    base = db.engine.base
+    half = base.shape[0] // 2
+    for position, sub_id in enumerate(base['Subject Id']):
+        side = 'Right' if position < half else 'Left'
+        rec = base.iloc[position]
+        batch = tuple(rec[f'{side} Pro Fit {x}']
+            for x in ['Matrix', 'Coupling', 'Vent'])
+        try:
+            matrix, coupling, vent = db.coupling(sub_id)
+        except TypeError:
+            # No recommendation threshold, or an earmold without a
+            # 1000 Hz threshold for the vent: values are missing
+            assert pd.isna(batch[0]) or pd.isna(batch[2]), \
+                (sub_id, side, batch)
+            continue
+        assert batch == (matrix[side], coupling[side], vent[side]), \
+            (sub_id, side, batch)
+
+
+def test_profit_covers_every_outcome(db):
+    base = db.engine.base
+    values = set(base['Right Pro Fit Coupling'].dropna()) | \
+        set(base['Left Pro Fit Coupling'].dropna())
+    assert values == set(features.profit_couplings)
@@ -7,12 +7,6 @@
 import tkinter as tk
 from tkinter import ttk
 
-# Import plotting packages
-import matplotlib
-matplotlib.use('TkAgg')
-from matplotlib.figure import Figure
-from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg, NavigationToolbar2Tk
-
 # Import custom modules
 from models.constants import FieldTypes as FT
 
@@ -123,8 +117,87 @@ class BrowseFrame(ttk.Frame):
         ttk.Label(lfrm_right, text="Pro Fit Matrix:", style='rec.TLabel').grid(row=5, column=0, sticky='e')
         ttk.Label(lfrm_right, textvariable=self._vars['r_matrix'], style='rec.TLabel').grid(row=5, column=1, sticky='w')
 
-        # Call audio plot
-        self.plot_audio()
+        # SIMILAR AUDIOGRAMS
+        lfrm_similar = ttk.LabelFrame(self, text="Similar Audiograms")
+        lfrm_similar.grid(row=2, column=0, columnspan=2, **options, 
+            sticky='nsew')
+        lfrm_similar.columnconfigure(index=1, weight=1)
+        # Typed audiogram (empty: use the selected subject)
+        ttk.Label(lfrm_similar, text="Audiogram:").grid(row=0, column=0, 
+            sticky='e')
+        self.audiogram_var = tk.StringVar()
+        ttk.Entry(lfrm_similar, textvariable=self.audiogram_var).grid(
+            row=0, column=1, columnspan=3, sticky='ew', padx=5, pady=5)
+        ttk.Label(lfrm_similar, text="e.g., 500=20 1000=30 R4000=60 " +
+            "(empty: selected subject)").grid(row=1, column=1, 
+                columnspan=3, sticky='w', padx=5)
+        # Number of matches
+        ttk.Label(lfrm_similar, text="Matches:").grid(row=2, column=0, 
+            sticky='e')
+        self.k_var = tk.IntVar(value=10)
+        ttk.Spinbox(lfrm_similar, from_=1, to=100, width=5, 
+            textvariable=self.k_var).grid(row=2, column=1, sticky='w', 
+                padx=5, pady=5)
+        # Search the filtered records only
+        self.similar_filtered_var = tk.IntVar(value=1)
+        ttk.Checkbutton(lfrm_similar, text="Filtered records only", 
+            variable=self.similar_filtered_var, takefocus=0).grid(
+                row=2, column=2, sticky='w', padx=5)
+        ttk.Button(lfrm_similar, text="Find Similar", takefocus=0,
+            command=lambda: self.event_generate('<<BrowseSimilar>>')).grid(
+                row=2, column=3, sticky='e', padx=5, pady=5)
+        # Results: selecting one shows that subject
+        columns = ('subject_id', 'distance', 'frequencies')
+        self.similar_tree = ttk.Treeview(lfrm_similar, columns=columns,
+            show='headings', height=5)
+        for col, text, width in zip(columns, 
+            ['Subject ID', 'Distance (dB)', 'Frequencies'], [90, 100, 90]):
+            self.similar_tree.heading(col, text=text)
+            self.similar_tree.column(col, width=width, anchor=tk.CENTER)
+        self.similar_tree.grid(row=3, column=0, columnspan=4, 
+            sticky='nsew', padx=5, pady=5)
+        self.similar_tree.bind('<<TreeviewSelect>>', 
+            lambda _: self.event_generate('<<SimilarSelected>>'))
+
+        # FIND SUBJECT
+        lfrm_find = ttk.LabelFrame(self, text="Find Subject")
+        lfrm_find.grid(row=3, column=0, columnspan=2, **options, 
+            sticky='nsew')
+        lfrm_find.columnconfigure(index=1, weight=1)
+        # Name or address (misspellings are fine)
+        ttk.Label(lfrm_find, text="Name/Address:").grid(row=0, column=0,
+            sticky='e')
+        self.find_var = tk.StringVar()
+        ent_find = ttk.Entry(lfrm_find, textvariable=self.find_var)
+        ent_find.grid(row=0, column=1, sticky='ew', padx=5, pady=5)
+        ent_find.bind('<Return>', 
+            lambda _: self.event_generate('<<BrowseFind>>'))
+        # Search the filtered records only
+        self.find_filtered_var = tk.IntVar(value=0)
+        ttk.Checkbutton(lfrm_find, text="Filtered records only", 
+            variable=self.find_filtered_var, takefocus=0).grid(
+                row=0, column=2, sticky='w', padx=5)
+        ttk.Button(lfrm_find, text="Find", takefocus=0,
+            command=lambda: self.event_generate('<<BrowseFind>>')).grid(
+                row=0, column=3, sticky='e', padx=5, pady=5)
+        # Ranked matches: selecting one shows that subject
+        columns = ('subject_id', 'name', 'address', 'score')
+        self.found_tree = ttk.Treeview(lfrm_find, columns=columns,
+            show='headings', height=5)
+        for col, text, width in zip(columns, 
+            ['Subject ID', 'Name', 'Address', 'Score'], 
+            [90, 150, 250, 60]):
+            self.found_tree.heading(col, text=text)
+            self.found_tree.column(col, width=width, anchor=tk.W)
+        self.found_tree.grid(row=1, column=0, columnspan=4, 
+            sticky='nsew', padx=5, pady=5)
+        self.found_tree.bind('<<TreeviewSelect>>', 
+            lambda _: self.event_generate('<<FoundSelected>>'))
+
+        # Audiogram figure is created on the first subject 
+        # selection (matplotlib is slow to import)
+        self.figure = None
+        self.figure_canvas = None
 
 
     #############
@@ -138,11 +211,66 @@ class BrowseFrame(ttk.Frame):
         
 
     def plot_audio(self):
-        """ Create figure axis for audiogram plot
+        """ Return a cleared figure axis for audiogram plot. The
+            figure is created on the first call and reused after.
         """
-        figure = Figure(figsize=(5, 4), dpi=100)
-        figure_canvas = FigureCanvasTkAgg(figure, self)
-        ax1 = figure.add_subplot()
-        figure_canvas.get_tk_widget().grid(row=10, column=0, columnspan=2, 
-            pady=10, padx=10, sticky='w')
+        if self.figure is None:
+            # Imported on first use to keep startup fast
+            import matplotlib
+            matplotlib.use('TkAgg')
+            from matplotlib.figure import Figure
+            from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
+
+            self.figure = Figure(figsize=(5, 4), dpi=100)
+            self.figure_canvas = FigureCanvasTkAgg(self.figure, self)
+            self.figure_canvas.get_tk_widget().grid(row=10, column=0, 
+                columnspan=2, pady=10, padx=10, sticky='w')
+        else:
+            self.figure.clear()
+
+        ax1 = self.figure.add_subplot()
+        # Redraw once the caller has finished plotting
+        self.figure_canvas.draw_idle()
         return ax1
+
+
+    def show_similar(self, results):
+        """ List similar subjects: a DataFrame of Subject Id, 
+            Distance and Frequencies (see SubDB.similar_subjects)
+        """
+        self.similar_tree.delete(*self.similar_tree.get_children())
+        for sub_id, distance, shared in results.itertuples(index=False):
+            self.similar_tree.insert('', tk.END, 
+                values=(sub_id, f"{distance:.1f}", shared))
+
+
+    def selected_similar(self):
+        """ Return subject ID of the selected similar subject, 
+            or None
+        """
+        for item in self.similar_tree.selection():
+            return int(self.similar_tree.item(item)['values'][0])
+        return None
+
+
+    def show_found(self, results):
+        """ List subjects matching a name/address search: a 
+            DataFrame of Subject Id, Name, Address and Score (see
+            SubDB.find_subjects)
+        """
+        self.found_tree.delete(*self.found_tree.get_children())
+        for sub_id, name, address, score in results.itertuples(
+            index=False):
+            self.found_tree.insert('', tk.END, values=(sub_id, 
+                name if isinstance(name, str) else '', 
+                address if isinstance(address, str) else '',
+                f"{score:.2f}"))
+
+
+    def selected_found(self):
+        """ Return subject ID of the selected search match, 
+            or None
+        """
+        for item in self.found_tree.selection():
+            return int(self.found_tree.item(item)['values'][0])
+        return None
@@ -12,6 +12,11 @@ from tkinter import messagebox
 # Import misc packages
 import uuid
 
+# Import custom modules
+from models import schema
+from models import audio_dict
+from models.predicates import PredicateError, compile_predicate
+
 
 #########
 # BEGIN #
@@ -20,6 +25,9 @@ class FilterFrame(ttk.Frame):
     """ Filtering view for 'Filter' tab of notebook
     """
 
+    # Milliseconds without edits before match counts update
+    preview_delay = 300
+
     def __init__(self, parent, database, filter_dict, *args, **kwargs):
         super().__init__(parent, *args, **kwargs)
 
@@ -29,6 +37,8 @@ class FilterFrame(ttk.Frame):
         # Assign constructor arguments to class variables
         self.filter_dict = filter_dict
         self.db = database
+        # Filter rows as typed (for exporting filter lists)
+        self.filter_values = {}
 
         # Create list of database columns
         self.attributes = list(self.db.data.columns)
@@ -36,7 +46,7 @@ class FilterFrame(ttk.Frame):
 
         # Create list of operators
         self.operators = ["equals", "does not equal", "contains", ">", ">=", 
-            "<", "<="]
+            "<", "<=", "text contains"]
 
 
         #################
@@ -85,8 +95,42 @@ class FilterFrame(ttk.Frame):
             takefocus=0, variable=self.scrub_var).grid(
                 row=0, column=0, sticky='w', padx=5, pady=5)
 
+        # Cancel database load button
+        self.btn_cancel = ttk.Button(frm_options, text="Cancel Load",
+            takefocus=0, state='disabled', 
+            command=lambda: self.event_generate('<<CancelLoad>>'))
+        self.btn_cancel.grid(row=0, column=1, sticky='e', padx=5, pady=5)
+
+        # Audiogram template controls
+        frm_template = ttk.LabelFrame(frm_filter, text="Audiogram Template")
+        frm_template.grid(row=3, column=1, columnspan=3, padx=10, 
+            pady=(10,0), sticky='nsew')
+        ttk.Label(frm_template, text="Template:").grid(row=0, column=0, 
+            sticky='e', padx=5, pady=5)
+        self.template_var = tk.StringVar()
+        cb_template = ttk.Combobox(frm_template, 
+            textvariable=self.template_var, state='readonly', 
+            values=list(audio_dict.templates), width=12, takefocus=0)
+        cb_template.grid(row=0, column=1, sticky='w', padx=5, pady=5)
+        ttk.Label(frm_template, text="Ears:").grid(row=0, column=2, 
+            sticky='e', padx=5, pady=5)
+        self.ears_var = tk.StringVar(value='both')
+        ttk.Combobox(frm_template, textvariable=self.ears_var, 
+            state='readonly', values=['both', 'either', 'right', 'left'],
+            width=8, takefocus=0).grid(row=0, column=3, sticky='w', 
+                padx=5, pady=5)
+        ttk.Label(frm_template, text="Missing:").grid(row=0, column=4, 
+            sticky='e', padx=5, pady=5)
+        self.missing_var = tk.StringVar(value='exclude')
+        ttk.Combobox(frm_template, textvariable=self.missing_var, 
+            state='readonly', values=['exclude', 'ignore'], width=8, 
+            takefocus=0).grid(row=0, column=5, sticky='w', padx=5, pady=5)
+        ttk.Button(frm_template, text="Apply Template", takefocus=0,
+            command=self._do_template).grid(row=0, column=6, sticky='e', 
+                padx=5, pady=5)
+
         # Filter box labels
-        label_text = ['Attribute', 'Operator', 'Value']
+        label_text = ['Attribute', 'Operator', 'Value', 'Matches']
         for idx, label in enumerate(label_text, start=1):
             ttk.Label(frm_filter, text=label).grid(
                 row=5, column=idx, pady=10, sticky='n')
@@ -95,6 +139,22 @@ class FilterFrame(ttk.Frame):
         ttk.Button(frm_filter, text="Filter Records", 
             command=self._do_filter).grid(row=20, column=2, sticky='ew')
 
+        # Boolean filter expression (e.g., "(RightStyle is RIC OR 
+        # LeftStyle is RIC) AND NOT Employment Status = Employee")
+        frm_expression = ttk.LabelFrame(frm_filter, 
+            text="Filter Expression")
+        frm_expression.grid(row=19, column=1, columnspan=3, padx=10,
+            pady=(0,10), sticky='nsew')
+        frm_expression.columnconfigure(index=0, weight=1)
+        self.expression_var = tk.StringVar()
+        ent_expression = ttk.Entry(frm_expression, 
+            textvariable=self.expression_var)
+        ent_expression.grid(row=0, column=0, sticky='ew', padx=5, pady=5)
+        ent_expression.bind('<Return>', lambda _: self._do_expression())
+        ttk.Button(frm_expression, text="Apply Expression", takefocus=0,
+            command=self._do_expression).grid(row=0, column=1, 
+                sticky='e', padx=5, pady=5)
+
         # Text widget for displaying filtering results
         #self.txt_output = tk.Text(frm_filter, height=10)
         #self.txt_output.grid(row=21, column=1, columnspan=4, **options,
@@ -126,6 +186,10 @@ class FilterFrame(ttk.Frame):
         # Value combobox
         self.value_vars = []
         self.value_cbs = []
+        # Live match count labels
+        self.count_vars = []
+        # Pending match count preview (after ID)
+        self._preview_job = None
 
         for ii in range(0, num_fields):
             # Attribute comboboxes:
@@ -174,6 +238,17 @@ class FilterFrame(ttk.Frame):
             # Append combobox to list
             self.value_cbs.append(cb_value)
 
+            # Match count label
+            self.count_vars.append(tk.StringVar())
+            ttk.Label(frm_filter, textvariable=self.count_vars[ii], 
+                width=8, anchor='e').grid(row=6+ii, column=4, 
+                    pady=(0,10), padx=(0,10), sticky='e')
+
+            # Update match counts as the row is edited
+            for var in (self.attrib_vars[ii], self.op_vars[ii],
+                self.value_vars[ii]):
+                var.trace_add('write', self._schedule_preview)
+
 
     #############
     # Functions #
@@ -184,7 +259,8 @@ class FilterFrame(ttk.Frame):
         """
         for ii in range(0, len(self.attrib_cbs)):
             if self.attrib_cbs[ii].get():
-                unique_vals = list(self.db.data[self.attrib_cbs[ii].get()].unique())
+                unique_vals = list(
+                    self.db.column(self.attrib_cbs[ii].get()).dropna().unique())
                 unique_vals.sort()
                 try:
                     unique_vals.remove('-')
@@ -193,22 +269,94 @@ class FilterFrame(ttk.Frame):
                 self.value_cbs[ii]['values'] = unique_vals
 
 
+    def _schedule_preview(self, *_):
+        """ Request match counts once the comboboxes have not
+            changed for preview_delay ms
+        """
+        if self._preview_job is not None:
+            self.after_cancel(self._preview_job)
+        self._preview_job = self.after(self.preview_delay, 
+            self._request_preview)
+
+
+    def _request_preview(self):
+        """ Collect the complete filter rows and ask the controller
+            to count matches
+        """
+        self._preview_job = None
+        self.preview_rows = []
+        for ii in range(0, len(self.attrib_cbs)):
+            try:
+                predicate = self._row_predicate(ii)
+            except (KeyError, ValueError):
+                # Incomplete or invalid value (e.g., while typing)
+                predicate = None
+            if predicate is None:
+                # Counts are cumulative, so stop at the first gap
+                break
+            self.preview_rows.append(predicate)
+        self.show_counts([])
+        if self.preview_rows:
+            self.event_generate('<<FilterPreview>>')
+
+
+    def show_counts(self, counts):
+        """ Display match count after each filter row
+        """
+        for ii, var in enumerate(self.count_vars):
+            var.set(f"{counts[ii]:,}" if ii < len(counts) else '')
+
+
+    def set_loading(self, loading):
+        """ Enable the cancel button while a database is loading
+        """
+        self.btn_cancel['state'] = 'normal' if loading else 'disabled'
+
+
     def _do_filter(self):
         """ Update filter dict based on provided combobox values.
             Send filter event to controller.
         """
         # Get values from all comboboxes
-        self._get_filter_vals()
+        if not self._get_filter_vals():
+            return
         # Send event to controller to filter
         self.event_generate('<<Filter>>')
 
 
+    def _do_template(self):
+        """ Send audiogram template filter event to controller
+        """
+        if not self.template_var.get():
+            messagebox.showerror(title="No Template",
+                message="Please choose an audiogram template!")
+            return
+        self.event_generate('<<FilterTemplate>>')
+
+
+    def _do_expression(self):
+        """ Send filter expression event to controller
+        """
+        if not self.expression_var.get().strip():
+            messagebox.showerror(title="No Expression",
+                message="Please type a filter expression!",
+                detail="For example: (RightStyle is RIC OR LeftStyle " +
+                    "is RIC) AND NOT Employment Status = Employee")
+            return
+        self.event_generate('<<FilterExpression>>')
+
+
     def _get_filter_vals(self):
         """ Create a dictionary of filter values from combobox values. 
-            Check for missing values and skipped rows.
+            Check for missing values and skipped rows. Returns 
+            False if the values are incomplete.
         """
         all_data = []
         self.txt_output.delete('1.0', tk.END)
+        # Rebuild in place (shared with the controller), so rows
+        # removed since the last filter are dropped
+        self.filter_dict.clear()
+        self.filter_values.clear()
 
         for ii in range(0, len(self.attrib_cbs)):
             # Check for any empty values in a given row
@@ -229,40 +377,24 @@ class FilterFrame(ttk.Frame):
                         detail="Please provide all filter parameters " +
                             "for a given row."
                     )
-                    return
+                    return False
             else:
-                # Create list from values if 'contains' operator
-                # Create new 'value' variable because tk.StringVar
-                # cannot hold a list
-                if self.op_vars[ii].get() == "contains":
-                    value = self.value_vars[ii].get().split()
-                else:
-                    value = self.value_vars[ii].get()
-
-
-                ###############################
-                # Patch for Subject Id #
-                ###############################
-                if self.attrib_vars[ii].get() == 'Subject Id':
-                    if isinstance(value, str):
-                        value = int(value)
-                    elif isinstance(value, list):
-                        value = [int(x) for x in value]
-                ###################################
-                # End Patch for Subject Id #
-                ###################################
-
-
                 # If all values are present in a given row, append to list
-                all_data.append((
-                    self.attrib_vars[ii].get(), 
-                    self.op_vars[ii].get(), 
-                    #self.value_vars[ii].get()
-                    value
-                ))
+                try:
+                    all_data.append(self._row_predicate(ii))
+                except (KeyError, PredicateError) as e:
+                    # Reject values that do not fit the attribute
+                    # before anything is filtered
+                    messagebox.showerror(title="Invalid Filter",
+                        message=f"Filter row {ii + 1} is not valid!",
+                        detail=str(e).strip("'") if isinstance(e,
+                            PredicateError) else f"Unknown attribute: {e}"
+                    )
+                    return False
                 try:
                     # Update dictionary with list by index
                     self.filter_dict[ii] = all_data[ii]
+                    self.filter_values[ii] = self._row_values(ii)
                 except IndexError:
                     # If indexes do not match, there was an empty row 
                     # between rows with values: display message and 
@@ -272,15 +404,51 @@ class FilterFrame(ttk.Frame):
                         detail="There cannot be empty rows between rows " +
                             "with values."
                     )
-                    return
+                    return False
+        return True
+
+
+    def _row_values(self, ii):
+        """ Return (attribute, operator, value) for filter row ii 
+            as typed. 'contains' values are split into a list.
+        """
+        operator = self.op_vars[ii].get()
+        value = self.value_vars[ii].get()
+        if operator == 'contains':
+            value = value.split()
+        return (self.attrib_vars[ii].get(), operator, value)
+
+
+    def _row_predicate(self, ii):
+        """ Return (attribute, operator, value) for filter row ii,
+            with the value converted to the attribute's type, or 
+            None if any part is empty. Raises PredicateError (a 
+            ValueError) if the value does not fit the attribute, 
+            and KeyError for an unknown attribute.
+        """
+        attrib = self.attrib_vars[ii].get()
+        operator = self.op_vars[ii].get()
+        value = self.value_vars[ii].get()
+        if not (attrib and operator and value):
+            return None
+        if attrib not in schema.fields:
+            raise KeyError(attrib)
+
+        # 'contains' values are separated by spaces
+        return compile_predicate(attrib, operator, value)
 
 
     def _clear_filters(self):
         """ Clear all values from the filter comboboxes.
             Reset filter dict to empty.
         """
-        # Clear out current filter dict
-        self.filter_dict = {}
+        # Clear out current filter dict (in place: shared with the
+        # controller)
+        self.filter_dict.clear()
+        self.filter_values.clear()
+        self.expression_var.set('')
+        self.preview_rows = []
+        self.show_counts([])
         # Delete any output from textbox
         self.txt_output.delete('1.0', tk.END)
         # Clear all combobox values
@@ -23,7 +23,7 @@ class SubjectTree(tk.Frame):
         """ Create tree widget from database
         """
         # Get subs from dataframe
-        subjects = self.db.data['Subject Id']
+        subjects = self.db.column('Subject Id')
         columns = ('subject_id')
         self.tree = ttk.Treeview(self, columns=columns, show='headings', height=20, style='new.Treeview')
         self.tree.column("# 1", width=100, anchor=tk.CENTER)
@@ -36,11 +36,25 @@ class SubjectTree(tk.Frame):
         self.tree.configure(yscroll=self.scrollbar.set)
         self.scrollbar.grid(row=0, rowspan=10, column=1, sticky='ns')
 
-        # Add subjects to tree
+        # Add subjects to tree (item IDs by subject for select())
+        self.items = {}
         for subject in subjects:
-            self.tree.insert('', tk.END, values=subject)
+            self.items[subject] = self.tree.insert('', tk.END, 
+                values=subject)
 
 
     def _item_selected(self, *args):
         """ Trigger event that tree item was selected """
         self.event_generate('<<TreeviewSelect>>')
+
+
+    def select(self, sub_id):
+        """ Select and scroll to subject sub_id. Returns False if 
+            the subject is not in the tree (e.g., filtered out).
+        """
+        item = self.items.get(sub_id)
+        if item is None:
+            return False
+        self.tree.selection_set(item)
+        self.tree.see(item)
+        return True